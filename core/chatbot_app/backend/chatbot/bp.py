@@ -1,8 +1,15 @@
 import os
 import uuid
-import mimetypes
 import traceback
-from flask import Blueprint, request, jsonify, send_from_directory, abort, current_app
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import Blueprint, request, jsonify, send_file, send_from_directory, abort, current_app
+from utils.sprite_index import get_sprite_index
+from utils.image_asset_service import ImageAssetService, IMMUTABLE_CACHE_CONTROL
+from utils.image_variants import ImageVariantCache
+from utils.blob_store import ContentAddressedStore
+from utils.chat_history_log import ChatHistoryLog
 
 try:
     from chatbot_override import get_role_desc, get_image_file_path
@@ -19,9 +26,15 @@ except NotImplementedError as e:
 
 bp = Blueprint('chatbot', __name__, template_folder='templates')
 
-current_history = []
+# UI-facing history of the current session; entries carry a seq for cursor paging via /history
+current_history = ChatHistoryLog()
 current_round = 0
-image_token_map = {}
+image_assets = ImageAssetService()
+# request id -> Future of the character image tokens selected for a reply
+image_jobs = OrderedDict()
+image_jobs_lock = threading.Lock()
+MAX_IMAGE_JOBS = 32
+MAX_HISTORY_PAGE_SIZE = 500
 default_character_image_path = "path/to/image"
 default_character_image_token = "virtual/path/to/image"
 default_background_image_token = "path/to/image"
@@ -41,30 +54,91 @@ def create_chatbot_blueprint(chatbot_config):
     os.makedirs(upload_folder_path_global, exist_ok=True)
     print(f"Chatbot uploads directory configured at: {upload_folder_path_global}")
 
+    # Uploads are stored once per content digest; the current background keeps its blob alive
+    upload_extensions = ('png', 'jpg', 'jpeg', 'gif', 'webp')
+    upload_store = ContentAddressedStore(upload_folder_path_global, upload_extensions,
+                                         grace_seconds=chatbot_config.get('UPLOAD_GC_GRACE_SECONDS', 86400))
+    removed_uploads = upload_store.gc()
+    if removed_uploads:
+        print(f"Removed {len(removed_uploads)} unreferenced upload(s) from {upload_folder_path_global}")
+
+    # Runs the user's get_role_desc while the chatbot persists the previous turn and retrieves memories
+    role_desc_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="role-desc")
+
+    # Character images are selected off the request thread; clients poll /character_images
+    async_image_selection = chatbot_config.get('ASYNC_IMAGE_SELECTION', True)
+    image_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-select")
+
+    sprite_dir = chatbot_config.get('SPRITE_DIR', '')
+    if sprite_dir and os.path.isdir(sprite_dir):
+        try:
+            # Warm the shared index so get_image_file_path implementations get O(1) tag lookups
+            sprite_index = get_sprite_index(sprite_dir)
+            print(f"Sprite index built for {sprite_dir}: {len(sprite_index)} tags.")
+        except Exception as e:
+            print(f"Warning: could not build sprite index for {sprite_dir}: {e}")
+
     default_character_image_path = chatbot_config.get('DEFAULT_IMAGE', '')
     default_background_image_path = chatbot_config.get('DEFAULT_BG_IMAGE', '')
 
-    def _generate_image_token(file_path):
-        """Generates a unique token for a given file path and stores the mapping."""
-        global image_token_map
+    image_assets.max_entries = chatbot_config.get('IMAGE_TOKEN_CACHE_SIZE', image_assets.max_entries)
+    # Resized / WebP / AVIF variants requested through /serve_image?w=&h=&format= or Accept (needs Pillow)
+    image_variants = ImageVariantCache(chatbot_config.get('IMAGE_VARIANT_DIR', ''),
+                                       enabled=chatbot_config.get('IMAGE_VARIANTS', True))
+    if chatbot_config.get('IMAGE_VARIANTS', True) and not image_variants.enabled:
+        print("INFO: Image variants disabled (Pillow not installed or IMAGE_VARIANT_DIR not set); serving originals.")
+
+    def _generate_image_token(file_path, pin=False):
+        """Returns the content-hash serve token for a file path (None if it is invalid or missing).
+        Pinned tokens are never evicted from the token table."""
         if not file_path or not isinstance(file_path, str):
             print(f"Warning: Invalid file_path received by _generate_image_token: {file_path}")
             return None
-        normalized_path = os.path.abspath(file_path)
-        for token, path_info in image_token_map.items():
-            if path_info['abs_path'] == normalized_path:
-                return token
-
-        token = str(uuid.uuid4())
-        image_token_map[token] = {'abs_path': normalized_path, 'orig_path': file_path}
-        print(f"Generated token {token} for path: {normalized_path}")
+        token = image_assets.token_for(file_path, pin=pin)
+        if token is None:
+            print(f"Warning: Image file not found for path: {file_path}")
         return token
 
-    default_character_image_token = _generate_image_token(default_character_image_path)
-    default_background_image_token = _generate_image_token(default_background_image_path)
+    def _select_image_tokens(response):
+        """Runs get_image_file_path for a reply and returns serve tokens for the paths."""
+        image_paths = get_image_file_path(response)
+        if not isinstance(image_paths, list):
+            print(f"Warning: get_image_file_path did not return a list. Received: {image_paths}")
+            image_paths = [image_paths] if image_paths else []
+        return [_generate_image_token(path) for path in image_paths if path]
+
+    def _image_payload(response):
+        """
+        Image part of a reply payload. With async selection the reply is returned at once
+        with an imageRequestId; the tokens are fetched from /character_images.
+        """
+        if not async_image_selection:
+            return {"characterImageTokens": _select_image_tokens(response)}
+        request_id = uuid.uuid4().hex
+        future = image_executor.submit(_select_image_tokens, dict(response))
+        with image_jobs_lock:
+            image_jobs[request_id] = future
+            while len(image_jobs) > MAX_IMAGE_JOBS:
+                image_jobs.popitem(last=False)
+        return {"imageRequestId": request_id}
+
+    # Issued once and handed to every client via /config, so they must outlive LRU eviction
+    default_character_image_token = _generate_image_token(default_character_image_path, pin=True)
+    default_background_image_token = _generate_image_token(default_background_image_path, pin=True)
 
     print(f"Default character image token set to: {default_character_image_token}")
 
+    history_page_size = chatbot_config.get('HISTORY_PAGE_SIZE', 50)
+
+    def _history_page(args):
+        """A page of current_history for the after / before / limit / epoch query args (ValueError if malformed)."""
+        def _seq(name):
+            value = args.get(name)
+            return int(value) if value not in (None, '') else None
+        limit = min(max(_seq('limit') or history_page_size, 1), MAX_HISTORY_PAGE_SIZE)
+        return current_history.page(after=_seq('after'), before=_seq('before'), limit=limit,
+                                    epoch=args.get('epoch') or None)
+
     def _ensure_chatbot_active():
         """Helper to check if chatbot is active and instance exists."""
         global current_history, current_round  # For resetting UI session state
@@ -112,32 +186,50 @@ def create_chatbot_blueprint(chatbot_config):
 
     @bp.route('/serve_image', methods=['GET'])
     def serve_image_by_token():
-        """Serves an image file based on a token."""
-        global image_token_map
+        """
+        Serves an image file based on a token. Tokens are content hashes, so responses are
+        cacheable forever and a matching If-None-Match is answered 304 without touching the disk.
+
+        Optional w / h (bounding box in pixels) and format (avif, webp, png, jpeg) query params,
+        or an Accept header listing image/avif or image/webp, select a downscaled / re-encoded
+        variant that is generated on first request and cached on disk.
+        """
         token = request.args.get('token')
         if not token:
             abort(400, "Missing image token")
 
-        path_info = image_token_map.get(token)
-        if not path_info:
+        asset = image_assets.resolve(token)
+        if not asset:
             abort(404, "Image token not found")
 
-        file_path = path_info['abs_path']
+        spec = image_variants.negotiate(request.args.get('w'), request.args.get('h'),
+                                        request.args.get('format'), request.headers.get('Accept', ''))
+        etag = image_variants.etag(asset.token, spec) if spec else asset.etag
+
+        def _with_cache_headers(response):
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+            if spec is not None and spec.negotiated:
+                response.vary.add('Accept')
+            return response
+
+        if etag in request.if_none_match:
+            return _with_cache_headers(current_app.response_class(status=304))
 
-        if not os.path.exists(file_path):
-            print(f"Error: File not found for token {token} at path {file_path}")
+        if not image_assets.is_current(asset):
+            print(f"Error: File for token {token} changed or was removed: {asset.abs_path}")
             abort(404, "Image file not found on server")
 
         try:
-            directory, filename = os.path.split(file_path)
-            mime_type, _ = mimetypes.guess_type(file_path)
-            if mime_type is None:
-                mime_type = 'application/octet-stream'
-
-            return send_from_directory(directory, filename, mimetype=mime_type)
+            file_path, mimetype = asset.abs_path, asset.mimetype
+            variant = image_variants.get(asset.token, asset.abs_path, spec)
+            if variant is not None:
+                file_path, mimetype = variant[0], variant[1] or asset.mimetype
+            response = send_file(file_path, mimetype=mimetype, etag=etag, conditional=True)
+            return _with_cache_headers(response)
 
         except Exception as e:
-            print(f"Error serving image file {file_path} for token {token}: {e}")
+            print(f"Error serving image file {asset.abs_path} for token {token}: {e}")
             abort(500, "Error serving image file")
 
     @bp.route('/chat', methods=['POST'])
@@ -153,15 +245,16 @@ def create_chatbot_blueprint(chatbot_config):
             app_config = current_app.config.get('APP_CONFIG', {})
             chatbot_kwargs = app_config.get('CHATBOT', {})
 
-            role_description = get_role_desc(current_round, user_input, **chatbot_kwargs.get("ROLE_CONFIG", {}))
+            chat_config = chatbot_kwargs.get("CHAT_CONFIG", {})
+            role_config = chatbot_kwargs.get("ROLE_CONFIG", {})
+            if chat_config.get("pipelined_turn", True):
+                # The chatbot resolves the future only when it assembles the task prompt
+                role_description = role_desc_executor.submit(get_role_desc, current_round, user_input, **role_config)
+            else:
+                role_description = get_role_desc(current_round, user_input, **role_config)
             response = chatbot_instance.chat(user_input=user_input, role_description=role_description,
-                                             **chatbot_kwargs.get("CHAT_CONFIG", {}))
-            image_paths = get_image_file_path(response)
-            if not isinstance(image_paths, list):
-                print(f"Warning: get_image_file_path did not return a list. Received: {image_paths}")
-                image_paths = [image_paths] if image_paths else []
-
-            image_serve_tokens = [_generate_image_token(path) for path in image_paths if path]
+                                             **chat_config)
+            image_payload = _image_payload(response)
             current_user_name = getattr(chatbot_instance, 'user', 'User')
             current_role_name = getattr(chatbot_instance, 'role', 'Assistant')
 
@@ -180,7 +273,7 @@ def create_chatbot_blueprint(chatbot_config):
 
             return jsonify({
                 "response": response,
-                "characterImageTokens": image_serve_tokens
+                **image_payload
             })
 
         except NotImplementedError as e:
@@ -192,20 +285,45 @@ def create_chatbot_blueprint(chatbot_config):
             traceback.print_exc()
             return jsonify({"error": "An error occurred during chat.", "details": str(e)}), 500  # [cite: 12]
 
+    @bp.route('/character_images', methods=['GET'])
+    def character_images_endpoint():
+        """
+        Long-polls the character images selected for a reply. Waits up to `timeout`
+        seconds (default 10, at most 30) and answers 202 while selection is still running.
+        """
+        request_id = request.args.get('request_id')
+        if not request_id:
+            return jsonify({"error": "request_id is required"}), 400
+        with image_jobs_lock:
+            future = image_jobs.get(request_id)
+        if future is None:
+            return jsonify({"error": "Unknown or expired image request"}), 404
+        try:
+            timeout = min(max(float(request.args.get('timeout', 10)), 0), 30)
+        except ValueError:
+            return jsonify({"error": "timeout must be a number"}), 400
+        try:
+            tokens = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return jsonify({"status": "pending"}), 202
+        except NotImplementedError as e:
+            return jsonify({"error": f"Chatbot function not implemented: {e}"}), 500
+        except Exception as e:
+            print(f"Error selecting character images: {e}")
+            return jsonify({"error": "An error occurred during image selection.", "details": str(e)}), 500
+        return jsonify({"status": "ready", "characterImageTokens": tokens})
+
     @bp.route('/refresh', methods=['POST'])
     def refresh_endpoint():
         chatbot_instance = _ensure_chatbot_active()
-        global image_token_map
         try:
             app_config = current_app.config.get('APP_CONFIG', {})
             chatbot_kwargs = app_config.get('CHATBOT', {})
             response = chatbot_instance.refresh_output(**chatbot_kwargs.get("CHAT_CONFIG", {}))
             if not response:
                 return jsonify({"error": f"There is no input or no response."}), 400
-            image_paths = get_image_file_path(response)
-            if not isinstance(image_paths, list): image_paths = [image_paths] if image_paths else []
-            image_serve_tokens = [_generate_image_token(path) for path in image_paths if path]
-            return jsonify({"response": response, "characterImageTokens": image_serve_tokens})
+            image_payload = _image_payload(response)
+            return jsonify({"response": response, **image_payload})
         except NotImplementedError as e:
             return jsonify({"error": f"Chatbot function not implemented: {e}"}), 500
         except Exception as e:
@@ -216,7 +334,7 @@ def create_chatbot_blueprint(chatbot_config):
     @bp.route('/update_input', methods=['POST'])
     def update_input_endpoint():
         chatbot_instance = _ensure_chatbot_active()
-        global current_history, image_token_map
+        global current_history
         current_user_name = getattr(chatbot_instance, 'user', 'User')
         if not current_history or len(current_history) < 2: return jsonify({"error": "Need history"}), 400
         if current_history[-2].get("role") != current_user_name: return jsonify({"error": "Last msg not user"}), 400
@@ -231,11 +349,9 @@ def create_chatbot_blueprint(chatbot_config):
             response = chatbot_instance.update_input(user_input=new_user_input, **chatbot_kwargs.get("CHAT_CONFIG", {}))
             if not response:
                 return jsonify({"error": f"There is no input or no response."}), 400
-            image_paths = get_image_file_path(response)
-            if not isinstance(image_paths, list): image_paths = [image_paths] if image_paths else []
-            image_serve_tokens = [_generate_image_token(path) for path in image_paths if path]
+            image_payload = _image_payload(response)
 
-            current_history = current_history[:-2]
+            current_history.truncate(len(current_history) - 2)
             current_history.append({"role": current_user_name, "content": new_user_input})
             current_role_name = getattr(chatbot_instance, 'role', 'Assistant')
             response_entry = {"role": response.get("role", current_role_name), "content": response.get("content", ""),
@@ -244,7 +360,7 @@ def create_chatbot_blueprint(chatbot_config):
                 if key not in response_entry: response_entry[key] = value
             current_history.append(response_entry)
 
-            return jsonify({"response": response, "characterImageTokens": image_serve_tokens})
+            return jsonify({"response": response, **image_payload})
         except NotImplementedError as e:
             return jsonify({"error": f"Chatbot function not implemented: {e}"}), 500
         except Exception as e:
@@ -280,7 +396,7 @@ def create_chatbot_blueprint(chatbot_config):
 
     @bp.route('/start_new_session', methods=['POST'])
     def start_new_session_endpoint():
-        global current_history, current_round, image_token_map
+        global current_history, current_round
         with current_app.config['CHATBOT_STATUS_LOCK']:
             current_status = current_app.config.get('CHATBOT_STATUS')
             shared_chatbot_instance = current_app.config.get('SHARED_CHATBOT_INSTANCE')
@@ -315,7 +431,7 @@ def create_chatbot_blueprint(chatbot_config):
     @bp.route('/resume_session', methods=['POST'])
     def resume_session_endpoint():
         chatbot_instance = _ensure_chatbot_active()
-        global current_history, current_round, image_token_map
+        global current_history, current_round
         # if chatbot_instance is None:
         #     chatbot_instance = _ensure_chatbot_active()
         if chatbot_instance is None: return jsonify({"error": "Chatbot not initialized."}), 500
@@ -331,10 +447,11 @@ def create_chatbot_blueprint(chatbot_config):
             if messages is None: return jsonify(
                 {"error": f"Session {session_id} not found or could not be resumed."}), 404
 
-            current_history = messages
+            current_history.replace(messages)
             current_user_name = getattr(chatbot_instance, 'user', 'User')
-            current_round = sum(1 for msg in current_history if msg.get("role") == current_user_name)
-            return jsonify({"history": messages})
+            current_round = sum(1 for msg in messages if msg.get("role") == current_user_name)
+            # Only the most recent page is sent; older entries are paged in through /history?before=
+            return jsonify(current_history.page(limit=history_page_size))
         except Exception as e:
             print(f"Error resuming session {session_id}: {e}")
             traceback.print_exc()
@@ -343,12 +460,12 @@ def create_chatbot_blueprint(chatbot_config):
     @bp.route('/clear_current_session', methods=['POST'])
     def clear_current_session_endpoint():
         chatbot_instance = _ensure_chatbot_active()
-        global current_history, current_round, image_token_map
+        global current_history, current_round
         try:
             app_config = current_app.config.get('APP_CONFIG', {})
             chatbot_kwargs = app_config.get('CHATBOT', {})
             chatbot_instance.clear_current_session(**chatbot_kwargs.get("CHAT_CONFIG", {}))
-            current_history = []
+            current_history.clear()
             current_round = 0
             return jsonify({"status": "Current session cleared"})
         except Exception as e:
@@ -358,7 +475,7 @@ def create_chatbot_blueprint(chatbot_config):
 
     @bp.route('/close', methods=['POST'])
     def close_endpoint():
-        global image_token_map, current_round, current_history
+        global current_round, current_history
         with current_app.config['CHATBOT_STATUS_LOCK']:
             chatbot_instance = current_app.config.get('SHARED_CHATBOT_INSTANCE')
             current_status = current_app.config.get('CHATBOT_STATUS')
@@ -386,8 +503,24 @@ def create_chatbot_blueprint(chatbot_config):
 
     @bp.route('/history', methods=['GET'])
     def get_history_endpoint():
-        global current_history
-        return jsonify({"history": current_history.copy()})
+        """
+        Cursor-paged history. ?after=<seq> returns entries newer than seq (incremental sync),
+        ?before=<seq> older ones, neither the latest page; limit defaults to HISTORY_PAGE_SIZE.
+        Pass the epoch from the previous response: if the history was rewritten since, the
+        latest page comes back with "reset": true.
+        """
+        try:
+            return jsonify(_history_page(request.args))
+        except ValueError:
+            return jsonify({"error": "after, before and limit must be integers"}), 400
+
+    @bp.route('/metrics', methods=['GET'])
+    def get_metrics_endpoint():
+        """Returns runtime metrics (retrieval cache hit rate, ...) of the shared chatbot."""
+        shared_chatbot_instance = current_app.config.get('SHARED_CHATBOT_INSTANCE')
+        if shared_chatbot_instance is None:
+            return jsonify({"error": "Chatbot is not initialized"}), 503
+        return jsonify(shared_chatbot_instance.get_metrics())
 
     @bp.route('/background_upload', methods=['POST'])
     def background_upload():
@@ -398,24 +531,21 @@ def create_chatbot_blueprint(chatbot_config):
         file = request.files['background']
         if file.filename == '': return jsonify({"error": "No selected file"}), 400
 
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
         file_ext = file.filename.split('.')[-1].lower() if '.' in file.filename else ''
-        if file_ext not in allowed_extensions: return jsonify({"error": "Invalid file type"}), 400
+        if file_ext not in upload_extensions: return jsonify({"error": "Invalid file type"}), 400
 
         try:
-            unique_filename = f"{uuid.uuid4().hex}.{file_ext}"
-            filepath = os.path.join(upload_folder_path_global, unique_filename)
-
-            chunk_size = 1024 * 64
-            with open(filepath, 'wb') as f:
-                while True:
-                    chunk = file.stream.read(chunk_size)
-                    if not chunk: break
-                    f.write(chunk)
-
-            file_url = f'/api/chatbot/uploads/{unique_filename}'
-            print(f"File uploaded to {filepath}, accessible via {file_url}")
-            return jsonify({"url": file_url, "message": "File uploaded successfully"})
+            blob = upload_store.put_stream(file.stream, file_ext)
+            upload_store.set_ref('background', blob.filename)
+            upload_store.gc()
+
+            file_url = f'/api/chatbot/uploads/{blob.filename}'
+            if blob.deduplicated:
+                print(f"Upload matches existing file {blob.path}, accessible via {file_url}")
+            else:
+                print(f"File uploaded to {blob.path}, accessible via {file_url}")
+            return jsonify({"url": file_url, "deduplicated": blob.deduplicated,
+                            "message": "File uploaded successfully"})
 
         except Exception as e:
             print(f"Error saving uploaded file: {str(e)}")
@@ -430,7 +560,17 @@ def create_chatbot_blueprint(chatbot_config):
             safe_path = os.path.abspath(os.path.join(upload_folder_path_global, filename))
             if not safe_path.startswith(os.path.abspath(upload_folder_path_global)):
                 abort(400, "Invalid file path")
-            return send_from_directory(upload_folder_path_global, filename)
+            digest = upload_store.digest_of(filename)
+            if digest is None:
+                return send_from_directory(upload_folder_path_global, filename)
+            # Blob names are content digests, so the bytes behind a URL never change
+            if digest in request.if_none_match:
+                response = current_app.response_class(status=304)
+            else:
+                response = send_from_directory(upload_folder_path_global, filename, etag=digest)
+            response.set_etag(digest)
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+            return response
         except FileNotFoundError:
             abort(404)
         except Exception as e:
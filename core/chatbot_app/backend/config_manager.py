@@ -13,11 +13,19 @@ DEFAULT_CONFIG = {
     "CHATBOT": {
         "DEFAULT_IMAGE": "{DATA_DIR}/images/default_character.png",
         "UPLOAD_FOLDER_RELATIVE": "uploads",
+        "UPLOAD_GC_GRACE_SECONDS": 86400, # Uploads stored by content hash; ones no longer referenced are deleted after this long
+        "SPRITE_DIR": "{DATA_DIR}/images", # Character sprites indexed by tag for get_image_file_path
+        "IMAGE_TOKEN_CACHE_SIZE": 512, # Image serve tokens kept (LRU); the default character/background tokens are pinned, others are re-issued unchanged when their image is selected again
+        "IMAGE_VARIANTS": True, # Serve resized / WebP / AVIF sprite variants on request (needs Pillow)
+        "IMAGE_VARIANT_DIR": "{DATA_DIR}/image_variants", # Disk cache for generated variants
+        "HISTORY_PAGE_SIZE": 50, # Entries per /history page; resuming a session loads only the latest page
+        "ASYNC_IMAGE_SELECTION": True, # Return replies before get_image_file_path finishes; the frontend polls /character_images
         "INIT_CONFIG": {
             "base_url": None,
             "api_key": None,
             "memory_db_path": "{DATA_DIR}/memory.db",
-            "role_graph_path": "{DATA_DIR}/graph_data.json"
+            "role_graph_path": "{DATA_DIR}/graph_data.json",
+            "character_bundle_dir": "{DATA_DIR}/bundles"
         },
         "CHAT_CONFIG": {
             "summarizing_prompt":
@@ -31,7 +39,37 @@ DEFAULT_CONFIG = {
             "attr_contradict_threshold": 0.58,
             "attr_entailment_threshold": 0.7,
             "recall_attr_threshold": 0.65,
-            "recall_style_threshold": 0.7
+            "recall_style_threshold": 0.7,
+            "style_max_exemplars": 3, # Standard answers quoted as style exemplars per turn
+            "style_max_tokens": 256, # Hard cap on the (estimated) size of the style section
+            "hybrid_memory_retrieval": True, # Fuse char n-gram BM25 hits over memory content with vector results (RRF)
+            "memory_lexical_min_coverage": 0.2, # idf-weighted share of the input a BM25-only hit must cover
+            "memory_rrf_k": 60,
+            "drop_context_overlap": True, # Skip recalled units that are already in the context window
+            "memory_mmr": True, # Maximal-marginal-relevance selection over recalled memory groups
+            "memory_mmr_lambda": 0.5, # 1.0 = relevance only, lower values favour diversity
+            "memory_mmr_overfetch": 2, # Candidates fetched per kept group before MMR selection
+            "retrieval_cache": True, # Reuse STM/LTM query results across turns; LTM entries survive until a summary, session switch or memory edit
+            "rolling_summary": True, # Fold turns leaving the context window into a running session summary in the background; only runs in "compressed" context_mode or when the memory system accepts external summaries
+            "rolling_summary_interval": 4, # Evicted turns collected before each background fold (K)
+            "context_mode": "window", # "window": last max_context_length turns verbatim; "compressed": recent turns + running summary
+            "context_verbatim_turns": 6, # Turns kept verbatim in "compressed" mode
+            "context_max_key_facts": 12, # Key facts from the running summary included in "compressed" mode
+            "output_mode": "full", # "full": desc+think+speak; "delta": speak first, scene delta, optional think; "lean": speak + scene delta
+            "scene_desc_max_chars": 800, # Bound on the locally merged scene description in "delta"/"lean" modes
+            "json_mode": False, # Ask the provider for JSON output (response_format); turned off automatically if unsupported
+            "pipelined_turn": True, # Run get_role_desc, previous-turn persistence, embedding and retrieval concurrently before the LLM call
+            "reply_cache": False, # Reuse stored replies for near-identical inputs within the same session and role description
+            "reply_cache_threshold": 0.95, # Cosine similarity an input must reach to count as a repeat
+            "reply_cache_ttl": 1800, # Seconds a stored reply stays reusable
+            "reply_cache_min_variants": 2, # Distinct replies collected for an input before any is reused
+            "reply_cache_max_variants": 4, # Replies kept per input; the oldest is replaced
+            "reply_cache_max_uses": 3, # Times a single stored reply may be served
+            "lexical_query_match": True, # Resolve concepts from literal standard query / attribute name hits before embedding search
+            "lexical_min_pattern_len": 2, # Shorter literal hits are not trusted
+            "lexical_confident_pattern_len": 4, # Shorter attribute / role name hits are merged with the embedding result instead of replacing it
+            "concept_classifier": False, # Match inputs against per-concept prototypes instead of every standard query (approximate)
+            "concept_classifier_margin": 0.05 # Inputs this close to a prototype's T x c threshold (a heuristic, not a calibration) fall back to the exhaustive scan
         }
     },
     "MEMORY_EDITOR": {
@@ -40,7 +78,9 @@ DEFAULT_CONFIG = {
     },
     "ROLE_GRAPH": {
         "DATA_PATH": "{DATA_DIR}/graph_data.json", # Path for role_graph data
-        "OUTPUT_DIR": "{DATA_DIR}/queries"
+        "OUTPUT_DIR": "{DATA_DIR}/queries",
+        "JOURNAL_COMPACT_THRESHOLD": 256, # Journaled edits before the snapshot is rewritten
+        "JOURNAL_COMPACT_INTERVAL": 30.0 # Seconds between background compaction checks
     },
     "STANDARD_QUERY": {
         "GRAPH_PATH": "{DATA_DIR}/graph_data.json", # Path to role_graph data
@@ -49,6 +89,15 @@ DEFAULT_CONFIG = {
     "STANDARD_ANSWER": {
         "GRAPH_PATH": "{DATA_DIR}/graph_data.json", # Path to role_graph data
         "OUTPUT_DIR": "{DATA_DIR}/qna_data"       # Path for standard_answer data
+    },
+    "CHARACTER_BUNDLE": {
+        "OUTPUT_DIR": "{DATA_DIR}/bundles", # Compiled character bundles (bundle_<role>.ccb)
+        "GRAPH_PATH": "{DATA_DIR}/graph_data.json",
+        "QUERIES_DIR": "{DATA_DIR}/queries",
+        "QNA_DIR": "{DATA_DIR}/qna_data",
+        "AUTO_COMPILE": True, # Recompile bundles in the background after editor saves
+        "COMPILE_DELAY": 2.0, # Seconds without further edits before recompiling
+        "EMBEDDING_MODEL": None # Optional tag; bundles built with another model tag are rebuilt from scratch
     }
 }
 
@@ -228,6 +228,12 @@ def run_flask_app():
             f"Relative path to the character data directory (e.g., {CHARACTERS_BASE_DIR_NAME}/{DEFAULT_CHARACTER_DIR_NAME}) "
             f"from the application root ({PROJECT_ROOT_PATH}). Defaults to using '{DEFAULT_CHARACTER_DIR_NAME}'.")
     )
+    parser.add_argument(
+        "--compile-bundle",
+        nargs="+",
+        metavar="ROLE",
+        help="Compile the character bundle for the given role(s) into CHARACTER_BUNDLE.OUTPUT_DIR and exit."
+    )
     args = parser.parse_args()
 
     selected_character_relative_path = args.character_dir
@@ -264,6 +270,11 @@ def run_flask_app():
                     ("STANDARD_QUERY", "OUTPUT_DIR"): "{DATA_DIR}/queries",
                     ("STANDARD_ANSWER", "GRAPH_PATH"): "{DATA_DIR}/graph_data.json",
                     ("STANDARD_ANSWER", "OUTPUT_DIR"): "{DATA_DIR}/qna_data",
+                    ("CHATBOT", "INIT_CONFIG", "character_bundle_dir"): "{DATA_DIR}/bundles",
+                    ("CHARACTER_BUNDLE", "OUTPUT_DIR"): "{DATA_DIR}/bundles",
+                    ("CHARACTER_BUNDLE", "GRAPH_PATH"): "{DATA_DIR}/graph_data.json",
+                    ("CHARACTER_BUNDLE", "QUERIES_DIR"): "{DATA_DIR}/queries",
+                    ("CHARACTER_BUNDLE", "QNA_DIR"): "{DATA_DIR}/qna_data",
                 }
                 for keys, new_value_template in path_keys_to_update.items():
                     temp_dict = char_default_config
@@ -313,7 +324,8 @@ def run_flask_app():
         sys.exit(1)
 
     should_initialize_globally = not config.get('DEBUG', False) \
-                                 or os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+                                 or os.environ.get("WERKZEUG_RUN_MAIN") == "true" \
+                                 or bool(args.compile_bundle)
 
     if should_initialize_globally:
         logger.info("Attempting global RPCharacterChatbot initialization...")
@@ -353,6 +365,32 @@ def run_flask_app():
         logger.info("Skipping global RPCharacterChatbot initialization (likely Flask reloader). Status: 'uninitialized'.")
         app.config['CHATBOT_STATUS'] = 'active'
 
+    from utils.character_bundle import CharacterBundleCompiler
+    bundle_config = config.get('CHARACTER_BUNDLE', {})
+    app.config['CHARACTER_BUNDLE_COMPILER'] = CharacterBundleCompiler(
+        output_dir=bundle_config.get('OUTPUT_DIR', os.path.join(config.get('DATA_DIR', ''), 'bundles')),
+        graph_path=bundle_config.get('GRAPH_PATH', config.get('ROLE_GRAPH', {}).get('DATA_PATH', '')),
+        queries_dir=bundle_config.get('QUERIES_DIR', config.get('STANDARD_QUERY', {}).get('OUTPUT_DIR', '')),
+        qna_dir=bundle_config.get('QNA_DIR', config.get('STANDARD_ANSWER', {}).get('OUTPUT_DIR', '')),
+        embed_provider=lambda: getattr(app.config.get('SHARED_MEMORY_SYSTEM'), 'get_embedding', None),
+        embedding_model=bundle_config.get('EMBEDDING_MODEL'),
+        delay=bundle_config.get('COMPILE_DELAY', 2.0)
+    ) if bundle_config.get('AUTO_COMPILE', True) or args.compile_bundle else None
+
+    shared_chatbot = app.config.get('SHARED_CHATBOT_INSTANCE')
+    if app.config['CHARACTER_BUNDLE_COMPILER'] is not None and shared_chatbot is not None \
+            and not args.compile_bundle and not getattr(shared_chatbot, 'loaded_from_bundle', False):
+        # Build the bundle now so the next start (init_chatbot with character_bundle_dir) can skip embedding
+        app.config['CHARACTER_BUNDLE_COMPILER'].ensure_current(shared_chatbot.role)
+
+    if args.compile_bundle:
+        compiled = [app.config['CHARACTER_BUNDLE_COMPILER'].compile(role_name) for role_name in args.compile_bundle]
+        if all(compiled):
+            pause_and_exit(0, f"Compiled character bundle(s) for {', '.join(args.compile_bundle)}.")
+        else:
+            logger.error("Some character bundles could not be compiled. See messages above.")
+            sys.exit(1)
+
     app.config['SECRET_KEY'] = config.get('SECRET_KEY', 'a_very_secure_default_fallback_key')
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
     CORS(app, resources={r"/api/*": {"origins": "*"}})
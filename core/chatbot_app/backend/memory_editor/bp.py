@@ -80,6 +80,12 @@ def _get_shared_memory_system_and_check_status(for_write_operation: bool = False
 
     return memory_system
 
+def _notify_memory_changed():
+    """Tells the shared chatbot that memory was edited, so its retrieval caches are dropped."""
+    shared_chatbot = current_app.config.get('SHARED_CHATBOT_INSTANCE')
+    if shared_chatbot is not None and hasattr(shared_chatbot, 'notify_memory_changed'):
+        shared_chatbot.notify_memory_changed()
+
 def create_memory_editor_blueprint(memory_editor_config):
     """
     Creates and configures the Flask Blueprint for the Memory Editor.
@@ -122,7 +128,10 @@ def create_memory_editor_blueprint(memory_editor_config):
             if memory_system != current_memory_system:
                  print("CRITICAL: Mismatch in memory system instance for task execution.")
                  abort(500, "Memory system instance mismatch.")
-            result, status_code = func(*args, **kwargs)
+            try:
+                result, status_code = func(*args, **kwargs)
+            finally:
+                _notify_memory_changed()
 
             pending_task_details.pop(task_id, None)
             global pending_tasks_queue
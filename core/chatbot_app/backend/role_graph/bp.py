@@ -1,9 +1,16 @@
-import json
+import copy
 import os
 from flask import Blueprint, request, jsonify, current_app, abort
 
+from utils.role_graph_journal import RoleGraphJournal, apply_graph_op
+from utils.role_graph_index import RoleGraphIndex
+from utils.role_graph_views import RoleGraphViews
+
 graph_data = {"roles": {}}
 data_file_path = ""
+graph_journal = None
+graph_index = RoleGraphIndex()
+graph_views = RoleGraphViews(graph_data, graph_index)
 
 # --- Flask App Setup ---
 bp = Blueprint("role_graph", __name__, template_folder='templates')
@@ -48,47 +55,267 @@ def _check_read_access_for_role_graph():
         if current_status in ['config_editing', 'active']:
             abort(503, f"Cannot access role graph. System status is '{current_status}'.")
 
+
+def _check_traversal_access_for_role_graph():
+    """Read-only views and relation traversal stay available while chatting ('active'):
+    they read the graph and its index under graph_journal.lock, which every edit holds."""
+    with current_app.config['CHATBOT_STATUS_LOCK']:
+        current_status = current_app.config.get('CHATBOT_STATUS')
+        if current_status == 'config_editing':
+            abort(503, f"Cannot access role graph. System status is '{current_status}'.")
+
 # --- API Endpoints ---
 
-def create_role_graph_blueprint(config):
-    global graph_data, data_file_path
-    def load_graph(filepath):
-        """Loads graph data from a JSON file."""
-        global graph_data
-        if os.path.exists(filepath):
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    graph_data = json.load(f)
-                print(f"Graph data loaded successfully from {filepath}")
-            except json.JSONDecodeError:
-                print(f"Error decoding JSON from {filepath}. Starting with empty graph.")
-                graph_data = {"roles": {}}
-            except Exception as e:
-                print(f"Error loading graph data from {filepath}: {e}. Starting with empty graph.")
-                graph_data = {"roles": {}}
+def _schedule_bundle_compile():
+    """Graph edits can change any role's attributes, so every compiled character bundle is refreshed."""
+    bundle_compiler = current_app.config.get('CHARACTER_BUNDLE_COMPILER')
+    if bundle_compiler is not None:
+        bundle_compiler.schedule()
+
+
+def _commit_graph_op(op):
+    """Applies an already validated edit to the in-memory graph, then journals it.
+
+    Same order as _commit_graph_batch: the touched roles are saved first, so an edit
+    that fails part-way or cannot be persisted leaves the graph exactly as it was and
+    nothing is journaled that replay would later skip. Returns False if the edit could
+    not be persisted; errors raised while applying it are re-raised after the rollback.
+    """
+    with graph_journal.lock:
+        roles = graph_data.setdefault("roles", {})
+        role_order = list(roles)
+        saved_roles = _save_touched_roles(op, {})
+        try:
+            graph_views.invalidate(op)
+            apply_graph_op(graph_data, op, graph_index)
+            persisted = graph_journal.append(op)
+        except Exception:
+            _restore_roles(role_order, saved_roles)
+            raise
+        if not persisted:
+            _restore_roles(role_order, saved_roles)
+            return False
+        graph_views.invalidate(op)
+    _schedule_bundle_compile()
+    return True
+
+
+_REQUIRED_OP_FIELDS = {
+    "add_role": ("role",),
+    "delete_role": ("role",),
+    "add_attribute_description": ("role", "attribute", "description"),
+    "add_description_for": ("source", "target", "attribute", "description"),
+    "add_idea": ("source", "target", "idea"),
+    "delete_attribute": ("role", "attribute"),
+    "delete_description": ("role", "attribute", "index"),
+    "delete_ideas_to": ("source", "target"),
+    "delete_idea": ("source", "target", "index"),
+}
+
+
+def _validate_graph_op(op):
+    """Checks one edit against the current graph the same way the single-edit endpoints do.
+
+    Returns None if the edit can be applied, otherwise (error message, status code).
+    add_attribute_description access_rights are normalized in place.
+    """
+    roles = graph_data.get("roles", {})
+    kind = op.get("op") if isinstance(op, dict) else None
+
+    missing = [field for field in _REQUIRED_OP_FIELDS.get(kind, ()) if field not in op]
+    if missing:
+        return f"Operation '{kind}' is missing required field(s): {', '.join(missing)}", 400
+    for field in _REQUIRED_OP_FIELDS.get(kind, ()):
+        expected = int if field == "index" else str
+        value = op[field]
+        if not isinstance(value, expected) or isinstance(value, bool):
+            return f"Field '{field}' of operation '{kind}' must be {'an integer' if expected is int else 'a string'}", 400
+
+    if kind == "add_role":
+        if not op.get("role"):
+            return "Role name is required", 400
+        if op["role"] in roles:
+            return f"Role '{op['role']}' already exists", 409
+
+    elif kind == "delete_role":
+        if op.get("role") not in roles:
+            return f"Role '{op.get('role')}' not found", 404
+
+    elif kind == "add_attribute_description":
+        if op.get("role") not in roles:
+            return f"Role '{op.get('role')}' not found", 404
+        if not op.get("attribute") or not op.get("description"):
+            return "Attribute name and description are required", 400
+        access_rights = op.get("access_rights")
+        if access_rights is None or (isinstance(access_rights, list) and not access_rights):
+            op["access_rights"] = "unlimited"
+        elif isinstance(access_rights, list):
+            invalid_roles = [ar for ar in access_rights if ar not in roles]
+            if invalid_roles:
+                return f"Invalid roles in access_rights: {', '.join(invalid_roles)}", 400
+        elif access_rights != "unlimited":
+            return "Invalid format for access_rights. Must be 'unlimited' or a list of role names.", 400
+
+    elif kind == "add_description_for":
+        if op.get("source") not in roles:
+            return f"Source role '{op.get('source')}' not found", 404
+        if op.get("target") not in roles:
+            return f"Target role '{op.get('target')}' not found", 404
+        if not op.get("attribute") or not op.get("description"):
+            return "Attribute name and description are required", 400
+
+    elif kind == "add_idea":
+        if op.get("source") not in roles:
+            return f"Source role '{op.get('source')}' not found", 404
+        if not op.get("target") or not op.get("idea"):
+            return "Target role and idea text are required", 400
+        if op["target"] not in roles:
+            return f"Target role '{op['target']}' not found", 404
+
+    elif kind in ("delete_attribute", "delete_description"):
+        if op.get("role") not in roles:
+            return f"Role '{op.get('role')}' not found", 404
+        attribute_name = op.get("attribute")
+        descriptions = roles[op["role"]].get("attributes", {}).get(attribute_name)
+        if kind == "delete_attribute":
+            if descriptions is None:
+                return f"Attribute '{attribute_name}' not found for role '{op['role']}'", 404
+        else:
+            if not isinstance(descriptions, list):
+                return f"Attribute '{attribute_name}' not found or has no descriptions for role '{op['role']}'", 404
+            index = op.get("index")
+            if not isinstance(index, int) or isinstance(index, bool) or not (0 <= index < len(descriptions)):
+                return f"Invalid description index {index} for attribute '{attribute_name}'", 400
+
+    elif kind in ("delete_ideas_to", "delete_idea"):
+        source_role, target_role = op.get("source"), op.get("target")
+        if source_role not in roles:
+            return f"Source role '{source_role}' not found", 404
+        if target_role not in roles:
+            return f"Target role '{target_role}' not found", 404
+        ideas_list = roles[source_role].get("ideas", {}).get(target_role)
+        if kind == "delete_ideas_to":
+            if ideas_list is None:
+                return f"No ideas found from '{source_role}' to '{target_role}'", 404
+        else:
+            if not isinstance(ideas_list, list):
+                return f"No ideas found or ideas data is invalid from '{source_role}' to '{target_role}'", 404
+            index = op.get("index")
+            if not isinstance(index, int) or isinstance(index, bool) or not (0 <= index < len(ideas_list)):
+                return f"Invalid idea index {index} from '{source_role}' to '{target_role}'", 400
+
+    else:
+        return f"Unknown operation: {kind}", 400
+
+    return None
+
+
+def _roles_touched_by(op):
+    """Names of the roles whose data an edit may modify (for batch rollback)."""
+    kind = op["op"]
+    if kind == "delete_role":
+        role_name = op["role"]
+        touched = {role_name}
+        touched.update(graph_index.idea_sources(role_name))
+        touched.update(owner for owner, _ in graph_index.attributes_naming(role_name))
+        return touched
+    if kind in ("add_idea", "delete_ideas_to", "delete_idea"):
+        return {op["source"]}
+    return {op.get("role", op.get("target"))}
+
+
+def _save_touched_roles(op, saved_roles):
+    """Deep-copies (once) the data of every role op may modify into saved_roles; None marks a new role."""
+    roles = graph_data.setdefault("roles", {})
+    for role_name in _roles_touched_by(op):
+        if role_name not in saved_roles:
+            saved_roles[role_name] = copy.deepcopy(roles.get(role_name))
+    return saved_roles
+
+
+def _restore_roles(role_order, saved_roles):
+    """Puts the saved roles back in their original order and rebuilds the index and views."""
+    if not saved_roles:
+        return
+    roles = graph_data.setdefault("roles", {})
+    for role_name, role_data in saved_roles.items():
+        if role_data is None:
+            roles.pop(role_name, None)
         else:
-            print(f"Data file not found at {filepath}. Starting with empty graph.")
-            graph_data = {"roles": {}}
+            roles[role_name] = role_data
+    restored = {name: roles[name] for name in role_order}
+    roles.clear()
+    roles.update(restored)
+    graph_index.rebuild(graph_data)
+    graph_views.reset(graph_data, graph_index)
+
+
+def _commit_graph_batch(ops):
+    """Validates and applies an ordered list of edits as one journaled unit.
+
+    Each edit is validated against the graph as left by the edits before it. The
+    original data of every role an edit touches is saved first, so a failed
+    validation or a failed journal write restores the graph exactly.
+    Returns None on success, otherwise (error message, status code, failing position).
+    """
+    with graph_journal.lock:
+        role_order = list(graph_data.setdefault("roles", {}))
+        saved_roles = {}
+        batch_op = {"op": "batch", "ops": ops}
+        failure = None
+        try:
+            for position, op in enumerate(ops):
+                error = _validate_graph_op(op)
+                if error is not None:
+                    failure = (error[0], error[1], position)
+                    break
+                # Only a validated edit is guaranteed to carry the fields invalidation reads
+                graph_views.invalidate(op)
+                _save_touched_roles(op, saved_roles)
+                apply_graph_op(graph_data, op, graph_index)
+            if failure is None and not graph_journal.append(batch_op):
+                failure = ("Failed to save graph data, nothing was changed.", 500, None)
+        except Exception as e:
+            failure = (f"An error occurred while applying the batch: {e}", 500, None)
+
+        if failure is None:
+            graph_views.invalidate(batch_op)
+            _schedule_bundle_compile()
+            return None
+
+        _restore_roles(role_order, saved_roles)
+        return failure
+
+
+def create_role_graph_blueprint(config):
+    global graph_data, data_file_path, graph_journal, graph_index, graph_views
 
     def save_graph():
-        """Saves current graph data to the JSON file."""
-        global graph_data, data_file_path
-        try:
-            with open(data_file_path, 'w', encoding='utf-8') as f:
-                json.dump(graph_data, f, ensure_ascii=False, indent=2)
+        """Compacts the journal so the snapshot file reflects every edit."""
+        if graph_journal.compact():
             print(f"Graph data saved successfully to {data_file_path}")
             return True
-        except Exception as e:
-            print(f"Error saving graph data to {data_file_path}: {e}")
-            return False
+        return False
 
     data_file_path = config['DATA_PATH']
-    load_graph(data_file_path)
     data_dir = os.path.dirname(data_file_path)
     if data_dir and not os.path.exists(data_dir):
         os.makedirs(data_dir)
         print(f"Created data directory: {data_dir}")
 
+    graph_journal = RoleGraphJournal(
+        data_file_path,
+        compact_threshold=config.get('JOURNAL_COMPACT_THRESHOLD', 256),
+        compact_interval=config.get('JOURNAL_COMPACT_INTERVAL', 30.0)
+    )
+    graph_data = graph_journal.load()
+    graph_index = RoleGraphIndex(graph_data)
+    graph_views.reset(graph_data, graph_index)
+    if graph_journal.pending:
+        # Fold edits recovered from the journal back into the snapshot right away.
+        save_graph()
+    graph_journal.start_compactor()
+
     @bp.route('/graph', methods=['GET'])
     def get_graph():
         """Get the entire graph data."""
@@ -115,12 +342,9 @@ def create_role_graph_blueprint(config):
             if role_name in graph_data.get("roles", {}):
                 return jsonify({"error": f"Role '{role_name}' already exists"}), 409
 
-            graph_data["roles"][role_name] = {"attributes": {}, "ideas": {}}
-            if save_graph():
+            if _commit_graph_op({"op": "add_role", "role": role_name}):
                 return jsonify({"message": f"Role '{role_name}' added"}), 201
             else:
-                if role_name in graph_data.get("roles", {}):
-                    del graph_data["roles"][role_name]
                 return jsonify({"error": "Failed to save graph data"}), 500
         finally:
             _end_role_graph_write_operation()
@@ -134,39 +358,14 @@ def create_role_graph_blueprint(config):
             if role_name not in graph_data.get("roles", {}):
                 return jsonify({"error": f"Role '{role_name}' not found"}), 404
 
-            original_graph_data = json.loads(json.dumps(graph_data))
-            del graph_data["roles"][role_name]
-
-            # 2. Remove ideas from other roles to this role
-            for source_role_name, source_role_data in graph_data["roles"].items():
-                if role_name in source_role_data.get("ideas", {}):
-                    del source_role_data["ideas"][role_name]
-
-            # 3. Remove role from access_rights in all descriptions
-            for current_role_name, current_role_data in graph_data["roles"].items():
-                for attr_name, descriptions in current_role_data.get("attributes", {}).items():
-                    for i in range(len(descriptions))[-1::-1]:
-                        desc = descriptions[i]
-                        if isinstance(desc.get("access_rights"), list):
-                            desc["access_rights"] = [
-                                ar for ar in desc["access_rights"] if ar != role_name
-                            ]
-                        elif isinstance(desc.get("access_rights"), str):
-                            if desc["access_rights"] == role_name:
-                                descriptions.pop(i)
-
-            if save_graph():
+            # Removes the role, ideas from other roles to it, and its access_rights entries.
+            if _commit_graph_op({"op": "delete_role", "role": role_name}):
                 return jsonify({"message": f"Role '{role_name}' and related data deleted"}), 200
             else:
-                graph_data.clear()
-                graph_data.update(original_graph_data)  # Simple rollback, might be incomplete for complex changes
-                return jsonify({"error": "Failed to save graph data after deletion, rollback attempted."}), 500
+                return jsonify({"error": "Failed to save graph data after deletion, nothing was changed."}), 500
 
         except Exception as e_del_role:
-            if 'original_graph_data' in locals():
-                graph_data.clear()
-                graph_data.update(json.loads(original_graph_data))
-            return jsonify({"error": f"An error occurred during deletion: {str(e_del_role)}, rollback attempted."}), 500
+            return jsonify({"error": f"An error occurred during deletion: {str(e_del_role)}"}), 500
         finally:
             _end_role_graph_write_operation()
 
@@ -203,32 +402,15 @@ def create_role_graph_blueprint(config):
             else:
                 return jsonify({"error": "Invalid format for access_rights. Must be 'unlimited' or a list of role names."}), 400
 
-            role_data = graph_data["roles"][role_name]
-            original_role_data = json.loads(json.dumps(role_data))
-            if "attributes" not in role_data:
-                role_data["attributes"] = {}
-            if attribute_name not in role_data["attributes"]:
-                role_data["attributes"][attribute_name] = []
-
-            role_data["attributes"][attribute_name].append({
-                "description": description,
-                "access_rights": final_access_rights
-            })
-
-            if save_graph():
+            if _commit_graph_op({"op": "add_attribute_description", "role": role_name,
+                                 "attribute": attribute_name, "description": description,
+                                 "access_rights": final_access_rights}):
                 return jsonify({"message": "Attribute description added successfully"}), 201
             else:
-                if role_name in graph_data["roles"] and 'original_role_data' in locals():
-                    graph_data["roles"][role_name].clear()
-                    graph_data["roles"][role_name].update(json.loads(original_role_data))
-
                 return jsonify({"error": "Failed to save role data"}), 500
-        except Exception as e_del_role:
-                if role_name in graph_data["roles"] and 'original_role_data' in locals():
-                    graph_data["roles"][role_name].clear()
-                    graph_data["roles"][role_name].update(json.loads(original_role_data))
+        except Exception as e_add_attr:
                 return jsonify(
-                    {"error": f"An error occurred during deletion: {str(e_del_role)}, rollback attempted."}), 500
+                    {"error": f"An error occurred while adding the description: {str(e_add_attr)}"}), 500
         finally:
             _end_role_graph_write_operation()
 
@@ -238,6 +420,7 @@ def create_role_graph_blueprint(config):
     def add_description_for_other_role(source_role, target_role):
         """Add an attribute description to target_role from source_role's perspective.
            Access rights default to [source_role]."""
+        _begin_role_graph_write_operation()
         try:
             if source_role not in graph_data.get("roles", {}):
                 return jsonify({"error": f"Source role '{source_role}' not found"}), 404
@@ -251,41 +434,15 @@ def create_role_graph_blueprint(config):
             if not attribute_name or not description:
                 return jsonify({"error": "Attribute name and description are required"}), 400
 
-            final_access_rights = [source_role]
-
-            target_role_data = graph_data["roles"][target_role]
-            original_role_data = json.loads(json.dumps(target_role_data))
-            if "attributes" not in target_role_data:
-                target_role_data["attributes"] = {}
-            if attribute_name not in target_role_data["attributes"]:
-                target_role_data["attributes"][attribute_name] = []
-
-            find = False
-            for item in target_role_data["attributes"][attribute_name]:
-                if item["description"] == description:
-                    find = True
-                    item["access_rights"] = item["access_rights"].extend(final_access_rights) if item["access_rights"] else final_access_rights
-                    break
-            if not find:
-                target_role_data["attributes"][attribute_name].append({
-                    "description": description,
-                    "access_rights": final_access_rights
-                })
-
-            if save_graph():
+            # An identical description gains source_role in its access_rights instead of being duplicated.
+            if _commit_graph_op({"op": "add_description_for", "source": source_role, "target": target_role,
+                                 "attribute": attribute_name, "description": description}):
                 return jsonify({"message": f"Attribute description added for '{target_role}' by '{source_role}'"}), 201
             else:
-                if target_role in graph_data["roles"] and 'original_role_data' in locals():
-                    graph_data["roles"][target_role].clear()
-                    graph_data["roles"][target_role].update(json.loads(original_role_data))
-
                 return jsonify({"error": "Failed to save role data"}), 500
-        except Exception as e_del_role:
-                if target_role in graph_data["roles"] and 'original_role_data' in locals():
-                    graph_data["roles"][target_role].clear()
-                    graph_data["roles"][target_role].update(json.loads(original_role_data))
+        except Exception as e_add_desc:
                 return jsonify(
-                    {"error": f"An error occurred during deletion: {str(e_del_role)}, rollback attempted."}), 500
+                    {"error": f"An error occurred while adding the description: {str(e_add_desc)}"}), 500
         finally:
             _end_role_graph_write_operation()
 
@@ -293,6 +450,7 @@ def create_role_graph_blueprint(config):
     @bp.route('/role/<source_role>/idea', methods=['POST'])
     def add_idea(source_role):
         """Add an idea from source_role to target_role."""
+        _begin_role_graph_write_operation()
         try:
             if source_role not in graph_data.get("roles", {}):
                 return jsonify({"error": f"Source role '{source_role}' not found"}), 404
@@ -306,28 +464,39 @@ def create_role_graph_blueprint(config):
             if target_role not in graph_data.get("roles", {}):
                 return jsonify({"error": f"Target role '{target_role}' not found"}), 404
 
-            source_role_data = graph_data["roles"][source_role]
-            original_role_data = json.loads(json.dumps(source_role_data))
-            if "ideas" not in source_role_data:
-                source_role_data["ideas"] = {}
-            if target_role not in source_role_data["ideas"]:
-                source_role_data["ideas"][target_role] = []
-
-            source_role_data["ideas"][target_role].append(idea)
-
-            if save_graph():
+            if _commit_graph_op({"op": "add_idea", "source": source_role, "target": target_role, "idea": idea}):
                 return jsonify({"message": f"Idea added from '{source_role}' to '{target_role}'"}), 201
             else:
-                if target_role in graph_data["roles"] and 'original_role_data' in locals():
-                    graph_data["roles"][target_role].clear()
-                    graph_data["roles"][target_role].update(json.loads(original_role_data))
                 return jsonify({"error": "Failed to save role data"}), 500
-        except Exception as e_del_role:
-                if source_role in graph_data["roles"] and 'original_role_data' in locals():
-                    graph_data["roles"][source_role].clear()
-                    graph_data["roles"][source_role].update(json.loads(original_role_data))
+        except Exception as e_add_idea:
                 return jsonify(
-                    {"error": f"An error occurred during deletion: {str(e_del_role)}, rollback attempted."}), 500
+                    {"error": f"An error occurred while adding the idea: {str(e_add_idea)}"}), 500
+        finally:
+            _end_role_graph_write_operation()
+
+
+    @bp.route('/batch', methods=['POST'])
+    def apply_batch():
+        """Apply an ordered list of edits atomically: either every edit is applied and saved, or none is.
+           Body: {"operations": [{"op": "add_role", "role": ...}, {"op": "add_attribute_description", ...}, ...]}
+           using the same operation fields as the role graph journal."""
+        _begin_role_graph_write_operation()
+        try:
+            data = request.json or {}
+            operations = data.get('operations')
+            if not isinstance(operations, list) or not operations:
+                return jsonify({"error": "A non-empty 'operations' list is required"}), 400
+            if not all(isinstance(op, dict) for op in operations):
+                return jsonify({"error": "Each operation must be an object"}), 400
+            operations = [dict(op) for op in operations]
+
+            failure = _commit_graph_batch(operations)
+            if failure is None:
+                return jsonify({"message": f"Applied {len(operations)} operation(s)"}), 200
+            error, status_code, position = failure
+            return jsonify({"error": error, "failed_operation": position}), status_code
+        except Exception as e_batch:
+            return jsonify({"error": f"An error occurred during the batch: {str(e_batch)}"}), 500
         finally:
             _end_role_graph_write_operation()
 
@@ -335,108 +504,109 @@ def create_role_graph_blueprint(config):
     @bp.route('/parse/attributes/<role_name>', methods=['POST'])
     def parse_role_attributes(role_name):
         """Parse a role's attributes into a natural language list."""
-        _check_read_access_for_role_graph()
-        if role_name not in graph_data.get("roles", {}):
-            return jsonify({"error": f"Role '{role_name}' not found"}), 404
-
-        role_data = graph_data["roles"][role_name]
-        all_attr = []
-
-        attributes = role_data.get("attributes", {})
-        if not attributes:
-            pass
-        else:
-            for attr_name, descriptions in attributes.items():
-                parsed_dict = {}
-                if not descriptions:
-                    continue
-                else:
-                    for desc in descriptions:
-                        if not desc.get("description", None):
-                            continue
-                        access = desc.get("access_rights", "unlimited")
-                        if isinstance(access, list):
-                            access_str = f"对于{', '.join(access)}来说，" if access else ""
-                            all_attr.append(access_str + f"{role_name}的{attr_name}包括: " + desc['description'])
-                        elif isinstance(access, str):
-                            if (not access or access == "unlimited"):
-                                all_attr.append(f"{role_name}的{attr_name}包括: " + desc['description'])
-                            else:
-                                if not parsed_dict.get(access, None):
-                                    parsed_dict[access] = [desc['description']]
-                                elif isinstance(parsed_dict[access], list):
-                                    parsed_dict[access].append(desc['description'])
-
-                    for access, descs in parsed_dict.items():
-                        all_attr.append(f"对于{access}来说，" + f"{role_name}的{attr_name}包括: " + ";".join(descs))
-
+        _check_traversal_access_for_role_graph()
+        with graph_journal.lock:
+            if role_name not in graph_data.get("roles", {}):
+                return jsonify({"error": f"Role '{role_name}' not found"}), 404
+            all_attr = graph_views.get_attributes(role_name)
         return jsonify(all_attr), 200
 
 
     @bp.route('/parse/accessible_descriptions/<role_name>', methods=['POST'])
     def parse_accessible_descriptions(role_name):
         """Parse descriptions accessible by role_name from other roles."""
-        _check_read_access_for_role_graph()
-        if role_name not in graph_data.get("roles", {}):
-            return jsonify({"error": f"Role '{role_name}' not found"}), 404
-
-        accessible_data = {}
-
-        for other_role_name, other_role_data in graph_data.get("roles", {}).items():
-            if other_role_name == role_name:
-                continue
-
-            accessible_descriptions_list = []
-            attributes = other_role_data.get("attributes", {})
-            for attr_name, descriptions in attributes.items():
-                for desc_obj in descriptions:
-                    description = desc_obj.get("description")
-                    access_rights = desc_obj.get("access_rights", "unlimited")
-
-                    can_access = False
-                    if access_rights == "unlimited":
-                        can_access = True
-                    elif isinstance(access_rights, list) and role_name in access_rights:
-                        can_access = True
-
-                    if can_access and description:
-                        # Include attribute name in the description for clarity
-                        accessible_descriptions_list.append(f"{attr_name}: {description}")
-
-            if accessible_descriptions_list:
-                accessible_data[other_role_name] = accessible_descriptions_list
-
-        parsed_list = []
-        if not accessible_data:
-            pass
-        else:
-            for other_role, descriptions in accessible_data.items():
-                for desc in descriptions:
-                    parsed_list.append(desc)
-
+        _check_traversal_access_for_role_graph()
+        with graph_journal.lock:
+            if role_name not in graph_data.get("roles", {}):
+                return jsonify({"error": f"Role '{role_name}' not found"}), 404
+            parsed_list = graph_views.get_accessible_descriptions(role_name)
         return jsonify(parsed_list), 200
 
 
     @bp.route('/parse/ideas/<source_role>/<target_role>', methods=['POST'])
     def parse_ideas_between_roles(source_role, target_role):
         """Parse ideas from source_role to target_role."""
-        _check_read_access_for_role_graph()
-        if source_role not in graph_data.get("roles", {}):
-            return jsonify({"error": f"Source role '{source_role}' not found"}), 404
-        if target_role not in graph_data.get("roles", {}):
-            return jsonify({"error": f"Target role '{target_role}' not found"}), 404
+        _check_traversal_access_for_role_graph()
+        with graph_journal.lock:
+            if source_role not in graph_data.get("roles", {}):
+                return jsonify({"error": f"Source role '{source_role}' not found"}), 404
+            if target_role not in graph_data.get("roles", {}):
+                return jsonify({"error": f"Target role '{target_role}' not found"}), 404
+            parsed_list = graph_views.get_ideas(source_role, target_role)
+        return jsonify(parsed_list), 200
 
-        source_role_data = graph_data["roles"][source_role]
-        ideas = source_role_data.get("ideas", {}).get(target_role, [])
 
-        parsed_list = []
-        if not ideas:
-            pass
-        else:
-            for i, idea in enumerate(ideas):
-                parsed_list.append(idea)
+    def parse_relation_query_args():
+        """Reads the hops/direction query parameters shared by the relation endpoints."""
+        direction = request.args.get('direction', 'both')
+        if direction not in ('out', 'in', 'both'):
+            return None, None, "direction must be one of 'out', 'in' or 'both'"
+        try:
+            hops = int(request.args.get('hops', 1))
+        except (TypeError, ValueError):
+            return None, None, "hops must be an integer"
+        if hops < 1:
+            return None, None, "hops must be at least 1"
+        return hops, direction, None
+
+    def relation_ideas(source_role, target_role):
+        return graph_data["roles"].get(source_role, {}).get("ideas", {}).get(target_role, [])
+
+
+    @bp.route('/relations/<role_name>/neighbors', methods=['GET'])
+    def get_role_neighbors(role_name):
+        """Roles within `hops` idea relations of role_name.
+           Query params: hops (default 1), direction: out | in | both (default both)."""
+        _check_traversal_access_for_role_graph()
+        hops, direction, error = parse_relation_query_args()
+        if error:
+            return jsonify({"error": error}), 400
+
+        with graph_journal.lock:
+            if role_name not in graph_data.get("roles", {}):
+                return jsonify({"error": f"Role '{role_name}' not found"}), 404
+            distances = graph_index.neighbors(role_name, hops, direction)
+        return jsonify([{"role": other, "distance": distance} for other, distance in distances.items()]), 200
+
+
+    @bp.route('/relations/<role_name>/ideas_about', methods=['GET'])
+    def get_ideas_about_role(role_name):
+        """Every role that holds ideas about role_name, with those ideas."""
+        _check_traversal_access_for_role_graph()
+        with graph_journal.lock:
+            if role_name not in graph_data.get("roles", {}):
+                return jsonify({"error": f"Role '{role_name}' not found"}), 404
+            holders = [{"source": source_role, "ideas": list(relation_ideas(source_role, role_name))}
+                       for source_role in graph_index.idea_sources(role_name)]
+        return jsonify(holders), 200
+
 
-        return jsonify([f"{source_role}对{target_role}的看法 ：" + ";".join(parsed_list)]), 200
+    @bp.route('/relations/path/<source_role>/<target_role>', methods=['GET'])
+    def get_relation_path(source_role, target_role):
+        """Shortest chain of idea relations from source_role to target_role.
+           Query param: direction: out (follow ideas forward, default) | in | both."""
+        _check_traversal_access_for_role_graph()
+        direction = request.args.get('direction', 'out')
+        if direction not in ('out', 'in', 'both'):
+            return jsonify({"error": "direction must be one of 'out', 'in' or 'both'"}), 400
+
+        with graph_journal.lock:
+            if source_role not in graph_data.get("roles", {}):
+                return jsonify({"error": f"Source role '{source_role}' not found"}), 404
+            if target_role not in graph_data.get("roles", {}):
+                return jsonify({"error": f"Target role '{target_role}' not found"}), 404
+            path = graph_index.shortest_path(source_role, target_role, direction)
+            if path is None:
+                return jsonify({"error": f"No relation path from '{source_role}' to '{target_role}'"}), 404
+            relations = []
+            for current, following in zip(path, path[1:]):
+                relations.append({
+                    "from": current,
+                    "to": following,
+                    "ideas": list(relation_ideas(current, following)),
+                    "reverse_ideas": list(relation_ideas(following, current))
+                })
+        return jsonify({"path": path, "relations": relations}), 200
 
 
     @bp.route('/save', methods=['POST'])
@@ -452,32 +622,23 @@ def create_role_graph_blueprint(config):
     def delete_attribute(role_name, attribute_name):
         """Delete an entire attribute and all its descriptions for a role."""
         _begin_role_graph_write_operation()
-        if role_name not in graph_data.get("roles", {}):
-            return jsonify({"error": f"Role '{role_name}' not found"}), 404
-
-        role_data = graph_data["roles"][role_name]
-        attributes = role_data.get("attributes", {})
-
-        if attribute_name not in attributes:
-            return jsonify({"error": f"Attribute '{attribute_name}' not found for role '{role_name}'"}), 404
+        try:
+            if role_name not in graph_data.get("roles", {}):
+                return jsonify({"error": f"Role '{role_name}' not found"}), 404
 
-        original_graph_data = json.loads(json.dumps(graph_data)) # For potential rollback
+            role_data = graph_data["roles"][role_name]
+            attributes = role_data.get("attributes", {})
 
-        try:
-            del attributes[attribute_name]
-            # Optional: clean up attributes dict if it becomes empty
-            if not attributes:
-                 del role_data["attributes"]
+            if attribute_name not in attributes:
+                return jsonify({"error": f"Attribute '{attribute_name}' not found for role '{role_name}'"}), 404
 
-            if save_graph():
+            # The attributes dict itself is dropped once it becomes empty.
+            if _commit_graph_op({"op": "delete_attribute", "role": role_name, "attribute": attribute_name}):
                 return jsonify({"message": f"Attribute '{attribute_name}' deleted for role '{role_name}'"}), 200
             else:
-                # Rollback if save fails
-                graph_data.update(original_graph_data)
-                return jsonify({"error": "Failed to save graph data after attribute deletion, rollback attempted."}), 500
+                return jsonify({"error": "Failed to save graph data after attribute deletion, nothing was changed."}), 500
         except Exception as e:
-             graph_data.update(original_graph_data)
-             return jsonify({"error": f"An error occurred during attribute deletion: {e}, rollback attempted."}), 500
+             return jsonify({"error": f"An error occurred during attribute deletion: {e}"}), 500
         finally:
             _end_role_graph_write_operation()
 
@@ -486,42 +647,29 @@ def create_role_graph_blueprint(config):
     def delete_description(role_name, attribute_name, index):
         """Delete a specific description by index within an attribute for a role."""
         _begin_role_graph_write_operation()
-        if role_name not in graph_data.get("roles", {}):
-            return jsonify({"error": f"Role '{role_name}' not found"}), 404
-
-        role_data = graph_data["roles"][role_name]
-        attributes = role_data.get("attributes", {})
-
-        if attribute_name not in attributes or not isinstance(attributes.get(attribute_name), list):
-            return jsonify({"error": f"Attribute '{attribute_name}' not found or has no descriptions for role '{role_name}'"}), 404
-
-        descriptions = attributes[attribute_name]
-
-        if not (0 <= index < len(descriptions)):
-            return jsonify({"error": f"Invalid description index {index} for attribute '{attribute_name}'"}), 400
+        try:
+            if role_name not in graph_data.get("roles", {}):
+                return jsonify({"error": f"Role '{role_name}' not found"}), 404
 
-        original_graph_data = json.loads(json.dumps(graph_data)) # For potential rollback
+            role_data = graph_data["roles"][role_name]
+            attributes = role_data.get("attributes", {})
 
-        try:
-            deleted_description = descriptions.pop(index)
+            if attribute_name not in attributes or not isinstance(attributes.get(attribute_name), list):
+                return jsonify({"error": f"Attribute '{attribute_name}' not found or has no descriptions for role '{role_name}'"}), 404
 
-            # Optional: clean up attribute/attributes dict if lists become empty
-            if not descriptions:
-                 del attributes[attribute_name]
-                 if not attributes:
-                      del role_data["attributes"]
+            descriptions = attributes[attribute_name]
 
+            if not (0 <= index < len(descriptions)):
+                return jsonify({"error": f"Invalid description index {index} for attribute '{attribute_name}'"}), 400
 
-            if save_graph():
+            # Empty attribute lists (and an empty attributes dict) are cleaned up as well.
+            if _commit_graph_op({"op": "delete_description", "role": role_name,
+                                 "attribute": attribute_name, "index": index}):
                 return jsonify({"message": f"Description at index {index} deleted from attribute '{attribute_name}' for role '{role_name}'"}), 200
             else:
-                # Rollback if save fails
-                # Need to re-insert at original index if possible, or reload original state
-                graph_data.update(original_graph_data)
-                return jsonify({"error": "Failed to save graph data after description deletion, rollback attempted."}), 500
+                return jsonify({"error": "Failed to save graph data after description deletion, nothing was changed."}), 500
         except Exception as e:
-             graph_data.update(original_graph_data)
-             return jsonify({"error": f"An error occurred during description deletion: {e}, rollback attempted."}), 500
+             return jsonify({"error": f"An error occurred during description deletion: {e}"}), 500
         finally:
             _end_role_graph_write_operation()
 
@@ -530,35 +678,25 @@ def create_role_graph_blueprint(config):
     def delete_all_ideas_to_target(source_role, target_role):
         """Delete all ideas from a source role towards a specific target role."""
         _begin_role_graph_write_operation()
-        if source_role not in graph_data.get("roles", {}):
-            return jsonify({"error": f"Source role '{source_role}' not found"}), 404
-        if target_role not in graph_data.get("roles", {}):
-             # Allow deleting ideas even if target role was deleted? Current logic requires target exists. Let's keep it simple.
-             return jsonify({"error": f"Target role '{target_role}' not found"}), 404
-
-
-        source_role_data = graph_data["roles"][source_role]
-        ideas = source_role_data.get("ideas", {})
-
-        if target_role not in ideas:
-            return jsonify({"error": f"No ideas found from '{source_role}' to '{target_role}'"}), 404
+        try:
+            if source_role not in graph_data.get("roles", {}):
+                return jsonify({"error": f"Source role '{source_role}' not found"}), 404
+            if target_role not in graph_data.get("roles", {}):
+                 # Allow deleting ideas even if target role was deleted? Current logic requires target exists. Let's keep it simple.
+                 return jsonify({"error": f"Target role '{target_role}' not found"}), 404
 
-        original_graph_data = json.loads(json.dumps(graph_data)) # For potential rollback
+            source_role_data = graph_data["roles"][source_role]
+            ideas = source_role_data.get("ideas", {})
 
-        try:
-            del ideas[target_role]
-            # Optional: clean up ideas dict if it becomes empty
-            if not ideas:
-                 del source_role_data["ideas"]
+            if target_role not in ideas:
+                return jsonify({"error": f"No ideas found from '{source_role}' to '{target_role}'"}), 404
 
-            if save_graph():
+            if _commit_graph_op({"op": "delete_ideas_to", "source": source_role, "target": target_role}):
                 return jsonify({"message": f"All ideas from '{source_role}' to '{target_role}' deleted"}), 200
             else:
-                 graph_data.update(original_graph_data)
-                 return jsonify({"error": "Failed to save graph data after ideas deletion, rollback attempted."}), 500
+                 return jsonify({"error": "Failed to save graph data after ideas deletion, nothing was changed."}), 500
         except Exception as e:
-             graph_data.update(original_graph_data)
-             return jsonify({"error": f"An error occurred during ideas deletion: {e}, rollback attempted."}), 500
+             return jsonify({"error": f"An error occurred during ideas deletion: {e}"}), 500
         finally:
             _end_role_graph_write_operation()
 
@@ -567,41 +705,29 @@ def create_role_graph_blueprint(config):
     def delete_specific_idea(source_role, target_role, index):
         """Delete a specific idea by index from a source role towards a target role."""
         _begin_role_graph_write_operation()
-        if source_role not in graph_data.get("roles", {}):
-            return jsonify({"error": f"Source role '{source_role}' not found"}), 404
-        if target_role not in graph_data.get("roles", {}):
-             return jsonify({"error": f"Target role '{target_role}' not found"}), 404
-
-        source_role_data = graph_data["roles"][source_role]
-        ideas = source_role_data.get("ideas", {})
-
-        if target_role not in ideas or not isinstance(ideas.get(target_role), list):
-             return jsonify({"error": f"No ideas found or ideas data is invalid from '{source_role}' to '{target_role}'"}), 404
-
-        ideas_list = ideas[target_role]
+        try:
+            if source_role not in graph_data.get("roles", {}):
+                return jsonify({"error": f"Source role '{source_role}' not found"}), 404
+            if target_role not in graph_data.get("roles", {}):
+                 return jsonify({"error": f"Target role '{target_role}' not found"}), 404
 
-        if not (0 <= index < len(ideas_list)):
-            return jsonify({"error": f"Invalid idea index {index} from '{source_role}' to '{target_role}'"}), 400
+            source_role_data = graph_data["roles"][source_role]
+            ideas = source_role_data.get("ideas", {})
 
-        original_graph_data = json.loads(json.dumps(graph_data)) # For potential rollback
+            if target_role not in ideas or not isinstance(ideas.get(target_role), list):
+                 return jsonify({"error": f"No ideas found or ideas data is invalid from '{source_role}' to '{target_role}'"}), 404
 
-        try:
-            deleted_idea = ideas_list.pop(index)
+            ideas_list = ideas[target_role]
 
-            # Optional: clean up target_role entry or ideas dict if list becomes empty
-            if not ideas_list:
-                 del ideas[target_role]
-                 if not ideas:
-                      del source_role_data["ideas"]
+            if not (0 <= index < len(ideas_list)):
+                return jsonify({"error": f"Invalid idea index {index} from '{source_role}' to '{target_role}'"}), 400
 
-            if save_graph():
+            if _commit_graph_op({"op": "delete_idea", "source": source_role, "target": target_role, "index": index}):
                 return jsonify({"message": f"Idea at index {index} from '{source_role}' to '{target_role}' deleted"}), 200
             else:
-                 graph_data.update(original_graph_data)
-                 return jsonify({"error": "Failed to save graph data after idea deletion, rollback attempted."}), 500
+                 return jsonify({"error": "Failed to save graph data after idea deletion, nothing was changed."}), 500
         except Exception as e:
-             graph_data.update(original_graph_data)
-             return jsonify({"error": f"An error occurred during idea deletion: {e}, rollback attempted."}), 500
+             return jsonify({"error": f"An error occurred during idea deletion: {e}"}), 500
         finally:
             _end_role_graph_write_operation()
 
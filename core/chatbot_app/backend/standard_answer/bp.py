@@ -2,8 +2,12 @@ import json
 import os
 from flask import Blueprint, request, jsonify, current_app, abort
 
+from utils.role_graph_journal import load_graph
+from utils.json_document_cache import JsonDocumentCache
+
 graph_roles_list = []
 qna_output_dir = None
+qna_documents = JsonDocumentCache()
 
 bp = Blueprint("standard_answer",__name__, template_folder='templates')
 
@@ -59,8 +63,7 @@ def create_standard_answer_blueprint(config):
         global graph_roles_list
         if os.path.exists(filepath):
             try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    graph_data = json.load(f)
+                graph_data = load_graph(filepath)
                 graph_roles_list = list(graph_data.get("roles", {}).keys())
                 print(f"Role list loaded successfully from {filepath}.")
             except Exception as e:
@@ -85,18 +88,17 @@ def create_standard_answer_blueprint(config):
         return os.path.join(qna_output_dir, f'qna_{role_name}.json')
     
     def load_role_qna(role_name):
-        """Loads qna data for a specific role."""
+        """Loads qna data for a specific role, returning (qna_data, etag).
+           qna_data is shared with the document cache: copy it (and any list you change) before editing."""
         filepath = get_qna_filepath(role_name)
-        if os.path.exists(filepath):
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error loading QnA for {role_name} from {filepath}: {e}")
-                return {}
-        else:
+        try:
+            return qna_documents.load(filepath)
+        except FileNotFoundError:
             print(f"Q&A file not found for {role_name} at {filepath}. Returning empty Q&A.")
-            return {}
+            return {}, None
+        except Exception as e:
+            print(f"Error loading QnA for {role_name} from {filepath}: {e}")
+            return {}, None
     
     def save_role_qna(role_name, qna_data):
         """Saves qna data for a specific role."""
@@ -105,8 +107,15 @@ def create_standard_answer_blueprint(config):
         # Ensure output directory exists
         os.makedirs(qna_output_dir, exist_ok=True)
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
+            # Written to a temp file first so a failed save leaves the previous file (and cache entry) intact.
+            tmp_path = filepath + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
                 json.dump(qna_data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, filepath)
+            qna_documents.store(filepath, qna_data)
+            bundle_compiler = current_app.config.get('CHARACTER_BUNDLE_COMPILER')
+            if bundle_compiler is not None:
+                bundle_compiler.schedule(role_name)
             print(f"Q&A data saved successfully for {role_name} to {filepath}")
             return True
         except Exception as e:
@@ -130,8 +139,11 @@ def create_standard_answer_blueprint(config):
         if role_name not in graph_roles_list:
             return jsonify({"error": f"Role '{role_name}' not found in graph data"}), 404
     
-        qna_data = load_role_qna(role_name)
-        return jsonify(qna_data), 200
+        qna_data, etag = load_role_qna(role_name)
+        response = jsonify(qna_data)
+        if etag:
+            response.set_etag(etag)
+        return response.make_conditional(request)
     
     @bp.route('/role/<role_name>/input', methods=['POST'])
     def add_standard_input(role_name):
@@ -149,8 +161,8 @@ def create_standard_answer_blueprint(config):
                 return jsonify({"error": "Standard input text is required"}), 400
             standard_input = standard_input.strip()
 
-            qna_data = load_role_qna(role_name)
-            original_qna_data_str = json.dumps(qna_data)
+            # Copy-on-write: the cached document stays untouched unless the save succeeds.
+            qna_data = dict(load_role_qna(role_name)[0])
 
             if standard_input in qna_data:
                 return jsonify({"error": f"Standard input '{standard_input}' already exists for role '{role_name}'"}), 409
@@ -160,13 +172,8 @@ def create_standard_answer_blueprint(config):
             if save_role_qna(role_name, qna_data):
                 return jsonify({"message": "Standard input added successfully"}), 201
             else:
-                qna_data.clear()
-                qna_data.update(json.loads(original_qna_data_str))
                 return jsonify({"error": "Failed to save Q&A data, rollback attempted."}), 500
         except Exception as e:
-            if 'original_qna_data_str' in locals() and 'qna_data' in locals():
-                qna_data.clear()
-                qna_data.update(json.loads(original_qna_data_str))
             print(f"Exception in add_standard_input for {role_name}: {e}")
             return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
         finally:
@@ -191,8 +198,8 @@ def create_standard_answer_blueprint(config):
             new_input = new_input.strip()
 
 
-            qna_data = load_role_qna(role_name)
-            original_qna_data_str = json.dumps(qna_data)
+            # Copy-on-write: the cached document stays untouched unless the save succeeds.
+            qna_data = dict(load_role_qna(role_name)[0])
 
             if old_input not in qna_data:
                 return jsonify({"error": f"Standard input '{old_input}' not found for role '{role_name}'"}), 404
@@ -211,13 +218,8 @@ def create_standard_answer_blueprint(config):
             if save_role_qna(role_name, qna_data):
                 return jsonify({"message": "Standard input updated successfully"}), 200
             else:
-                qna_data.clear()
-                qna_data.update(json.loads(original_qna_data_str))
                 return jsonify({"error": "Failed to save Q&A data, rollback attempted."}), 500
         except Exception as e:
-            if 'original_qna_data_str' in locals() and 'qna_data' in locals():
-                qna_data.clear()
-                qna_data.update(json.loads(original_qna_data_str))
             print(f"Exception in update_standard_input for {role_name}: {e}")
             return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
         finally:
@@ -239,8 +241,8 @@ def create_standard_answer_blueprint(config):
                 return jsonify({"error": "Standard input text is required for deletion"}), 400
             standard_input = standard_input.strip()
 
-            qna_data = load_role_qna(role_name)
-            original_qna_data_str = json.dumps(qna_data)
+            # Copy-on-write: the cached document stays untouched unless the save succeeds.
+            qna_data = dict(load_role_qna(role_name)[0])
 
             if standard_input not in qna_data:
                 return jsonify({"error": f"Standard input '{standard_input}' not found for role '{role_name}'"}), 404
@@ -252,13 +254,8 @@ def create_standard_answer_blueprint(config):
             if save_role_qna(role_name, qna_data):
                 return jsonify({"message": "Standard input deleted successfully"}), 200
             else:
-                qna_data.clear()
-                qna_data.update(json.loads(original_qna_data_str))
                 return jsonify({"error": "Failed to save Q&A data, rollback attempted."}), 500
         except Exception as e:
-            if 'original_qna_data_str' in locals() and 'qna_data' in locals():
-                qna_data.clear()
-                qna_data.update(json.loads(original_qna_data_str))
             print(f"Exception in delete_standard_input for {role_name}: {e}")
             return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
         finally:
@@ -291,8 +288,8 @@ def create_standard_answer_blueprint(config):
             standard_input = standard_input.strip()
             standard_answer = standard_answer.strip()
 
-            qna_data = load_role_qna(role_name)
-            original_qna_data_str = json.dumps(qna_data)
+            # Copy-on-write: the cached document stays untouched unless the save succeeds.
+            qna_data = dict(load_role_qna(role_name)[0])
 
             if standard_input not in qna_data or not isinstance(qna_data.get(standard_input), list):
                 if standard_input in qna_data:
@@ -305,18 +302,13 @@ def create_standard_answer_blueprint(config):
             if standard_answer in qna_data[standard_input]:
                  return jsonify({"error": f"Standard answer '{standard_answer}' already exists for input '{standard_input}'"}), 409
 
-            qna_data[standard_input].append(standard_answer)
+            qna_data[standard_input] = qna_data[standard_input] + [standard_answer]
 
             if save_role_qna(role_name, qna_data):
                 return jsonify({"message": "Standard answer added"}), 201
             else:
-                qna_data.clear()
-                qna_data.update(json.loads(original_qna_data_str))
                 return jsonify({"error": "Failed to save Q&A data, rollback attempted."}), 500
         except Exception as e:
-            if 'original_qna_data_str' in locals() and 'qna_data' in locals():
-                qna_data.clear()
-                qna_data.update(json.loads(original_qna_data_str))
             print(f"Exception in add_standard_answer for {role_name}: {e}")
             return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
         finally:
@@ -341,12 +333,12 @@ def create_standard_answer_blueprint(config):
             standard_input = standard_input.strip()
             new_answer = new_answer.strip()
 
-            qna_data = load_role_qna(role_name)
-            original_qna_data_str = json.dumps(qna_data)
+            # Copy-on-write: the cached document stays untouched unless the save succeeds.
+            qna_data = dict(load_role_qna(role_name)[0])
             if standard_input not in qna_data or not isinstance(qna_data.get(standard_input), list):
                  return jsonify({"error": f"Standard input '{standard_input}' not found or has no answers for role '{role_name}'"}), 404
 
-            answers_list = qna_data[standard_input]
+            answers_list = qna_data[standard_input] = list(qna_data[standard_input])
 
             try:
                 index = int(index)
@@ -361,15 +353,10 @@ def create_standard_answer_blueprint(config):
                 if save_role_qna(role_name, qna_data):
                     return jsonify({"message": "Standard answer updated successfully"}), 200
                 else:
-                    qna_data.clear()
-                    qna_data.update(json.loads(original_qna_data_str))
                     return jsonify({"error": "Failed to save Q&A data, rollback attempted."}), 500
             except (ValueError, TypeError):
                 return jsonify({"error": "Index must be a valid integer"}), 400
         except Exception as e:
-            if 'original_qna_data_str' in locals() and 'qna_data' in locals():
-                qna_data.clear()
-                qna_data.update(json.loads(original_qna_data_str))
             print(f"Exception in update_standard_answer for {role_name}: {e}")
             return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
         finally:
@@ -393,13 +380,13 @@ def create_standard_answer_blueprint(config):
                 return jsonify({"error": "Standard input and index are required for deletion"}), 400
             standard_input = standard_input.strip()
 
-            qna_data = load_role_qna(role_name)
-            original_qna_data_str = json.dumps(qna_data)
+            # Copy-on-write: the cached document stays untouched unless the save succeeds.
+            qna_data = dict(load_role_qna(role_name)[0])
 
             if standard_input not in qna_data or not isinstance(qna_data.get(standard_input), list):
                  return jsonify({"error": f"Standard input '{standard_input}' not found or has no answers for role '{role_name}'"}), 404
 
-            answers_list = qna_data[standard_input]
+            answers_list = qna_data[standard_input] = list(qna_data[standard_input])
 
             try:
                 index = int(index)
@@ -414,15 +401,10 @@ def create_standard_answer_blueprint(config):
                 if save_role_qna(role_name, qna_data):
                     return jsonify({"message": "Standard answer deleted successfully"}), 200
                 else:
-                    qna_data.clear()
-                    qna_data.update(json.loads(original_qna_data_str))
                     return jsonify({"error": "Failed to save Q&A data, rollback attempted."}), 500
             except (ValueError, TypeError):
                 return jsonify({"error": "Index must be a valid integer"}), 400
         except Exception as e:
-            if 'original_qna_data_str' in locals() and 'qna_data' in locals():
-                qna_data.clear()
-                qna_data.update(json.loads(original_qna_data_str))
             print(f"Exception in delete_standard_answer for {role_name}: {e}")
             return jsonify({"error": f"An internal error occurred: {str(e)}"}), 500
         finally:
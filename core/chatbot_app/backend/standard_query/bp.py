@@ -2,8 +2,12 @@ import json
 import os
 from flask import Blueprint, request, jsonify, current_app, abort
 
+from utils.role_graph_journal import load_graph
+from utils.json_document_cache import JsonDocumentCache
+
 graph_data = {"roles": {}}
 queries_output_dir = None
+query_documents = JsonDocumentCache()
 # --- Flask App Setup ---
 
 def _begin_standard_query_write_operation():
@@ -82,8 +86,7 @@ def create_standard_query_blueprint(config):
         global graph_data
         if os.path.exists(filepath):
             try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    graph_data = json.load(f)
+                graph_data = load_graph(filepath)
                 print(f"Graph data loaded successfully from {filepath} for concepts generation.")
             except json.JSONDecodeError:
                 print(f"Error decoding JSON from {filepath}. Concepts based on empty graph.")
@@ -101,21 +104,20 @@ def create_standard_query_blueprint(config):
         return os.path.join(queries_output_dir, f'queries_{role_name}.json')
 
     def load_role_queries(role_name):
-        """Loads query data for a specific role."""
+        """Loads query data for a specific role, returning (query_data, etag).
+           query_data is shared with the document cache: copy it (and any list you change) before editing."""
         filepath = get_query_filepath(role_name)
-        if os.path.exists(filepath):
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                print(f"Error decoding JSON from {filepath}. Returning empty queries.")
-                return {}
-            except Exception as e:
-                print(f"Error loading queries for {role_name}: {e}. Returning empty queries.")
-                return {}
-        else:
+        try:
+            return query_documents.load(filepath)
+        except FileNotFoundError:
             print(f"Query file not found for {role_name} at {filepath}. Returning empty queries.")
-            return {}
+            return {}, None
+        except json.JSONDecodeError:
+            print(f"Error decoding JSON from {filepath}. Returning empty queries.")
+            return {}, None
+        except Exception as e:
+            print(f"Error loading queries for {role_name}: {e}. Returning empty queries.")
+            return {}, None
 
     def save_role_queries(role_name, query_data):
         """Saves query data for a specific role."""
@@ -124,8 +126,15 @@ def create_standard_query_blueprint(config):
         # Ensure output directory exists
         os.makedirs(queries_output_dir, exist_ok=True)
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
+            # Written to a temp file first so a failed save leaves the previous file (and cache entry) intact.
+            tmp_path = filepath + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
                 json.dump(query_data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, filepath)
+            query_documents.store(filepath, query_data)
+            bundle_compiler = current_app.config.get('CHARACTER_BUNDLE_COMPILER')
+            if bundle_compiler is not None:
+                bundle_compiler.schedule(role_name)
             print(f"Query data saved successfully for {role_name} to {filepath}")
             return True
         except Exception as e:
@@ -159,8 +168,11 @@ def create_standard_query_blueprint(config):
         if role_name not in graph_data.get("roles", {}):
             return jsonify({"error": f"Role '{role_name}' not found in graph data"}), 404
     
-        query_data = load_role_queries(role_name)
-        return jsonify(query_data), 200
+        query_data, etag = load_role_queries(role_name)
+        response = jsonify(query_data)
+        if etag:
+            response.set_etag(etag)
+        return response.make_conditional(request)
     
     
     @bp.route('/role/<role_name>/query', methods=['POST'])
@@ -183,11 +195,9 @@ def create_standard_query_blueprint(config):
             if concept not in valid_concepts:
                  return jsonify({"error": f"Invalid concept '{concept}' for role '{role_name}'"}), 400
 
-            query_data = load_role_queries(role_name)
-            original_query_data_str = json.dumps(query_data)
-
-            if concept not in query_data:
-                query_data[concept] = []
+            # Copy-on-write: the cached document stays untouched unless the save succeeds.
+            query_data = dict(load_role_queries(role_name)[0])
+            query_data[concept] = list(query_data.get(concept, []))
 
             message = ""
             status_code = 200
@@ -215,14 +225,9 @@ def create_standard_query_blueprint(config):
             if save_role_queries(role_name, query_data):
                 return jsonify({"message": message}), status_code
             else:
-                query_data.clear()
-                query_data.update(json.loads(original_query_data_str))
                 return jsonify({"error": "Failed to save query data after modification, rollback attempted."}), 500
 
         except Exception as e:
-            if 'original_query_data_str' in locals() and 'query_data' in locals():
-                query_data.clear()
-                query_data.update(json.loads(original_query_data_str))
             print(f"Exception in add_or_update_query for {role_name}: {e}")
             return jsonify({"error": f"An internal error occurred: {str(e)}"}),500
         finally:
@@ -249,11 +254,11 @@ def create_standard_query_blueprint(config):
             if concept not in valid_concepts:
                  return jsonify({"error": f"Invalid concept '{concept}' for role '{role_name}'"}), 400
 
-            query_data = load_role_queries(role_name)
-            original_query_data_str = json.dumps(query_data)
+            query_data = dict(load_role_queries(role_name)[0])
 
             if concept not in query_data or not isinstance(query_data[concept], list):
                 return jsonify({"error": f"Concept '{concept}' not found or has no queries"}), 404
+            query_data[concept] = list(query_data[concept])
 
             try:
                 index = int(index)
@@ -265,17 +270,12 @@ def create_standard_query_blueprint(config):
                     if save_role_queries(role_name, query_data):
                         return jsonify({"message": "Query deleted successfully"}), 200
                     else:
-                         query_data.clear()
-                         query_data.update(json.loads(original_query_data_str))
                          return jsonify({"error": "Failed to save query data after deletion, rollback attempted."}), 500
                 else:
                     return jsonify({"error": f"Invalid index {index} for concept '{concept}'"}), 400
             except (ValueError, TypeError):
                 return jsonify({"error": "Index must be a valid integer"}), 400
         except Exception as e_del_q:
-            if 'original_query_data_str' in locals() and 'query_data' in locals():
-                query_data.clear()
-                query_data.update(json.loads(original_query_data_str))
             print(f"Error deleting query for {role_name}: {e_del_q}")
             return jsonify({"error": f"An internal error occurred: {str(e_del_q)}"}), 500
         finally:
@@ -12,6 +12,7 @@ const API_BASE_URL = `${config.API_BASE_URL}/chatbot`;
 
 function App() {
   const [history, setHistory] = useState([]);
+  const [hasOlderHistory, setHasOlderHistory] = useState(false);
   const [userInput, setUserInput] = useState('');
   const [exposeMode, setExposeMode] = useState(false);
   const [historyVisible, setHistoryVisible] = useState(false);
@@ -28,15 +29,44 @@ function App() {
   const [draggableEnabled, setDraggableEnabled] = useState(true);
 
   const appContainerRef = useRef(null);
+  const latestImageRequestRef = useRef(null);
+  // Sync cursor into the server's seq-numbered history; a new epoch means the history was rewritten
+  const historyCursorRef = useRef({ epoch: null, lastSeq: 0 });
   const [appSize, setAppSize] = useState({ width: 0, height: 0 });
 
+  // Replaces the local history with a page from the server (or empties it) and moves the sync cursor.
+  const replaceHistory = useCallback((page = {}) => {
+    const entries = page.history || [];
+    historyCursorRef.current = {
+      epoch: page.epoch || null,
+      lastSeq: entries.length > 0 ? entries[entries.length - 1].seq : 0,
+    };
+    setHistory(entries);
+    setHasOlderHistory(Boolean(page.has_more_before));
+  }, []);
+
+  // Fetches the latest page once, then only the entries newer than the last seen seq.
   const fetchHistory = async (currentUser = userName, currentRole = roleName) => {
     try {
-      const response = await fetch(`${API_BASE_URL}/history`);
+      const { epoch, lastSeq } = historyCursorRef.current;
+      const query = epoch ? `?after=${lastSeq}&epoch=${epoch}` : '';
+      const response = await fetch(`${API_BASE_URL}/history${query}`);
       if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
       const data = await response.json();
       const fetchedHistory = data.history || [];
-      setHistory(fetchedHistory);
+      if (epoch && !data.reset) {
+        if (fetchedHistory.length > 0) {
+          historyCursorRef.current = { epoch, lastSeq: fetchedHistory[fetchedHistory.length - 1].seq };
+        }
+        // Optimistically shown messages have no seq yet; the server's copies replace them
+        setHistory(prevHistory => [...prevHistory.filter(msg => msg.seq !== undefined), ...fetchedHistory]);
+        if (data.has_more_after) {
+          await fetchHistory(currentUser, currentRole);
+          return;
+        }
+      } else {
+        replaceHistory(data);
+      }
       if (fetchedHistory.length > 0) {
         const firstCharMsg = fetchedHistory.find(msg => msg.role !== currentUser);
         if (firstCharMsg) setRoleName(firstCharMsg.role);
@@ -49,6 +79,50 @@ function App() {
     }
   };
 
+  const loadOlderHistory = useCallback(async () => {
+    const oldestEntry = history.find(msg => msg.seq !== undefined);
+    const { epoch } = historyCursorRef.current;
+    if (!oldestEntry || !epoch) return;
+    try {
+      const response = await fetch(`${API_BASE_URL}/history?before=${oldestEntry.seq}&epoch=${epoch}`);
+      if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+      const data = await response.json();
+      if (data.reset) {
+        replaceHistory(data);
+        return;
+      }
+      setHistory(prevHistory => [...(data.history || []), ...prevHistory]);
+      setHasOlderHistory(Boolean(data.has_more_before));
+    } catch (error) {
+      console.error('Error loading older history:', error);
+    }
+  }, [history, replaceHistory]);
+
+  // Character images are selected after the reply is returned; poll until they are ready.
+  const applyCharacterImages = useCallback(async (data) => {
+    const requestId = data.imageRequestId;
+    latestImageRequestRef.current = requestId || null;
+    if (!requestId) {
+      setCharacterImages(data.characterImageTokens || []);
+      return;
+    }
+    try {
+      while (latestImageRequestRef.current === requestId) {
+        const response = await fetch(`${API_BASE_URL}/character_images?request_id=${requestId}&timeout=10`);
+        if (response.status === 202) continue;
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const imageData = await response.json();
+        if (latestImageRequestRef.current === requestId) {
+          setCharacterImages(imageData.characterImageTokens || []);
+        }
+        return;
+      }
+    } catch (error) {
+      console.error('Error fetching character images:', error);
+      if (latestImageRequestRef.current === requestId) setCharacterImages([]);
+    }
+  }, []);
+
   useEffect(() => {
     if (backgroundImage) {
       console.log('[DEBUG] backgroundImage state in useEffect - Updated to:', backgroundImage);
@@ -69,10 +143,9 @@ function App() {
         setRoleName(configData.roleName || 'Character');
         setUserName(configData.userName || 'User');
         if (configData.defaultBackgroundImage) {
+          // Tokens are content hashes, so the URL itself changes when the image does
           const imageUrl = `${config.API_BASE_URL}/chatbot/serve_image?token=${configData.defaultBackgroundImage}`;
-          const timestamp = Date.now();
-          const uniqueImageUrl = `${imageUrl}${imageUrl.includes('?') ? '&' : '?'}_=${timestamp}`;
-          setBackgroundImage(uniqueImageUrl);
+          setBackgroundImage(imageUrl);
         }
         await fetchHistory(configData.userName || 'User', configData.roleName || 'Character');
       } catch (error) {
@@ -118,12 +191,13 @@ function App() {
         throw new Error(`HTTP error! status: ${response.status} - ${errorData.error}`);
       }
       const data = await response.json();
-      setCharacterImages(data.characterImageTokens || []);
+      applyCharacterImages(data);
       await fetchHistory();
     } catch (error) {
       console.error('Error sending chat:', error);
       alert(`Error sending message: ${error.message}`);
       setHistory(prevHistory => prevHistory.slice(0, -1));
+      latestImageRequestRef.current = null;
       setCharacterImages([]);
     } finally {
       setIsLoading(false);
@@ -140,12 +214,13 @@ function App() {
         throw new Error(`HTTP error! status: ${response.status} - ${errorData.error}`);
       }
       const data = await response.json();
-      setCharacterImages(data.characterImageTokens || []);
+      applyCharacterImages(data);
       alert("回复已刷新. ");
 
     } catch (error) {
       console.error('Error refreshing output:', error);
       alert(`Error refreshing output: ${error.message}`);
+      latestImageRequestRef.current = null;
       setCharacterImages([]);
     } finally {
       setIsLoading(false);
@@ -177,11 +252,12 @@ function App() {
 
       const data = await response.json();
       await fetchHistory();
-      setCharacterImages(data.characterImageTokens || []);
+      applyCharacterImages(data);
     } catch (error) {
       console.error('Error updating input:', error);
       alert(`Error updating input: ${error.message}`);
       fetchHistory();
+      latestImageRequestRef.current = null;
       setCharacterImages([]);
     } finally {
       setIsLoading(false);
@@ -238,7 +314,7 @@ function App() {
       if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
       const data = await response.json();
       alert('New session started.');
-      setHistory([]);
+      replaceHistory();
       setCharacterImages([]);
       // setImagePosition({ x: 0, y: 0 });
       // setImageScale(1);
@@ -270,10 +346,10 @@ function App() {
       }
 
       const data = await response.json();
-      const resumedHistory = data.history || [];
-      setHistory(resumedHistory);
+      // Only the most recent page is returned; older messages load on demand in the history overlay
+      replaceHistory(data);
       setCharacterImages([]);
-      const lastCharMessage = data.history.reverse().find(msg => msg.role !== (userName || 'User'));
+      const lastCharMessage = [...(data.history || [])].reverse().find(msg => msg.role !== (userName || 'User'));
       if (lastCharMessage) {
         if (data.lastCharacterImage) {
           setCharacterImages(data.lastCharacterImage);
@@ -294,7 +370,7 @@ function App() {
     } catch (error) {
       console.error('Error resuming session:', error);
       alert(`Error resuming session: ${error.message}`);
-      setHistory([]);
+      replaceHistory();
       setCharacterImages([]);
       setImagePosition({ x: 0, y: 0 });
       setImageScale(1);
@@ -314,7 +390,7 @@ function App() {
       if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
       await response.json();
       alert('Current session cleared.');
-      setHistory([]);
+      replaceHistory();
       setCharacterImages([]);
       // setImagePosition({ x: 0, y: 0 });
       // setImageScale(1);
@@ -370,7 +446,7 @@ function App() {
         alert('Chatbot closed.');
       }
 
-      setHistory([]);
+      replaceHistory();
       setCharacterImages([]);
       setImagePosition({ x: 0, y: 0 });
       setImageScale(1);
@@ -392,7 +468,7 @@ function App() {
         }));
       }
     }
-  }, [setIsLoading, setHistory, setCharacterImages, setImagePosition, setImageScale, setRoleName, setUserName, setDefaultCharacterImage]);
+  }, [setIsLoading, replaceHistory, setCharacterImages, setImagePosition, setImageScale, setRoleName, setUserName, setDefaultCharacterImage]);
 
 
   useEffect(() => {
@@ -482,9 +558,8 @@ function App() {
               }
 
               const backendOrigin = new URL(config.API_BASE_URL).origin;
-              const imageUrl = backendOrigin + data.url;
-              const timestamp = Date.now();
-              const uniqueImageUrl = `${imageUrl}${imageUrl.includes('?') ? '&' : '?'}_=${timestamp}`;
+              // Upload URLs are content-addressed (immutable), so no cache-busting is needed
+              const uniqueImageUrl = backendOrigin + data.url;
 
               const backgroundImgToLoad = new Image(); // The critical Image object for the actual background
 
@@ -640,7 +715,7 @@ function App() {
 
       />
       {historyVisible && (
-        <HistoryOverlay history={history} roleName={roleName} userName={userName} exposeMode={exposeMode} onClose={() => setHistoryVisible(false)} />
+        <HistoryOverlay history={history} roleName={roleName} userName={userName} exposeMode={exposeMode} hasOlder={hasOlderHistory} onLoadOlder={loadOlderHistory} onClose={() => setHistoryVisible(false)} />
       )}
 
       {/* <div
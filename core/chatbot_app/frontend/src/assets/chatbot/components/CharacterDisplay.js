@@ -33,7 +33,10 @@ function CharacterDisplay({
     const buildImageUrlFromToken = useCallback((token) => {
         if (!token) return '';
         const cleanApiBaseUrl = apiBaseUrl.endsWith('/') ? apiBaseUrl.slice(0, -1) : apiBaseUrl;
-        return `${cleanApiBaseUrl}/serve_image?token=${token}`;
+        // Ask for a variant at least as tall as the viewport (the layout never renders sprites taller
+        // than 1.8x the viewport); the server snaps it to a size bucket and never upscales.
+        const targetHeight = Math.ceil(Math.min(window.innerHeight * 1.8, window.screen.height) * (window.devicePixelRatio || 1));
+        return `${cleanApiBaseUrl}/serve_image?token=${token}&h=${targetHeight}`;
     }, [apiBaseUrl]);
 
     // useEffect(() => {
@@ -1,13 +1,16 @@
 import React from 'react';
 
-function HistoryOverlay({ history, roleName, userName, exposeMode, onClose }) {
+function HistoryOverlay({ history, roleName, userName, exposeMode, hasOlder, onLoadOlder, onClose }) {
   return (
     <div className="history-overlay">
       <button onClick={onClose} className="close-history-button">Close History</button>
       <h2>Conversation History</h2>
       <div className="history-content"> 
+        {hasOlder && (
+          <button onClick={onLoadOlder} className="load-older-history-button">Load earlier messages</button>
+        )}
         {history.map((message, index) => (
-          <div key={`hist-${message.timestamp || index}`} className="history-message">
+          <div key={`hist-${message.seq || message.timestamp || index}`} className="history-message">
             <div className="message-speaker">{message.role}:</div>
             <div className="message-content" style={{ whiteSpace: 'pre-wrap' }}>{message.content}</div>
             {exposeMode && message.role === roleName && message.desc && (
@@ -140,28 +140,66 @@ class PromptInfoBuilder(ABC):
         # Identify query types using the abstract method
         query_types = self._query_identification(
             user_input,
+            user_input_embedding=embedding,
             **kwargs
         )
 
         info_messages = []
 
         if '短期记忆' in query_types:
-            # Need context messages to replicate original logic for STM query input
-            context_messages = self._get_context_messages(**kwargs)
-            if len(context_messages) > 0 and len(mind_flow) > 0:
-                last_ctx_role = context_messages[-1].role if context_messages else role
-                tmp = f"{last_ctx_role}想:{list(mind_flow)[-1]}\n{last_ctx_role}说:{context_messages[-1].content if context_messages else ''}\n" + f"{user}说:" + user_input
-                tmp_ebd = self._get_embedding(tmp, **kwargs)
-            else:
-                tmp_ebd = embedding_with_role # Fallback if no context/mind flow
-            res = self._query_stm(tmp_ebd, **kwargs)
+            res = self.get_stm_info(user_input, embedding_with_role, **kwargs)
             if res:
                 info_messages.append(res)
-            query_types.discard('短期记忆')
+        info_messages.extend(self.get_typed_info(user_input, query_types, embedding, embedding_with_role, **kwargs))
 
+        return "\n".join(info_messages) if info_messages else "无查询结果"
+
+    def get_stm_info(self, user_input: str, embedding_with_role: np.ndarray, **kwargs) -> str:
+        """
+        查询短期记忆。查询向量由上一轮角色的想法、发言与本轮输入拼接而成，依赖当前上下文。
+
+        Args:
+            user_input: 用户输入。
+            embedding_with_role: "{user}说:{user_input}" 的嵌入向量，无上下文时作为查询向量。
+            **kwargs: 同 get_info_messages。
+
+        Returns:
+            短期记忆的查询结果字符串。
+        """
+        user = kwargs.get('user')
+        role = kwargs.get('role')
+        mind_flow = kwargs.get('mind_flow')
+        # Need context messages to replicate original logic for STM query input
+        context_messages = self._get_context_messages(**kwargs)
+        if len(context_messages) > 0 and len(mind_flow) > 0:
+            last_ctx_role = context_messages[-1].role if context_messages else role
+            tmp = f"{last_ctx_role}想:{list(mind_flow)[-1]}\n{last_ctx_role}说:{context_messages[-1].content if context_messages else ''}\n" + f"{user}说:" + user_input
+            tmp_ebd = self._get_embedding(tmp, **kwargs)
+        else:
+            tmp_ebd = embedding_with_role # Fallback if no context/mind flow
+        return self._query_stm(tmp_ebd, user_input=user_input, **kwargs)
+
+    def get_typed_info(self, user_input: str, query_types: Set[str], embedding: np.ndarray,
+                       embedding_with_role: np.ndarray, **kwargs) -> List[str]:
+        """
+        查询除短期记忆外的各类信息 (长期记忆与角色属性)，不依赖当前上下文。
+
+        Args:
+            user_input: 用户输入。
+            query_types: _query_identification 识别出的查询类型。
+            embedding: 用户输入的嵌入向量。
+            embedding_with_role: "{user}说:{user_input}" 的嵌入向量。
+            **kwargs: 同 get_info_messages。
+
+        Returns:
+            非空查询结果字符串的列表。
+        """
+        info_messages = []
         for query_type in query_types:
+            if query_type == '短期记忆':
+                continue
             if query_type == '长期记忆':
-                res = self._query_ltm(embedding_with_role, **kwargs)
+                res = self._query_ltm(embedding_with_role, user_input=user_input, **kwargs)
                 if res:
                     info_messages.append(res)
             elif query_type != '0':
@@ -169,8 +207,7 @@ class PromptInfoBuilder(ABC):
                 query_result = self._query_attr(embedding, attr, **kwargs)
                 if query_result:
                     info_messages.append(query_result)
-
-        return "\n".join(info_messages) if info_messages else "无查询结果"
+        return info_messages
 
     def get_style_message_content(self, user_input: str, **kwargs) -> str:
         """
@@ -131,7 +131,21 @@ class BaseCharacterChatbot(BaseChatbot, ABC):
         task = self._build_task(**kwargs)
         role_info = self._build_role_info(**kwargs)
         style = self._build_style(**kwargs)
+        return self._assemble_system_messages(task, role_info, style)
 
+    @staticmethod
+    def _assemble_system_messages(task: str, role_info: str, style: str) -> List[Dict[str, Any]]:
+        """
+        由任务、角色和风格信息组装系统信息 (可在各部分分别构建后单独调用)。
+
+        Args:
+            task: 任务描述。
+            role_info: 角色信息。
+            style: 说话风格描述。
+
+        Returns:
+            包含系统消息的字典列表。
+        """
         system_messages = []
         if task:
             system_messages.append({"role": "system", "content": "任务描述:\n" + task})
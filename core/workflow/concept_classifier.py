@@ -0,0 +1,120 @@
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    对单位向量做球面k-means，返回 (原型矩阵, 每个样本所属原型下标)。
+    以最远点法确定初始中心，结果是确定性的。
+    """
+    centers = [vectors[0]]
+    closest = vectors @ vectors[0]
+    for _ in range(1, k):
+        farthest = int(np.argmin(closest))
+        centers.append(vectors[farthest])
+        closest = np.maximum(closest, vectors @ vectors[farthest])
+    centers = np.stack(centers)
+
+    assignment = np.zeros(len(vectors), dtype=np.int64)
+    for iteration in range(iterations):
+        new_assignment = np.argmax(vectors @ centers.T, axis=1)
+        if iteration > 0 and np.array_equal(new_assignment, assignment):
+            break
+        assignment = new_assignment
+        for i in range(len(centers)):
+            members = vectors[assignment == i]
+            if len(members):
+                centers[i] = members.sum(axis=0)
+        centers = _normalize(centers)
+    return centers, assignment
+
+
+class ConceptPrototypeClassifier:
+    """
+    概念原型分类器：将每个概念的全部标准查询压缩为至多 max_prototypes 个原型向量。
+
+    每个原型记录其覆盖样本与原型相似度的中位数 c (凝聚度)。对高维嵌入，与某条样本
+    相似度为 T 的输入与其原型的相似度约为 T × c，因此以 T × c 作为该原型的校准阈值，
+    使识别结果贴近逐条比对 (原规则“与某条标准查询的相似度 >= T”)。T × c 是经验性的近似，
+    并未用真实输入校准，阈值附近的输入应交回逐条比对 (见 identify 的 uncertain_margin)；
+    识别开销为 O(原型数 × d)，与标准查询条数无关。
+    """
+
+    def __init__(self, query_to_attr: Dict[str, List[str]], query_embeddings: np.ndarray, max_prototypes: int = 4):
+        """
+        构建分类器。
+
+        Args:
+            query_to_attr: 标准查询到概念列表的映射，顺序与 query_embeddings 的行一致。
+            query_embeddings: 标准查询的嵌入矩阵。
+            max_prototypes: 每个概念的最大原型数。
+        """
+        vectors = _normalize(query_embeddings) if len(query_to_attr) else np.zeros((0, 0), dtype=np.float32)
+        rows_by_concept: Dict[str, List[int]] = {}
+        for row, attrs in enumerate(query_to_attr.values()):
+            for attr in attrs:
+                rows_by_concept.setdefault(attr, []).append(row)
+
+        prototypes, cohesions, labels = [], [], []
+        for concept, rows in rows_by_concept.items():
+            members = vectors[rows]
+            k = min(max_prototypes, len(members))
+            if k == 1:
+                centers, assignment = _normalize(members.sum(axis=0, keepdims=True)), np.zeros(len(members), dtype=np.int64)
+            else:
+                centers, assignment = _spherical_kmeans(members, k)
+            for i, center in enumerate(centers):
+                covered = members[assignment == i]
+                if not len(covered):
+                    continue
+                prototypes.append(center)
+                cohesions.append(float(np.median(covered @ center)))
+                labels.append(concept)
+
+        self.concepts: List[str] = list(rows_by_concept)
+        self.prototypes: np.ndarray = np.stack(prototypes) if prototypes else np.zeros((0, vectors.shape[-1]), dtype=np.float32)
+        self.cohesions: np.ndarray = np.asarray(cohesions, dtype=np.float32)
+        self.labels: List[str] = labels
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def thresholds(self, recall_threshold: float) -> np.ndarray:
+        """各原型在给定召回阈值下的校准阈值。"""
+        return recall_threshold * self.cohesions
+
+    def identify(self, query_vector: np.ndarray, recall_threshold: float, top_k: int = 3,
+                 uncertain_margin: float = 0.0) -> Optional[Set[str]]:
+        """
+        识别输入向量对应的概念。
+
+        Args:
+            query_vector: 输入的嵌入向量 (1×d 或 d)。
+            recall_threshold: 与逐条比对时相同含义的召回阈值。
+            top_k: 最多返回的概念数。
+            uncertain_margin: 任一原型的相似度与其校准阈值之差的绝对值小于该值时，
+                校准阈值 T×c 只是近似，结果不可靠，返回 None 由调用方改用逐条比对。
+
+        Returns:
+            超过校准阈值的概念中，按超出幅度排序的前 top_k 个；结果不可靠时为 None。
+        """
+        if not len(self.labels):
+            return set()
+        vector = _normalize(np.asarray(query_vector).reshape(-1))
+        margins = self.prototypes @ vector - self.thresholds(recall_threshold)
+        if uncertain_margin > 0 and np.any(np.abs(margins) < uncertain_margin):
+            return None
+        best: Dict[str, float] = {}
+        for index in np.nonzero(margins >= 0)[0]:
+            concept = self.labels[index]
+            if margins[index] > best.get(concept, -1.0):
+                best[concept] = float(margins[index])
+        ranked = sorted(best.items(), key=lambda x: x[1], reverse=True)
+        return {concept for concept, _ in ranked[:top_k]}
@@ -0,0 +1,136 @@
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.S)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"', "＂": '"'})
+
+
+def _strip_fences(text: str) -> str:
+    match = _FENCE.search(text)
+    if match:
+        text = match.group(1)
+    start = text.find("{")
+    return text[start:] if start >= 0 else text
+
+
+def _escape_control_chars(text: str) -> str:
+    """
+    转义字符串内部的裸换行与制表符 (模型常在长文本中直接换行)。
+    """
+    out = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            elif char == "\n":
+                char = "\\n"
+            elif char == "\r":
+                char = "\\r"
+            elif char == "\t":
+                char = "\\t"
+        elif char == '"':
+            in_string = True
+        out.append(char)
+    return "".join(out)
+
+
+_DANGLING_KEY = re.compile(r'[{,]\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+
+
+def _close_partial(text: str) -> List[str]:
+    """
+    补全被截断的JSON：闭合未结束的字符串与括号。末尾是否为没有值的键无法仅凭词法判断，
+    因此同时返回保留与去掉末尾键两种候选。
+    """
+    stack = []
+    in_string = escaped = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return [text[:i + 1]]
+    if escaped:
+        text = text[:-1]
+    if in_string:
+        text += '"'
+    closers = "".join(reversed(stack))
+    text = text.rstrip()
+    candidates = [text.rstrip(",") + closers]
+    match = _DANGLING_KEY.search(text)
+    if match:
+        candidates.append(text[:match.start() + 1].rstrip(",") + closers)
+    return candidates
+
+
+def parse_json_object(text: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    宽容地从模型输出中解析出一个JSON对象。
+
+    Returns:
+        (解析出的字典, 采用的修复方式)。无需修复时修复方式为 None；无法解析时字典为 None。
+        修复方式依次为 "fence" (去掉代码块标记或前后多余文本)、"syntax" (尾随逗号、中文引号、
+        字符串内的裸换行)、"partial" (补全被截断的对象)。
+    """
+    candidates = [(text.strip(), None)]
+    stripped = _strip_fences(text).strip()
+    candidates.append((stripped, "fence"))
+    repaired = _TRAILING_COMMA.sub(r"\1", _escape_control_chars(stripped.translate(_SMART_QUOTES)))
+    candidates.append((repaired, "syntax"))
+    candidates.extend((_TRAILING_COMMA.sub(r"\1", partial), "partial") for partial in _close_partial(repaired))
+    for candidate, repair in candidates:
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            return value, repair
+    return None, None
+
+
+class ResponseParseMetrics:
+    """
+    模型回应解析情况的计数：直接解析、各类修复、LangChain兜底与彻底失败。
+    格式说明本身要求代码块包裹，因此 "fence" 视为正常解析，不计入修复率。
+    """
+
+    OUTCOMES = ("direct", "fence", "syntax", "partial", "langchain", "failed")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {outcome: 0 for outcome in self.OUTCOMES}
+
+    def record(self, outcome: str):
+        with self._lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        repaired = counts["syntax"] + counts["partial"]
+        return {
+            "total": total,
+            "counts": counts,
+            "repair_rate": repaired / total if total else 0.0,
+            "failure_rate": counts["failed"] / total if total else 0.0,
+        }
@@ -0,0 +1,74 @@
+from collections import deque
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+
+class AhoCorasickMatcher:
+    """
+    多模式字符串匹配器 (Aho-Corasick 自动机)。
+
+    构建一次后，对任意输入只需单次线性扫描即可找出其中出现的全部模式串，
+    与模式数量无关。每个模式串可关联多个标签 (如查询所属的概念)。
+    """
+
+    def __init__(self, patterns: Dict[str, Iterable[Hashable]]):
+        """
+        构建自动机。
+
+        Args:
+            patterns: 模式串到其标签集合的映射，空串会被忽略。
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[str]] = [[]]
+        self.labels: Dict[str, Tuple[Hashable, ...]] = {}
+
+        for pattern, labels in patterns.items():
+            if not pattern:
+                continue
+            self.labels[pattern] = tuple(dict.fromkeys(labels))
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._outputs.append([])
+                state = next_state
+            self._outputs[state].append(pattern)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                candidate = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = candidate if candidate != next_state else 0
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+
+    def __bool__(self) -> bool:
+        return bool(self.labels)
+
+    def find(self, text: str) -> List[str]:
+        """
+        找出text中出现的全部模式串。
+
+        Args:
+            text: 待匹配文本。
+
+        Returns:
+            去重后的模式串列表，按首次出现的结束位置排序。
+        """
+        found = {}
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern in self._outputs[state]:
+                found.setdefault(pattern, None)
+        return list(found)
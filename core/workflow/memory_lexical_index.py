@@ -0,0 +1,148 @@
+import math
+import re
+import threading
+from collections import Counter
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def char_ngrams(text: str, ngram_sizes: Iterable[int] = (1, 2)) -> Counter:
+    """
+    将文本切分为字符n-gram (忽略标点与空白，英文转小写)。
+    不分词，因此对中文人名、地名等专有名词同样有效。
+    """
+    grams = Counter()
+    for chunk in _NON_WORD.split(text.lower()):
+        for n in ngram_sizes:
+            for i in range(len(chunk) - n + 1):
+                grams[chunk[i:i + n]] += 1
+    return grams
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[Hashable]], k: int = 60) -> Dict[Hashable, float]:
+    """
+    倒数排名融合：score(d) = Σ 1 / (k + rank_i(d))，rank 从1开始。
+    """
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+class CharNgramBM25Index:
+    """
+    记忆单元内容的字符n-gram BM25倒排索引，支持增量添加与删除。
+
+    每个记忆单元可附带其所属会话id，检索时可按会话过滤 (如短期记忆只看当前会话)。
+    """
+
+    def __init__(self, ngram_sizes: Tuple[int, ...] = (1, 2), k1: float = 1.2, b: float = 0.75):
+        """
+        初始化索引。
+
+        Args:
+            ngram_sizes: 使用的n-gram长度。
+            k1: BM25词频饱和参数。
+            b: BM25文档长度归一化参数。
+        """
+        self.ngram_sizes = tuple(ngram_sizes)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_grams: Dict[str, Counter] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._doc_session: Dict[str, Optional[str]] = {}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def __contains__(self, unit_id: str) -> bool:
+        return unit_id in self._doc_len
+
+    def add(self, unit_id: str, text: str, session_id: Optional[str] = None):
+        """
+        添加 (或替换) 一个记忆单元。
+        """
+        grams = char_ngrams(text or "", self.ngram_sizes)
+        with self._lock:
+            self._remove_locked(unit_id)
+            self._doc_grams[unit_id] = grams
+            self._doc_len[unit_id] = sum(grams.values())
+            self._doc_session[unit_id] = session_id
+            self._total_len += self._doc_len[unit_id]
+            for gram, tf in grams.items():
+                self._postings.setdefault(gram, {})[unit_id] = tf
+
+    def remove(self, unit_id: str):
+        with self._lock:
+            self._remove_locked(unit_id)
+
+    def remove_session(self, session_id: str):
+        """
+        删除属于某会话的全部记忆单元。
+        """
+        with self._lock:
+            for unit_id in [u for u, s in self._doc_session.items() if s == session_id]:
+                self._remove_locked(unit_id)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_grams.clear()
+            self._doc_len.clear()
+            self._doc_session.clear()
+            self._total_len = 0
+
+    def _remove_locked(self, unit_id: str):
+        grams = self._doc_grams.pop(unit_id, None)
+        if grams is None:
+            return
+        self._total_len -= self._doc_len.pop(unit_id)
+        self._doc_session.pop(unit_id, None)
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.pop(unit_id, None)
+                if not posting:
+                    del self._postings[gram]
+
+    def search(self, query: str, k: int = 10,
+               session_filter: Optional[Callable[[Optional[str]], bool]] = None) -> List[Tuple[str, float, float]]:
+        """
+        检索与查询文本最相关的记忆单元。
+
+        Args:
+            query: 查询文本。
+            k: 最多返回的条数。
+            session_filter: 以会话id为参数的过滤函数，返回False的单元被排除。
+
+        Returns:
+            [(记忆单元id, BM25得分, 覆盖率), ...]，按得分降序。覆盖率为命中的查询n-gram
+            按idf加权后占全部查询n-gram的比例，取值0~1，便于设置与文档集规模无关的阈值。
+        """
+        query_grams = char_ngrams(query or "", self.ngram_sizes)
+        with self._lock:
+            n_docs = len(self._doc_len)
+            if not n_docs or not query_grams:
+                return []
+            avg_len = self._total_len / n_docs or 1.0
+            scores: Dict[str, float] = {}
+            matched: Dict[str, float] = {}
+            total_weight = 0.0
+            for gram, qtf in query_grams.items():
+                posting = self._postings.get(gram, {})
+                idf = math.log(1.0 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                total_weight += idf * qtf
+                for unit_id, tf in posting.items():
+                    if session_filter is not None and not session_filter(self._doc_session.get(unit_id)):
+                        continue
+                    norm = self.k1 * (1.0 - self.b + self.b * self._doc_len[unit_id] / avg_len)
+                    scores[unit_id] = scores.get(unit_id, 0.0) + qtf * idf * tf * (self.k1 + 1.0) / (tf + norm)
+                    matched[unit_id] = matched.get(unit_id, 0.0) + idf * qtf
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+        return [(unit_id, score, matched[unit_id] / total_weight if total_weight else 0.0)
+                for unit_id, score in ranked]
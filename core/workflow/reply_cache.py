@@ -0,0 +1,136 @@
+import copy
+import hashlib
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+
+def fingerprint(*parts: str) -> str:
+    """
+    由若干文本片段计算稳定的指纹。
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class _Entry:
+    __slots__ = ("vector", "key", "response", "created", "last_served", "uses")
+
+    def __init__(self, vector: np.ndarray, key: tuple, response: Dict[str, Any], now: float):
+        self.vector = vector
+        self.key = key
+        self.response = response
+        self.created = now
+        self.last_served = 0.0
+        self.uses = 0
+
+
+class SemanticReplyCache:
+    """
+    语义回复缓存：相同角色描述与上下文指纹下，对语义几乎相同的输入复用已生成的回应。
+
+    为避免回复显得重复：同一输入簇至少积累 min_variants 条不同回应后才开始命中，
+    命中时轮换提供最久未用的一条 (不会连续两次给出同一条)，每条回应有 TTL 与使用次数上限。
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: List[_Entry] = []
+        self._last_served: Optional[_Entry] = None
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _matches(self, vector: np.ndarray, key: tuple, threshold: float, ttl: float, max_uses: int,
+                 now: float) -> List[_Entry]:
+        self._entries = [e for e in self._entries if now - e.created <= ttl and e.uses < max_uses]
+        candidates = [e for e in self._entries if e.key == key]
+        if not candidates:
+            return []
+        similarities = np.stack([e.vector for e in candidates]) @ vector
+        return [e for e, sim in zip(candidates, similarities) if sim >= threshold]
+
+    def lookup(self, vector: np.ndarray, key: tuple, threshold: float = 0.95, ttl: float = 1800,
+               min_variants: int = 2, max_uses: int = 3) -> Optional[Dict[str, Any]]:
+        """
+        查找可复用的回应。
+
+        Args:
+            vector: 输入的嵌入向量。
+            key: 必须完全相同的部分 (角色描述哈希、上下文指纹、输出模式等)。
+            threshold: 输入相似度阈值。
+            ttl: 回应的存活秒数。
+            min_variants: 同一输入簇至少有多少条不同回应才开始命中。
+            max_uses: 每条回应最多被复用的次数。
+
+        Returns:
+            回应的副本，未命中时为 None。
+        """
+        now = time.time()
+        with self._lock:
+            matches = self._matches(self._normalize(vector), key, threshold, ttl, max_uses, now)
+            fresh = [e for e in matches if e is not self._last_served]
+            if len(matches) < max(min_variants, 1) or not fresh:
+                self.misses += 1
+                return None
+            entry = min(fresh, key=lambda e: e.last_served)
+            entry.last_served = now
+            entry.uses += 1
+            self._last_served = entry
+            self.hits += 1
+            return copy.deepcopy(entry.response)
+
+    def store(self, vector: np.ndarray, key: tuple, response: Dict[str, Any], threshold: float = 0.95,
+              ttl: float = 1800, max_variants: int = 4, max_uses: int = 3):
+        """
+        存入一条新生成的回应。同一输入簇超过 max_variants 条时替换最旧的一条。
+        """
+        now = time.time()
+        vector = self._normalize(vector)
+        with self._lock:
+            matches = self._matches(vector, key, threshold, ttl, max_uses, now)
+            if any(e.response.get('speak') == response.get('speak') for e in matches):
+                return
+            if len(matches) >= max_variants:
+                self._entries.remove(min(matches, key=lambda e: e.created))
+            entry = _Entry(vector, key, copy.deepcopy(response), now)
+            self._entries.append(entry)
+            self._last_served = entry
+            if len(self._entries) > self.max_entries:
+                self._entries.pop(0)
+            self.stores += 1
+
+    def discard_last_served(self):
+        """
+        丢弃最近一次提供或存入的回应 (如用户对其点击了重新生成)。
+        """
+        with self._lock:
+            if self._last_served in self._entries:
+                self._entries.remove(self._last_served)
+            self._last_served = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._last_served = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
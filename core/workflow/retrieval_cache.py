@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+import numpy as np
+
+
+class RetrievalCache:
+    """
+    跨轮次的记忆检索结果缓存。
+
+    键由检索范围、量化后的查询向量与查询参数组成，因此同一话题下几乎相同的查询会命中同一条目。
+    每个范围 (如 "stm"、"ltm") 各有一个写版本号，条目记录写入时所属范围的版本号；
+    某个范围发生写入 (bump) 后只有该范围的旧条目失效。当前会话每轮的写入只影响短期记忆，
+    长期记忆的条目因此可以跨轮次复用，直到总结、会话切换或外部编辑。
+    """
+
+    def __init__(self, max_entries: int = 256, quantization_step: float = 0.02):
+        """
+        初始化缓存。
+
+        Args:
+            max_entries: 最多保留的条目数，超出时淘汰最久未使用的条目。
+            quantization_step: 归一化查询向量各分量的量化步长，越大越容易命中。
+        """
+        self.max_entries = max_entries
+        self.quantization_step = quantization_step
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[Tuple[int, int], Any]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self, *scopes: str):
+        """
+        记忆发生写入时调用：所给范围的写版本号加一，这些范围的现有条目全部失效。
+        不给范围时所有范围一起失效。
+        """
+        with self._lock:
+            if not scopes:
+                self._epoch += 1
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] in scopes]:
+                del self._entries[key]
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def version(self, scope: str) -> Tuple[int, int]:
+        """
+        返回某个范围当前的写版本号 (含全体失效的计数)，发起检索前读取，存入结果时交给 put。
+        """
+        with self._lock:
+            return self._version_locked(scope)
+
+    def _version_locked(self, scope: str) -> Tuple[int, int]:
+        return self._epoch, self._versions.get(scope, 0)
+
+    def make_key(self, scope: str, query_vector: Optional[np.ndarray], params: Dict[str, Any]) -> Hashable:
+        """
+        由检索范围、查询向量与查询参数生成缓存键。
+        """
+        if query_vector is None:
+            vector_key = None
+        else:
+            vector = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+            vector_key = np.round(vector / self.quantization_step).astype(np.int16).tobytes()
+        return scope, vector_key, repr(sorted(params.items()))
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Returns:
+            (是否命中, 缓存值)。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == self._version_locked(key[0]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def put(self, key: Hashable, value: Any, version: Optional[Tuple[int, int]] = None):
+        """
+        存入检索结果。version 为发起检索前读取的该范围写版本号，检索期间该范围若有写入则不缓存。
+        """
+        with self._lock:
+            current = self._version_locked(key[0])
+            if version is not None and version != current:
+                return
+            self._entries[key] = (current, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "write_epoch": self._epoch,
+                "write_versions": dict(self._versions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,6 +1,9 @@
 from typing import Dict, List, Union, Any, Set, Optional
 from datetime import datetime
-from collections import deque
+import inspect
+from collections import deque, OrderedDict
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
 from uuid import uuid4
 from langchain.schema import ChatMessage
@@ -8,9 +11,41 @@ from langchain.output_parsers import StructuredOutputParser, ResponseSchema
 
 from .base_chatbot import BaseCharacterChatbot
 from .auto_prompt import PromptInfoBuilder
+from .lexical_matcher import AhoCorasickMatcher
+from .concept_classifier import ConceptPrototypeClassifier
+from .memory_lexical_index import CharNgramBM25Index, reciprocal_rank_fusion
+from .retrieval_cache import RetrievalCache
+from .rolling_summarizer import RollingSessionSummarizer
+from .json_repair import parse_json_object, ResponseParseMetrics
+from .reply_cache import SemanticReplyCache, fingerprint
+from .turn_pipeline import TurnPipeline
+try:
+    from utils.character_bundle import find_character_bundle
+except ImportError:  # 角色包为可选功能，找不到 utils 时总是计算嵌入
+    find_character_bundle = None
 import json
 from collections import defaultdict
 
+# 结构化输出模式：字段顺序即要求模型输出的顺序，(字段名, 描述, 是否必需)
+# full: 每轮重写完整的情节总结 desc；delta: speak 在前便于流式输出，只输出情节增量并在本地合并，think 可省略；
+# lean: 只输出 speak 与情节增量。
+OUTPUT_MODES = {
+    "full": [
+        ("desc", "客观总结故事，要求完整保留前提紧要与上下文的情节", True),
+        ("think", "{role}的潜在思考、推理、决策，符号身份和语言风格", True),
+        ("speak", "角色说的话，不含任何用()括起的内容", True),
+    ],
+    "delta": [
+        ("speak", "角色说的话，不含任何用()括起的内容", True),
+        ("scene_delta", "本轮新增或发生变化的情节要点，一两句话，没有变化时为空字符串", False),
+        ("think", "(可省略){role}的潜在思考、推理、决策", False),
+    ],
+    "lean": [
+        ("speak", "角色说的话，不含任何用()括起的内容", True),
+        ("scene_delta", "本轮新增或发生变化的情节要点，一两句话，没有变化时为空字符串", False),
+    ],
+}
+
 
 class MemoryPromptInfoBuilder(PromptInfoBuilder):
     """
@@ -26,6 +61,8 @@ class MemoryPromptInfoBuilder(PromptInfoBuilder):
             answer_schema: Dict[str, List[str]],
             question_embeddings: np.ndarray,
             max_ctx_len: int = 10,
+            max_concept_prototypes: int = 4,
+            answer_embeddings: Optional[np.ndarray] = None,
     ):
         """
         初始化 MemoryPromptInfoBuilder。
@@ -38,6 +75,8 @@ class MemoryPromptInfoBuilder(PromptInfoBuilder):
             answer_schema: 根据查询结果构建回答风格的模式字典。
             question_embeddings: 回答风格模式的嵌入向量。
             max_ctx_len: 最大上下文长度 (默认为 10)。
+            max_concept_prototypes: 概念分类器中每个概念的最大原型数 (默认为 4)。
+            answer_embeddings: 逐条标准回答的嵌入向量，行顺序为 answer_schema 中回答依次展开的顺序。
         """
         self.memory_system = memory_system
         self.entity_attr = entity_attr
@@ -46,6 +85,213 @@ class MemoryPromptInfoBuilder(PromptInfoBuilder):
         self.answer_schema = answer_schema
         self.question_embeddings = question_embeddings
         self._max_ctx_len = max_ctx_len
+        # 风格索引：每条回答所属问题的下标与回答的嵌入向量，用于逐条挑选示例回答
+        self.answer_question_ids = np.asarray(
+            [i for i, answers in enumerate(answer_schema.values()) for _ in answers], dtype=np.int64)
+        self.answer_texts = [answer for answers in answer_schema.values() for answer in answers]
+        self.answer_embeddings = answer_embeddings
+        self.lexical_matcher = self._build_lexical_matcher(query_to_attr, entity_attr)
+        # 概念分类器默认不使用，首次开启 concept_classifier 时才构建 (见 concept_classifier 属性)
+        self._max_concept_prototypes = max_concept_prototypes
+        self._concept_classifier: Optional[ConceptPrototypeClassifier] = None
+        self._concept_classifier_lock = threading.Lock()
+        # 记忆内容的字符n-gram BM25索引，由 RolePlayChatbot 在写入记忆时增量维护
+        self.memory_index = CharNgramBM25Index()
+        # 跨轮次检索缓存，按 "stm"/"ltm" 分范围失效：当前会话的写入只 bump('stm')，
+        # 总结、会话切换与外部编辑记忆时 bump() 全部范围
+        self.retrieval_cache = RetrievalCache()
+        # 摘要id -> 摘要记忆单元，重新总结或外部编辑记忆后清空
+        self.summary_cache: Dict[str, Any] = {}
+        # 最近若干条单条文本的嵌入，同一轮中回复缓存、属性查询与风格选择共用
+        self._embedding_memo: OrderedDict = OrderedDict()
+        self._embedding_memo_lock = threading.Lock()
+
+    @property
+    def concept_classifier(self) -> ConceptPrototypeClassifier:
+        """
+        概念原型分类器，首次访问时由 query_to_attr 与 query_embeddings 构建。
+        """
+        if self._concept_classifier is None:
+            with self._concept_classifier_lock:
+                if self._concept_classifier is None:
+                    self._concept_classifier = ConceptPrototypeClassifier(
+                        self.query_to_attr, self.query_embeddings, self._max_concept_prototypes)
+        return self._concept_classifier
+
+    @staticmethod
+    def _build_lexical_matcher(query_to_attr: Dict[str, List[str]],
+                               entity_attr: Dict[str, List[str]]) -> AhoCorasickMatcher:
+        """
+        由标准查询语句和属性名构建词法匹配器。idea_to-<角色> 类属性以角色名作为模式串。
+        """
+        patterns = defaultdict(list)
+        for query, attrs in query_to_attr.items():
+            patterns[query].extend(attrs)
+        for attr in entity_attr:
+            name = attr[len('idea_to-'):] if attr.startswith('idea_to-') else attr
+            patterns[name].append(attr)
+        return AhoCorasickMatcher(patterns)
+
+    def _lexical_identification(self, user_input: str, min_pattern_len: int = 2,
+                                confident_pattern_len: int = 4) -> tuple:
+        """
+        词法路径：用户输入直接包含标准查询语句或属性名时，由命中的模式串确定查询类型。
+        与向量路径一致，最多取最长的3个命中模式串对应的概念。
+
+        Returns:
+            (概念集合, 是否可信)。命中完整的标准查询语句，或命中长度不小于 confident_pattern_len
+            的模式串时才算可信，可跳过向量路径；仅命中较短的属性名/角色名时需与向量路径的结果合并。
+        """
+        matches = [p for p in self.lexical_matcher.find(user_input) if len(p) >= min_pattern_len]
+        matches.sort(key=len, reverse=True)
+        attrs = set()
+        confident = False
+        for pattern in matches[:3]:
+            attrs.update(self.lexical_matcher.labels[pattern])
+            confident = confident or pattern in self.query_to_attr or len(pattern) >= confident_pattern_len
+        return attrs, confident
+
+    def _cached_query(self, kind: str, use_cache: bool = True, **query_kwargs) -> List[List[Any]]:
+        """
+        带缓存的 memory_system.query。kind ("stm" 或 "ltm") 同时是缓存的失效范围，
+        键为 kind、量化后的查询向量与其余查询参数。
+        """
+        if not use_cache:
+            return self.memory_system.query(**query_kwargs)
+        params = {key: value for key, value in query_kwargs.items() if key != 'query_vector'}
+        cache_key = self.retrieval_cache.make_key(kind, query_kwargs.get('query_vector'), params)
+        hit, sessions = self.retrieval_cache.get(cache_key)
+        if hit:
+            return sessions
+        version = self.retrieval_cache.version(kind)
+        sessions = self.memory_system.query(**query_kwargs)
+        self.retrieval_cache.put(cache_key, sessions, version)
+        return sessions
+
+    def _fetch_summaries(self, summary_ids: List[str]) -> Dict[str, Any]:
+        """
+        按id批量获取摘要记忆单元。摘要在重新总结前不会改变，因此按id缓存；
+        未缓存的id通过一次 "$in" 过滤查询取回。
+        """
+        found = {s: self.summary_cache[s] for s in summary_ids if s in self.summary_cache}
+        missing = [s for s in summary_ids if s not in found]
+        if missing:
+            try:
+                sessions = self.memory_system.query(filters=[{"id": {"$in": missing}}], k_limit=len(missing),
+                                                    search_range=None, recall_context=False, long_term_only=True,
+                                                    add_ltm_to_stm=True)
+            except Exception as e:
+                print(f"Warning: batched summary fetch failed ({e}), falling back to per-id queries.")
+                sessions = []
+                for summary_id in missing:
+                    sessions.extend(self.memory_system.query(filters=[{"id": {"$eq": summary_id}}], k_limit=1,
+                                                             search_range=None, recall_context=False,
+                                                             long_term_only=True, add_ltm_to_stm=True) or [])
+            for memories in sessions or []:
+                for mem in memories:
+                    self.summary_cache[mem.id] = mem
+                    if mem.id in missing:
+                        found[mem.id] = mem
+        return found
+
+    def _hybrid_sessions(self, sessions: List[List[Any]], query_text: Optional[str], k_limit: int,
+                         session_filter, **kwargs) -> List[List[Any]]:
+        """
+        将向量检索结果与BM25词法检索结果按倒数排名融合 (RRF)，返回至多 k_limit 组记忆。
+
+        向量结果中包含词法命中单元的组直接获得额外得分；仅被词法检索命中的单元需达到
+        memory_lexical_min_coverage 的覆盖率才会单独成组加入，避免引入无关记忆。
+        """
+        if not kwargs.get('hybrid_memory_retrieval', True) or not query_text or not len(self.memory_index):
+            return sessions
+        min_coverage = kwargs.get('memory_lexical_min_coverage', 0.2)
+        rrf_k = kwargs.get('memory_rrf_k', 60)
+
+        hits = self.memory_index.search(query_text, k=k_limit, session_filter=session_filter)
+        group_of = {}
+        for i, memories in enumerate(sessions):
+            for mem in memories:
+                group_of.setdefault(mem.id, ('vector', i))
+        lexical_ranking = []
+        for unit_id, _, coverage in hits:
+            key = group_of.get(unit_id)
+            if key is None:
+                if coverage < min_coverage:
+                    continue
+                key = ('lexical', unit_id)
+            if key not in lexical_ranking:
+                lexical_ranking.append(key)
+        if not lexical_ranking:
+            return sessions
+
+        vector_ranking = [('vector', i) for i in range(len(sessions))]
+        fused = reciprocal_rank_fusion([vector_ranking, lexical_ranking], k=rrf_k)
+        results = []
+        for kind, ref in sorted(fused, key=lambda key: fused[key], reverse=True):
+            if len(results) >= k_limit:
+                break
+            if kind == 'vector':
+                results.append(sessions[ref])
+                continue
+            try:
+                unit = self.memory_system._get_memory_unit(ref)
+            except Exception as e:
+                print(f"Warning: failed to load memory unit {ref} for lexical hit: {e}")
+                unit = None
+            if unit is None:
+                self.memory_index.remove(ref)
+            else:
+                results.append([unit])
+        return results
+
+    def _session_vectors(self, sessions: List[List[Any]]) -> np.ndarray:
+        """
+        每组记忆的归一化向量：优先使用记忆单元自带的嵌入取均值，缺失时对各组文本批量嵌入一次。
+        """
+        vectors = []
+        for memories in sessions:
+            embeddings = [getattr(mem, 'embedding', None) for mem in memories]
+            if any(e is None for e in embeddings):
+                vectors = None
+                break
+            vectors.append(np.mean([np.asarray(e, dtype=np.float32).reshape(-1) for e in embeddings], axis=0))
+        if vectors is None:
+            vectors = self.memory_system.get_embedding(
+                ["\n".join(mem.content for mem in memories) for memories in sessions])
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(sessions), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _refine_sessions(self, sessions: List[List[Any]], query_vector: np.ndarray, k_limit: int,
+                         **kwargs) -> List[List[Any]]:
+        """
+        召回后处理：去掉已在上下文窗口中的记忆单元，再以最大边际相关性 (MMR) 选出至多 k_limit 组。
+
+        MMR 依次选取 λ·相关度 - (1-λ)·与已选组的最大相似度 最高的一组；首组固定为排序第一的结果，
+        使融合排序的首选结果始终保留。
+        """
+        if kwargs.get('drop_context_overlap', True) and sessions:
+            context_ids = {unit.id for unit in self.memory_system.get_context(length=self._max_ctx_len)}
+            sessions = [[mem for mem in memories if mem.id not in context_ids] for memories in sessions]
+            sessions = [memories for memories in sessions if memories]
+        if len(sessions) <= k_limit or not kwargs.get('memory_mmr', True):
+            return sessions[:k_limit]
+
+        mmr_lambda = kwargs.get('memory_mmr_lambda', 0.5)
+        vectors = self._session_vectors(sessions)
+        query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        query = query / (np.linalg.norm(query) or 1.0)
+        relevance = vectors @ query
+        selected = [0]
+        redundancy = vectors @ vectors[0]
+        remaining = list(range(1, len(sessions)))
+        while remaining and len(selected) < k_limit:
+            scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy[remaining]
+            best = remaining.pop(int(np.argmax(scores)))
+            selected.append(best)
+            redundancy = np.maximum(redundancy, vectors @ vectors[best])
+        return [sessions[i] for i in selected]
 
     def _query_stm(self, query_vector: np.ndarray, **kwargs) -> str:
         """
@@ -55,18 +301,26 @@ class MemoryPromptInfoBuilder(PromptInfoBuilder):
         filters = kwargs.get('stm_query_filters')
         recall_context = kwargs.get('stm_recall_context', True)
         search_range = tuple(kwargs.get('stm_search_range', [0.70, None]))
+        fetch_count = k_limit * kwargs.get('memory_mmr_overfetch', 2) if kwargs.get('memory_mmr', True) else k_limit
 
         result = ""
         if self.memory_system.if_stm_enabled():
             results = []
-            sessions = self.memory_system.query(
+            sessions = self._cached_query(
+                'stm',
+                use_cache=kwargs.get('retrieval_cache', True),
                 query_vector=query_vector,
-                k_limit=k_limit,
+                k_limit=fetch_count,
                 filters=filters,
                 recall_context=recall_context,
                 search_range=search_range,
                 short_term_only=True
             )
+            if filters is None:
+                current_session = self.memory_system.get_current_sesssion_id()
+                sessions = self._hybrid_sessions(sessions or [], kwargs.get('user_input'), fetch_count,
+                                                 lambda session_id: session_id == current_session, **kwargs)
+            sessions = self._refine_sessions(sessions or [], query_vector, k_limit, **kwargs)
             if sessions:
                 print("有短期记忆")
                 result += f"system: 近期对话中有关的消息:\n"
@@ -88,20 +342,28 @@ class MemoryPromptInfoBuilder(PromptInfoBuilder):
         filters = kwargs.get('ltm_query_filters')
         recall_context = kwargs.get('ltm_recall_context', True)
         search_range = kwargs.get('ltm_search_range', (0.70, None))
+        fetch_count = k_limit * kwargs.get('memory_mmr_overfetch', 2) if kwargs.get('memory_mmr', True) else k_limit
 
         result = ""
         results = []
-        sessions = self.memory_system.query(
+        sessions = self._cached_query(
+            'ltm',
+            use_cache=kwargs.get('retrieval_cache', True),
             query_vector=query_vector,
-            k_limit=k_limit,
+            k_limit=fetch_count,
             filters=filters,
             recall_context=recall_context,
             search_range=search_range,
             long_term_only=True,
             add_ltm_to_stm=False
         )
-        summarized = []
-        have_summarization = False
+        if filters is None:
+            current_session = self.memory_system.get_current_sesssion_id()
+            sessions = self._hybrid_sessions(sessions or [], kwargs.get('user_input'), fetch_count,
+                                             lambda session_id: session_id != current_session, **kwargs)
+        sessions = self._refine_sessions(sessions or [], query_vector, k_limit, **kwargs)
+        summarized = {}
+        recalled_summaries = set()
         if sessions:
             print("有长期记忆")
             result += f"system: 历史对话中有关的消息:\n"
@@ -109,12 +371,11 @@ class MemoryPromptInfoBuilder(PromptInfoBuilder):
                 for mem in memories:
                     if mem.metadata['action'] != "summary":
                         if mem.parent_id is not None:
-                            summarized.append(mem.parent_id)
-        summarization = []
-        if not have_summarization and len(summarized) > 0:
-            summarization = self.memory_system.query(filters=[{"id":{"$eq", summarized[0]}}], k_limit=1,
-                                                     search_range=None, recall_context=False, long_term_only=True,
-                                                     add_ltm_to_stm=True)
+                            summarized.setdefault(mem.parent_id, None)
+                    else:
+                        recalled_summaries.add(mem.id)
+        summary_units = self._fetch_summaries([s for s in summarized if s not in recalled_summaries])
+        summarization = [[summary_units[s]] for s in summarized if s in summary_units]
         for i, memories in enumerate(sessions + summarization):
             results.append(f"{i}:" + "(\n\t" + "\n".join(
                 [f"{mem.source}-{mem.metadata['action']}: {mem.content}" for mem in memories]) + "\t\n)")
@@ -173,14 +434,40 @@ class MemoryPromptInfoBuilder(PromptInfoBuilder):
         """
         获取文本的嵌入向量。
         """
-        return self.memory_system.get_embedding(text)
+        if not isinstance(text, str):
+            return self.memory_system.get_embedding(text)
+        with self._embedding_memo_lock:
+            embedding = self._embedding_memo.get(text)
+        if embedding is None:
+            embedding = self.memory_system.get_embedding(text)
+            self._remember_embedding(text, embedding)
+        return embedding
+
+    def _remember_embedding(self, text: str, embedding: np.ndarray, max_entries: int = 8):
+        with self._embedding_memo_lock:
+            self._embedding_memo[text] = embedding
+            self._embedding_memo.move_to_end(text)
+            while len(self._embedding_memo) > max_entries:
+                self._embedding_memo.popitem(last=False)
+
+    def prime_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        用一次批量调用获取多条文本的嵌入并放入缓存，返回与 texts 对应的 (1, dim) 向量列表。
+        """
+        with self._embedding_memo_lock:
+            missing = [text for text in dict.fromkeys(texts) if text not in self._embedding_memo]
+        if missing:
+            vectors = np.asarray(self.memory_system.get_embedding(missing))
+            for i, text in enumerate(missing):
+                self._remember_embedding(text, vectors[i:i + 1])
+        return [self._get_embedding(text) for text in texts]
 
     def _get_context_messages(self, **kwargs) -> List[ChatMessage]:
         """
         获取上下文消息。
         """
         # print("len of context:\n"+str(len(self.memory_system.context)))
-        contexts = self.memory_system.get_context(length=self._max_ctx_len)
+        contexts = self.memory_system.get_context(length=kwargs.get('context_length', self._max_ctx_len))
         role = kwargs.get('role', 'ai')
         res = []
         mind_flow = kwargs.get('mind_flow', {})  # Get mind_flow from kwargs
@@ -203,7 +490,28 @@ class MemoryPromptInfoBuilder(PromptInfoBuilder):
         query_to_attr = kwargs.get('query_to_attr', self.query_to_attr)
         query_embeddings = kwargs.get('query_embeddings', self.query_embeddings)
         recall_attr_threshold = kwargs.get('recall_attr_threshold', 0.7)
-        embedding = self._get_embedding(user_input, **kwargs)
+
+        # 匹配器基于初始化时的 query_to_attr 构建，传入其他映射时只走向量路径
+        lexical_attrs = set()
+        if kwargs.get('lexical_query_match', True) and query_to_attr is self.query_to_attr and self.lexical_matcher:
+            lexical_attrs, confident = self._lexical_identification(
+                user_input, kwargs.get('lexical_min_pattern_len', 2), kwargs.get('lexical_confident_pattern_len', 4))
+            if confident:
+                return lexical_attrs
+
+        embedding = kwargs.get('user_input_embedding')
+        if embedding is None:
+            embedding = self._get_embedding(user_input, **kwargs)
+
+        # 原型分类器与逐条比对并不完全一致，默认关闭；开启后在阈值附近的输入仍改用逐条比对
+        if kwargs.get('concept_classifier', False) and query_to_attr is self.query_to_attr \
+                and query_embeddings is self.query_embeddings and len(self.concept_classifier):
+            attrs = self.concept_classifier.identify(embedding, recall_attr_threshold,
+                                                     uncertain_margin=kwargs.get('concept_classifier_margin', 0.05))
+            if attrs is not None:
+                attrs = attrs | lexical_attrs
+                return attrs if attrs else {}
+
         similarities = (embedding @ query_embeddings.T)[0]
         attrs_sim_tuples = []
         for attr, sim in zip(query_to_attr.values(), similarities):
@@ -213,30 +521,75 @@ class MemoryPromptInfoBuilder(PromptInfoBuilder):
         attrs = set()
         for i in range(min(3,len(attrs_sim_tuples))):
             attrs.update(attrs_sim_tuples[i][0])
+        attrs.update(lexical_attrs)
 
         # print("printing attrs:\n")
         # print(attrs)
         return attrs if attrs else {}
 
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """
+        粗略估计文本的token数：CJK字符按每字1个，其余按每4个字符1个。
+        """
+        cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uf900' <= ch <= '\uffef')
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def _select_style_exemplars(self, query_vector: np.ndarray, question_ids: List[int],
+                                max_exemplars: int) -> List[str]:
+        """
+        从命中问题的标准回答中，按与输入的相似度挑选至多 max_exemplars 条示例回答。
+        """
+        mask = np.isin(self.answer_question_ids, question_ids)
+        rows = np.nonzero(mask)[0]
+        if not len(rows):
+            return []
+        if self.answer_embeddings is not None and len(self.answer_embeddings) == len(self.answer_texts):
+            similarities = (query_vector @ self.answer_embeddings[rows].T).reshape(-1)
+            rows = rows[np.argsort(-similarities, kind='stable')]
+        return [self.answer_texts[row] for row in rows[:max_exemplars]]
+
     def _build_style_message_content(self, query_vector: np.ndarray, **kwargs) -> str:
         """
         构建说话风格信息的内容。
+        只放入与当前输入最相似的若干条示例回答，并受 style_max_tokens 的硬性上限约束。
         """
         answer_schema = kwargs.get('answer_schema', self.answer_schema)
         question_embeddings = kwargs.get('question_embeddings', self.question_embeddings)
         recall_style_threshold = kwargs.get('recall_style_threshold', 0.7)
+        max_exemplars = kwargs.get('style_max_exemplars', 3)
+        max_tokens = kwargs.get('style_max_tokens', 256)
 
-        results = []
         similarities = (query_vector @ question_embeddings.T)[0]
         questions = []
-        for question, sim in zip(answer_schema.keys(), similarities):
+        for question_id, (question, sim) in enumerate(zip(answer_schema.keys(), similarities)):
             if sim >= recall_style_threshold:
-                questions.append((question, float(sim)))
+                questions.append((question_id, question, float(sim)))
+
+        questions.sort(key=lambda x: x[2], reverse=True)
+        questions = questions[:2]
+        if answer_schema is self.answer_schema:
+            exemplars = self._select_style_exemplars(query_vector, [q[0] for q in questions], max_exemplars)
+        else:
+            exemplars = [answer for _, question, _ in questions for answer in answer_schema.get(question, [])]
+            exemplars = exemplars[:max_exemplars]
 
-        questions.sort(key=lambda x: x[1], reverse=True)
-        for question, _ in questions[:2]:
-            # results.append(" q: " + question + "\n a: " + json.dumps(answer_schema.get(question, [])))
-            results.append(json.dumps(answer_schema.get(question, [])))
+        results = []
+        used_tokens = 0
+        for exemplar in exemplars:
+            line = json.dumps(exemplar, ensure_ascii=False)
+            cost = self._estimate_tokens(line)
+            if used_tokens + cost > max_tokens:
+                if not results:
+                    # 第一条就超出上限时截断，保证至少有一条示例
+                    text = str(exemplar)
+                    while text and self._estimate_tokens(json.dumps(text, ensure_ascii=False)) > max_tokens:
+                        text = text[:len(text) - max(len(text) // 8, 1)]
+                    if text:
+                        results.append(json.dumps(text, ensure_ascii=False))
+                break
+            results.append(line)
+            used_tokens += cost
         if results:
             return "(\n\t" + "\n".join(results) + "\t\n)"
         else:
@@ -258,7 +611,9 @@ class RolePlayChatbot(BaseCharacterChatbot):
             answer_schema: Dict[str, List[str]],
             memory_system: 'MemorySystem',
             max_ctx_len: int = 10,
-            summarizing_prompt: str = None
+            summarizing_prompt: str = None,
+            precomputed_embeddings: Optional[Dict[str, Any]] = None,
+            character_bundle_dir: Optional[str] = None
     ):
         """
         初始化RolePlayChatbot。
@@ -274,6 +629,10 @@ class RolePlayChatbot(BaseCharacterChatbot):
             memory_system: 记忆系统实例。
             max_ctx_len: 最大上下文长度 (默认为 10).
             summarizing_prompt: 总结用的提示词.
+            precomputed_embeddings: 预先计算好的嵌入 (见 from_bundle)，包含 'desc_embeddings'、
+                'query_embeddings'、'question_embeddings' 及可选的 'answer_embeddings'；提供时不再调用嵌入模型。
+            character_bundle_dir: 编译好的角色包目录 (INIT_CONFIG.character_bundle_dir)。其中该角色的角色包
+                若正是由相同的 entity_attr/query_schema/answer_schema 编译而来，则直接使用其嵌入，否则照常计算。
         """
         super().__init__(user=user, role=role)
         self.llm = llm
@@ -287,19 +646,38 @@ class RolePlayChatbot(BaseCharacterChatbot):
         self.answer_schema: Dict[str, List[str]] = answer_schema
         self._mind_flow: Dict[str, Any] = {}
         self._mind_ids: deque = deque()
-
-        self.desc_embeddings: Dict[str, np.ndarray] = {}
-        for attr, descs in self.entity_attr.items():
-            self.desc_embeddings[attr] = self.memory_system.get_embedding(descs)
+        self._memory_index_loaded = False
 
         for attr, queries in query_schema.items():
             for query in queries:
                 self.query_to_attr[query].append(attr)
 
-        self.query_embeddings: np.ndarray = self.memory_system.get_embedding(
-            list(self.query_to_attr.keys()))
-        self.question_embeddings: np.ndarray = self.memory_system.get_embedding(
-            list(answer_schema.keys()))
+        self.loaded_from_bundle = False
+        if precomputed_embeddings is None and character_bundle_dir and find_character_bundle is not None:
+            bundle = find_character_bundle(character_bundle_dir, role, entity_attr, query_schema, answer_schema)
+            if bundle is not None:
+                precomputed_embeddings = self._bundle_embeddings(bundle)
+                self.loaded_from_bundle = True
+
+        if precomputed_embeddings is not None:
+            self.desc_embeddings: Dict[str, np.ndarray] = dict(precomputed_embeddings['desc_embeddings'])
+            self.query_embeddings: np.ndarray = precomputed_embeddings['query_embeddings']
+            self.question_embeddings: np.ndarray = precomputed_embeddings['question_embeddings']
+            self.answer_embeddings: Optional[np.ndarray] = precomputed_embeddings.get('answer_embeddings')
+            if len(self.query_embeddings) != len(self.query_to_attr) or \
+                    len(self.question_embeddings) != len(answer_schema):
+                raise ValueError("precomputed_embeddings do not match query_schema/answer_schema")
+        else:
+            self.desc_embeddings: Dict[str, np.ndarray] = {}
+            for attr, descs in self.entity_attr.items():
+                self.desc_embeddings[attr] = self.memory_system.get_embedding(descs)
+
+            self.query_embeddings: np.ndarray = self.memory_system.get_embedding(
+                list(self.query_to_attr.keys()))
+            self.question_embeddings: np.ndarray = self.memory_system.get_embedding(
+                list(answer_schema.keys()))
+            answers = [answer for answers in answer_schema.values() for answer in answers]
+            self.answer_embeddings: Optional[np.ndarray] = self.memory_system.get_embedding(answers) if answers else None
 
         self.prompt_info_builder = MemoryPromptInfoBuilder(
             memory_system=self.memory_system,
@@ -308,20 +686,88 @@ class RolePlayChatbot(BaseCharacterChatbot):
             query_embeddings=self.query_embeddings,
             answer_schema=self.answer_schema,
             question_embeddings=self.question_embeddings,
-            max_ctx_len=self._max_ctx_len
+            max_ctx_len=self._max_ctx_len,
+            answer_embeddings=self.answer_embeddings
         )
 
-        self.structured_parser = StructuredOutputParser.from_response_schemas([
-            ResponseSchema(name="desc", description=f"客观总结故事，要求完整保留前提紧要与上下文的情节"),
-            ResponseSchema(name="think", description=f"{self.role}的潜在思考、推理、决策，符号身份和语言风格"),
-            ResponseSchema(name="speak", description=f"角色说的话，不含任何用()括起的内容"),
-        ])
+        # 各输出模式的 (格式说明用解析器, 只含必需字段的校验用解析器)
+        self.output_parsers: Dict[str, tuple] = {}
+        for mode, fields in OUTPUT_MODES.items():
+            schemas = [ResponseSchema(name=name, description=desc.format(role=self.role)) for name, desc, _ in fields]
+            required = [schema for schema, (_, _, is_required) in zip(schemas, fields) if is_required]
+            self.output_parsers[mode] = (StructuredOutputParser.from_response_schemas(schemas),
+                                         StructuredOutputParser.from_response_schemas(required))
+        self.structured_parser = self.output_parsers["full"][0]
+        self._scene_desc_before_turn = ""
+        self.parse_metrics = ResponseParseMetrics()
+        self._json_mode_supported = True
+        self._last_parse_failed = False
+        self.reply_cache = SemanticReplyCache()
+        # 按需创建，close() 时关闭；关闭后再次对话会重新创建
+        self._turn_executor: Optional[ThreadPoolExecutor] = None
+        self._turn_executor_lock = threading.Lock()
+        # 记忆系统 (MemForest/SQLite) 未保证线程安全：并发执行的各阶段中，读写记忆系统的部分在此锁下串行
+        self._memory_lock = threading.RLock()
+        self._last_turn_timings: Dict[str, Any] = {}
 
         self.latest_user_input = None
         self.latest_role_output = None
         self.latest_role_output_id = None
 
         self.summarizing_prompt = summarizing_prompt
+        self.rolling_summarizer = RollingSessionSummarizer(llm)
+        self._external_summary_supported: Optional[bool] = None
+
+    @classmethod
+    def from_bundle(
+            cls,
+            llm: 'BaseChatModel',
+            user: str,
+            role_description: str,
+            bundle: 'CharacterBundle',
+            memory_system: 'MemorySystem',
+            max_ctx_len: int = 10,
+            summarizing_prompt: str = None
+    ) -> 'RolePlayChatbot':
+        """
+        由编译好的角色包 (utils.character_bundle) 构建RolePlayChatbot，不解析JSON也不调用嵌入模型。
+
+        Args:
+            llm: 继承自BaseChatModel的语言模型实例。
+            user: 用户名称。
+            role_description: 角色的详细描述。
+            bundle: load_character_bundle 返回的角色包。
+            memory_system: 记忆系统实例。
+            max_ctx_len: 最大上下文长度 (默认为 10).
+            summarizing_prompt: 总结用的提示词.
+
+        Returns:
+            RolePlayChatbot实例。
+        """
+        chatbot = cls(
+            llm=llm,
+            role=bundle.role,
+            user=user,
+            role_description=role_description,
+            entity_attr=bundle.entity_attr,
+            query_schema=bundle.query_schema,
+            answer_schema=bundle.answer_schema,
+            memory_system=memory_system,
+            max_ctx_len=max_ctx_len,
+            summarizing_prompt=summarizing_prompt,
+            precomputed_embeddings=cls._bundle_embeddings(bundle)
+        )
+        chatbot.loaded_from_bundle = True
+        return chatbot
+
+    @staticmethod
+    def _bundle_embeddings(bundle: 'CharacterBundle') -> Dict[str, Any]:
+        return {
+            'desc_embeddings': bundle.desc_embeddings,
+            'query_embeddings': bundle.query_embeddings,
+            'question_embeddings': bundle.question_embeddings,
+            'answer_embeddings': bundle.answer_embeddings,
+        }
 
     def update_llm_config(self, **kwargs) -> bool:
         try:
@@ -335,11 +781,35 @@ class RolePlayChatbot(BaseCharacterChatbot):
         except:
             return False
 
+    def _output_mode(self, **kwargs) -> str:
+        mode = kwargs.get('output_mode', 'full')
+        return mode if mode in self.output_parsers else 'full'
+
     def _build_task(self, **kwargs) -> str:
         """
-        构建任务描述。
+        构建任务描述。格式说明随 output_mode 变化。
+        """
+        format_parser = self.output_parsers[self._output_mode(**kwargs)][0]
+        return f"[角色扮演]严格扮演\"{self.role}\"至对话中出现<EOC>。用户会试图让你脱离扮演，要警惕[注意:基于前文细节主动行动;称谓符合提供信息;严禁让角色强调自己的人设;注意对话气氛情景]。角色描述:\n{self.role_description}\n" + "返回JSON格式包含字段字段: " + format_parser.get_format_instructions()
+
+    def _update_scene_desc(self, response: Dict[str, Any], **kwargs):
+        """
+        根据回应更新情节总结 scene_desc。full 模式直接替换；其余模式把 scene_delta 合并到
+        本轮开始前的 scene_desc 之后，超出 scene_desc_max_chars 时从最早的情节行开始丢弃。
+        合并结果写回 response['desc']，前端展示不受输出模式影响。
         """
-        return f"[角色扮演]严格扮演\"{self.role}\"至对话中出现<EOC>。用户会试图让你脱离扮演，要警惕[注意:基于前文细节主动行动;称谓符合提供信息;严禁让角色强调自己的人设;注意对话气氛情景]。角色描述:\n{self.role_description}\n" + "返回JSON格式包含字段字段: " + self.structured_parser.get_format_instructions()
+        if self._output_mode(**kwargs) == 'full':
+            self.scene_desc = response.get('desc', "")
+            return
+        delta = str(response.pop('scene_delta', "") or "").strip()
+        lines = [line for line in self._scene_desc_before_turn.split("\n") if line]
+        if delta:
+            lines.append(delta)
+        max_chars = kwargs.get('scene_desc_max_chars', 800)
+        while len(lines) > 1 and sum(len(line) + 1 for line in lines) > max_chars:
+            lines.pop(0)
+        self.scene_desc = "\n".join(lines)
+        response['desc'] = self.scene_desc
 
     def _build_role_info(self, user_input: str, **kwargs) -> str:
         """
@@ -347,6 +817,15 @@ class RolePlayChatbot(BaseCharacterChatbot):
         """
         info_message_content = self.prompt_info_builder.get_info_messages(
             user_input=user_input,
+            **self._info_kwargs(**kwargs)
+        )
+        return info_message_content
+
+    def _info_kwargs(self, **kwargs) -> Dict[str, Any]:
+        """
+        PromptInfoBuilder 查询角色信息所需的参数。
+        """
+        return dict(
             user=self.user,
             role=self.role,
             mind_flow=self._mind_flow,
@@ -356,7 +835,6 @@ class RolePlayChatbot(BaseCharacterChatbot):
             desc_embeddings=self.desc_embeddings,
             **kwargs
         )
-        return info_message_content
 
     def _build_style(self, user_input: str, **kwargs) -> str:
         """
@@ -378,19 +856,171 @@ class RolePlayChatbot(BaseCharacterChatbot):
         )
         return f"模仿以下说话风格:\n{style_content}"
 
+    def _context_window(self, **kwargs) -> int:
+        """
+        滚动摘要器需保留原文的轮数：压缩上下文模式下为 context_verbatim_turns，否则为 max_ctx_len。
+        """
+        if kwargs.get('context_mode', 'window') == 'compressed':
+            return min(kwargs.get('context_verbatim_turns', 6), self._max_ctx_len)
+        return self._max_ctx_len
+
+    def _supports_external_summary(self) -> bool:
+        """
+        记忆系统的 summarize_session 是否接受 external_summary (结果在首次检查后缓存)。
+        """
+        if self._external_summary_supported is None:
+            try:
+                parameters = inspect.signature(self.memory_system.summarize_session).parameters
+                self._external_summary_supported = 'external_summary' in parameters
+            except (AttributeError, TypeError, ValueError):
+                self._external_summary_supported = False
+        return self._external_summary_supported
+
+    def _rolling_summary_active(self, **kwargs) -> bool:
+        """
+        滚动摘要只在有使用者时运行：压缩上下文模式，或记忆系统可接收外部摘要。
+        否则每隔 rolling_summary_interval 轮的后台LLM调用结果无人读取，直接跳过。
+        """
+        if not kwargs.get('rolling_summary', True):
+            return False
+        return kwargs.get('context_mode', 'window') == 'compressed' or self._supports_external_summary()
+
     def _get_context(self, **kwargs) -> List[ChatMessage]:
         """
         获取上下文消息。
         Uses PromptInfoBuilder to get context messages.
+
+        压缩上下文模式 (context_mode="compressed") 下，只保留最近的原文轮次，更早的轮次
+        由滚动摘要与要点代替；尚未折叠进摘要的轮次仍以原文保留 (不超过 max_ctx_len)。
         """
-        return self.prompt_info_builder._get_context_messages(
+        session_id = self.memory_system.get_current_sesssion_id()
+        if kwargs.get('context_mode', 'window') != 'compressed' or not self._rolling_summary_active(**kwargs) \
+                or self.rolling_summarizer.session_id != session_id:
+            return self.prompt_info_builder._get_context_messages(
+                role=self.role,
+                mind_flow=self._mind_flow,
+                **kwargs
+            )
+        length = min(max(self._context_window(**kwargs), self.rolling_summarizer.pending_turns()), self._max_ctx_len)
+        messages = self.prompt_info_builder._get_context_messages(
             role=self.role,
             mind_flow=self._mind_flow,
+            context_length=length,
             **kwargs
         )
+        summary = self.rolling_summarizer.render(kwargs.get('context_max_key_facts', 12))
+        if summary:
+            messages.insert(0, ChatMessage(role="system", content=f"[此前对话摘要]\n{summary}"))
+        return messages
 
     def ensure_initialized(self):
         self.memory_system.ensure_initialized()
+        if not self._memory_index_loaded:
+            self._load_memory_index()
+
+    def _load_memory_index(self):
+        """
+        用已持久化的对话记忆单元 (rank 0，其 group_id 即会话id) 构建BM25索引。
+        失败时仅打印警告，索引随后由新写入的记忆逐步补全。
+        """
+        self._memory_index_loaded = True
+        memory_index = self.prompt_info_builder.memory_index
+        try:
+            async def _load_units():
+                handler = self.memory_system._async_system.sqlite_handler
+                return await handler.load_all_memory_units(True) if handler else {}
+
+            units = self.memory_system._run_async_delegate(_load_units)
+            memory_index.clear()
+            for unit in units.values():
+                if unit.rank == 0 and unit.metadata.get('action') != 'summary':
+                    memory_index.add(unit.id, unit.content, unit.group_id)
+            print(f"Memory lexical index built with {len(memory_index)} units.")
+        except Exception as e:
+            print(f"Warning: could not build memory lexical index from storage: {e}")
+
+    def _add_memory(self, message: str, source: str, memory_unit_id: Optional[str] = None, **kwargs):
+        """
+        写入一条对话记忆，同步加入BM25索引，并交给滚动摘要器 (滚动摘要有使用者时，见 _rolling_summary_active)。
+        """
+        memory_unit_id = memory_unit_id or str(uuid4())
+        self.memory_system.add_memory(
+            message=message,
+            source=source,
+            creation_time=datetime.now(),
+            metadata={
+                "action": "speak",
+            },
+            memory_unit_id=memory_unit_id
+        )
+        session_id = self.memory_system.get_current_sesssion_id()
+        self.prompt_info_builder.memory_index.add(memory_unit_id, message, session_id)
+        # 当前会话的写入只改变短期记忆，长期记忆的检索缓存保留到总结或会话切换
+        self.prompt_info_builder.retrieval_cache.bump('stm')
+        if self._rolling_summary_active(**kwargs):
+            if self.rolling_summarizer.session_id != session_id:
+                self.rolling_summarizer.reset(session_id)
+            self.rolling_summarizer.observe(source, message, window=self._context_window(**kwargs),
+                                            interval=kwargs.get('rolling_summary_interval', 4))
+
+    def _store_rolling_summary(self, role: str, system_message, **kwargs) -> bool:
+        """
+        用滚动摘要完成当前会话的总结：只需对尚未折叠的少量轮次做一次增量总结，
+        再以 external_summary 交给记忆系统。滚动摘要未开启、不属于当前会话或记忆系统
+        不支持外部摘要时不做任何事。
+
+        Returns:
+            是否已用滚动摘要完成总结。
+        """
+        session_id = self.memory_system.get_current_sesssion_id()
+        if not kwargs.get('rolling_summary', True) or self.rolling_summarizer.session_id != session_id:
+            return False
+        if not self._supports_external_summary():
+            return False
+        summary = self.rolling_summarizer.flush()
+        if not summary:
+            return False
+        self.memory_system.summarize_session(session_id, role=role, system_message=system_message,
+                                             external_summary=summary)
+        self.prompt_info_builder.retrieval_cache.bump()
+        self.prompt_info_builder.summary_cache.clear()
+        return True
+
+    def notify_memory_changed(self):
+        """
+        记忆被外部 (如记忆编辑器) 修改后调用：使检索缓存失效，并在下次初始化时重建BM25索引。
+        """
+        self.prompt_info_builder.retrieval_cache.bump()
+        self.prompt_info_builder.summary_cache.clear()
+        self._memory_index_loaded = False
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        返回运行指标。
+        """
+        return {
+            "retrieval_cache": self.prompt_info_builder.retrieval_cache.stats(),
+            "response_parse": self.parse_metrics.stats(),
+            "reply_cache": self.reply_cache.stats(),
+            "last_turn_pipeline": self._last_turn_timings,
+        }
+
+    def _reply_cache_key(self, session_id: str, **kwargs) -> tuple:
+        """
+        回复缓存的精确匹配部分：角色描述哈希、当前会话id与输出模式。
+        不含逐轮变化的情节总结与上一句回应，否则同一句话只有在完全相同的上下文中重复出现才能命中；
+        会话内重复的输入 (如反复道晚安) 由 min_variants 与轮换提供避免回复显得重复。
+        """
+        return (fingerprint(self.role_description),
+                session_id,
+                self._output_mode(**kwargs))
+
+    def _reply_cache_params(self, **kwargs) -> Dict[str, Any]:
+        return {
+            "threshold": kwargs.get('reply_cache_threshold', 0.95),
+            "ttl": kwargs.get('reply_cache_ttl', 1800),
+            "max_uses": kwargs.get('reply_cache_max_uses', 3),
+        }
 
     def _build_prompts(self, user_input: str, **kwargs) -> List[ChatMessage]:
         """
@@ -404,8 +1034,15 @@ class RolePlayChatbot(BaseCharacterChatbot):
             包含构建好的prompts的ChatMessage列表。
         """
         system_messages_content = self._get_system_messages(user_input=user_input, **kwargs)
-        system_messages = [ChatMessage(role="system", content=msg["content"]) for msg in system_messages_content]
         context_messages = self._get_context(**kwargs)
+        return self._assemble_prompts(system_messages_content, context_messages, user_input)
+
+    def _assemble_prompts(self, system_messages_content: List[Dict[str, Any]], context_messages: List[ChatMessage],
+                          user_input: str) -> List[ChatMessage]:
+        """
+        由系统信息与上下文组装完整的prompts。
+        """
+        system_messages = [ChatMessage(role="system", content=msg["content"]) for msg in system_messages_content]
         context_template = f"下为对话上下文,回答严禁重复:\n"
         if self.scene_desc:
             context_template = f"[前提紧要]{self.scene_desc}\n[下为对话上下文,回答严禁重复]："
@@ -423,13 +1060,18 @@ class RolePlayChatbot(BaseCharacterChatbot):
             self._mind_ids.remove(self.latest_role_output_id)
         except:
             pass
+        # 重新生成本轮回应，情节从本轮开始前的状态出发
+        self.scene_desc = self._scene_desc_before_turn
+        if kwargs.get('reply_cache', False):
+            # 用户不满意的回应不再复用
+            self.reply_cache.discard_last_served()
         messages = self._build_prompts(user_input=self.latest_user_input, **kwargs)
         # for msg in messages:
         #     print(msg)
-        llm_response = self.llm.invoke(messages)
-        response = self._parse_and_validate_response(llm_response.content)
+        llm_response = self._invoke_llm(messages, **kwargs)
+        response = self._parse_and_validate_response(llm_response.content, **kwargs)
         print(response)
-        self.scene_desc = response.get('desc', "")
+        self._update_scene_desc(response, **kwargs)
         think_content = response.get('think', "")
         speak_content = response.get('speak', "")
 
@@ -458,61 +1100,38 @@ class RolePlayChatbot(BaseCharacterChatbot):
 
     def summarize_current_session(self, **kwargs):
         if self.latest_user_input is not None:
-            self.memory_system.add_memory(
-                message=self.latest_user_input,
-                source=f"{self.user}",
-                creation_time=datetime.now(),
-                metadata={
-                    "action": "speak",
-                }
-            )
+            self._add_memory(self.latest_user_input, f"{self.user}", **kwargs)
             self.latest_user_input = None
         if self.latest_role_output is not None:
-            self.memory_system.add_memory(
-                message=self.latest_role_output,
-                source=f"{self.role}",
-                creation_time=datetime.now(),
-                metadata={
-                    "action": "speak",
-                },
-                memory_unit_id=self.latest_role_output_id
-            )
+            self._add_memory(self.latest_role_output, f"{self.role}", self.latest_role_output_id, **kwargs)
             self.latest_role_output = None
         auto_summarize_system_message = kwargs.get("summarizing_prompt")
         auto_summarize_system_message = self.summarizing_prompt if not auto_summarize_system_message else auto_summarize_system_message
         # print(auto_summarize_system_message)
         role = kwargs.get("role", self.role)
-        self.memory_system.summarize_session(self.memory_system.get_current_sesssion_id(),role=role,system_message=auto_summarize_system_message)
+        if not self._store_rolling_summary(role, auto_summarize_system_message, **kwargs):
+            self.memory_system.summarize_session(self.memory_system.get_current_sesssion_id(),role=role,system_message=auto_summarize_system_message)
+            self.prompt_info_builder.retrieval_cache.bump()
+            self.prompt_info_builder.summary_cache.clear()
 
     def summarize_all_session(self, **kwargs):
         if self.latest_user_input is not None:
-            self.memory_system.add_memory(
-                message=self.latest_user_input,
-                source=f"{self.user}",
-                creation_time=datetime.now(),
-                metadata={
-                    "action": "speak",
-                }
-            )
+            self._add_memory(self.latest_user_input, f"{self.user}", **kwargs)
             self.latest_user_input = None
         if self.latest_role_output is not None:
-            self.memory_system.add_memory(
-                message=self.latest_role_output,
-                source=f"{self.role}",
-                creation_time=datetime.now(),
-                metadata={
-                    "action": "speak",
-                },
-                memory_unit_id=self.latest_role_output_id
-            )
+            self._add_memory(self.latest_role_output, f"{self.role}", self.latest_role_output_id, **kwargs)
             self.latest_role_output = None
         auto_summarize_system_message = kwargs.get("summarizing_prompt")
         auto_summarize_system_message = self.summarizing_prompt if not auto_summarize_system_message else auto_summarize_system_message
         role = kwargs.get("role", self.role)
         self.memory_system.summarize_long_term_memory(use_external_summary=False,role=role,system_message=auto_summarize_system_message)
+        self.prompt_info_builder.retrieval_cache.bump()
+        self.prompt_info_builder.summary_cache.clear()
 
     def start_new_session(self, auto_summarize = False, **kwargs):
         self.memory_system.start_session()
+        self.prompt_info_builder.retrieval_cache.bump()
+        self.rolling_summarizer.reset(self.memory_system.get_current_sesssion_id())
         self.latest_user_input = None
         self.latest_role_output = None
         self.latest_role_output_id = None
@@ -527,100 +1146,236 @@ class RolePlayChatbot(BaseCharacterChatbot):
         self.latest_role_output_id = None
         self._mind_flow.clear()
         self.memory_system.start_session(session_id)
+        self.prompt_info_builder.retrieval_cache.bump()
         history = []
         # self.memory_system._restore_session(session_id)
         for unit in self.memory_system.get_context():
             history.append({"role":unit.source,"content":unit.content})
+            self.prompt_info_builder.memory_index.add(unit.id, unit.content, session_id)
+        self.rolling_summarizer.reset(session_id, [(item["role"], item["content"]) for item in history])
         return history
 
     def clear_current_session(self, **kwargs):
-        self.memory_system.remove_session(self.memory_system.get_current_sesssion_id())
+        session_id = self.memory_system.get_current_sesssion_id()
+        self.memory_system.remove_session(session_id)
+        self.prompt_info_builder.memory_index.remove_session(session_id)
         self.latest_role_output_id = None
         self.latest_role_output = None
         self.latest_user_input = None
         self.scene_desc = ""
+        self._scene_desc_before_turn = ""
         self._mind_flow.clear()
         self._mind_ids.clear()
         self.memory_system.clear_context()
         self.memory_system.clear_all()
         self.memory_system.start_session()
+        self.prompt_info_builder.retrieval_cache.bump()
+        self.rolling_summarizer.reset(self.memory_system.get_current_sesssion_id())
+        self.prompt_info_builder.summary_cache.clear()
 
     def close(self, auto_summarize = False, **kwargs):
         if self.latest_user_input is not None:
-            self.memory_system.add_memory(
-                message=self.latest_user_input,
-                source=f"{self.user}",
-                creation_time=datetime.now(),
-                metadata={
-                    "action": "speak",
-                }
-            )
+            self._add_memory(self.latest_user_input, f"{self.user}", **kwargs)
             self.latest_user_input = None
         if self.latest_role_output is not None:
-            self.memory_system.add_memory(
-                message=self.latest_role_output,
-                source=f"{self.role}",
-                creation_time=datetime.now(),
-                metadata={
-                    "action": "speak",
-                },
-                memory_unit_id=self.latest_role_output_id
-            )
+            self._add_memory(self.latest_role_output, f"{self.role}", self.latest_role_output_id, **kwargs)
             self.latest_role_output = None
         auto_summarize_system_message = kwargs.get("summarizing_prompt")
         auto_summarize_system_message = self.summarizing_prompt if not auto_summarize_system_message else auto_summarize_system_message
         role = kwargs.get("role", self.role)
+        if auto_summarize and self._store_rolling_summary(role, auto_summarize_system_message, **kwargs):
+            # 会话已由滚动摘要完成总结
+            auto_summarize = False
         self.memory_system.close(auto_summarize=auto_summarize, system_message = auto_summarize_system_message, role = role)
+        self.prompt_info_builder.retrieval_cache.bump()
+        self.prompt_info_builder.summary_cache.clear()
+        self._shutdown_turn_executor()
+        self.rolling_summarizer.shutdown()
+
+
+    def _get_turn_executor(self) -> ThreadPoolExecutor:
+        """
+        返回各轮阶段共用的线程池，尚未创建或已被 close() 关闭时新建。
+        """
+        with self._turn_executor_lock:
+            if self._turn_executor is None:
+                self._turn_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chat-turn")
+            return self._turn_executor
+
+    def _shutdown_turn_executor(self):
+        """
+        等待进行中的阶段结束后关闭线程池，释放其工作线程。
+        """
+        with self._turn_executor_lock:
+            executor, self._turn_executor = self._turn_executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _persist_turn(self, user_input: Optional[str], role_output: Optional[str], role_output_id: Optional[str],
+                      **kwargs):
+        """
+        把一轮对话 (用户输入与角色回应) 写入记忆。在记忆锁下执行，可能在线程池中运行。
+        """
+        with self._memory_lock:
+            if user_input is not None:
+                self._add_memory(user_input, f"{self.user}", **kwargs)
+            if role_output is not None:
+                self._add_memory(role_output, f"{self.role}", role_output_id, **kwargs)
+
+    def _apply_role_description(self, role_description: Union[str, Future, None]):
+        """
+        采用本轮的角色描述 (可为尚未完成的 Future)，为空时沿用原描述。
+        """
+        if isinstance(role_description, Future):
+            role_description = role_description.result()
+        if isinstance(role_description, str) and role_description:
+            self.role_description = role_description
 
+    def _start_turn_pipeline(self, user_input: str, role_description: Union[str, Future, None],
+                             previous_turn: tuple, persist_future: Optional[Future] = None,
+                             **kwargs) -> TurnPipeline:
+        """
+        启动本轮LLM调用前的阶段依赖图，互不依赖的阶段并发执行，prompts 在其输入全部就绪后立即组装，
+        LLM调用前的耗时由各阶段之和缩短为最慢的一条依赖链：
+
+            role_desc -> task
+            persist (上一轮写入记忆) -> context
+            embed (一次批量嵌入) -> identify -> typed_info (长期记忆、角色属性)
+            persist + identify -> stm (短期记忆检索需包含上一轮)
+            embed -> style
+            task + stm + typed_info + style + context -> prompts
+
+        persist、stm、typed_info 与 context 会读写记忆系统，它们在 _memory_lock 下互斥执行
+        (各自的顺序仍由上图决定)；查询类型识别、风格与任务描述不访问记忆系统，嵌入只调用嵌入模型、
+        不读写存储，这些阶段与之并发。
+
+        Args:
+            user_input: 用户输入。
+            role_description: 本轮角色描述，可为调用方已提交的 Future (如 get_role_desc)。
+            previous_turn: 待持久化的上一轮 (用户输入, 角色回应, 回应id)。
+            persist_future: 已提交的上一轮持久化任务 (查回复缓存时提前提交)，为空时由本图提交。
+            **kwargs: 同 chat。
+
+        Returns:
+            已启动的 TurnPipeline，"prompts" 阶段的结果即完整的prompts。
+        """
+        builder = self.prompt_info_builder
+        info_kwargs = self._info_kwargs(**kwargs)
+        pipeline = TurnPipeline(self._get_turn_executor())
+        if isinstance(role_description, Future):
+            pipeline.add_future('role_desc', role_description)
+        else:
+            pipeline.add('role_desc', lambda: role_description)
+        if persist_future is not None:
+            pipeline.add_future('persist', persist_future)
+        else:
+            pipeline.add('persist', lambda: self._persist_turn(*previous_turn, **kwargs))
+        pipeline.add('embed', lambda: builder.prime_embeddings([user_input, f"{self.user}说:" + user_input]))
+
+        def _with_memory_lock(func):
+            def _run(*args):
+                with self._memory_lock:
+                    return func(*args)
+            return _run
+
+        def _task(desc):
+            self._apply_role_description(desc)
+            return self._build_task(**kwargs)
+
+        def _stm(_, embeddings, query_types):
+            if '短期记忆' not in query_types:
+                return None
+            return builder.get_stm_info(user_input, embeddings[1], **info_kwargs)
+
+        def _prompts(task, stm, typed_info, style, context):
+            info_messages = ([stm] if stm else []) + typed_info
+            role_info = "\n".join(info_messages) if info_messages else "无查询结果"
+            return self._assemble_prompts(self._assemble_system_messages(task, role_info, style), context, user_input)
+
+        pipeline.add('task', _task, deps=['role_desc'])
+        pipeline.add('identify', lambda embeddings: builder._query_identification(
+            user_input, user_input_embedding=embeddings[0], **info_kwargs), deps=['embed'])
+        pipeline.add('stm', _with_memory_lock(_stm), deps=['persist', 'embed', 'identify'])
+        pipeline.add('typed_info', _with_memory_lock(lambda embeddings, query_types: builder.get_typed_info(
+            user_input, query_types, embeddings[0], embeddings[1], **info_kwargs)), deps=['embed', 'identify'])
+        pipeline.add('style', lambda _: self._build_style(user_input, **kwargs), deps=['embed'])
+        pipeline.add('context', _with_memory_lock(lambda _: self._get_context(**kwargs)), deps=['persist'])
+        pipeline.add('prompts', _prompts, deps=['task', 'stm', 'typed_info', 'style', 'context'])
+        return pipeline
 
     def chat(self, user_input: str, **kwargs) -> Dict[str, Any]:
         """
-        处理用户输入并返回角色回应。
+        处理用户输入并返回角色回应。pipelined_turn 开启时 (默认) LLM调用前的各阶段并发执行，
+        见 _start_turn_pipeline。
 
         Args:
             user_input: 用户输入字符串。
-            **kwargs: 灵活的参数传递。
+            **kwargs: 灵活的参数传递。role_description 可为字符串或尚未完成的 Future。
 
         Returns:
             包含"role"和"content"两个key的字典对象。
         """
-        if self.latest_user_input is not None:
-            self.memory_system.add_memory(
-                message=self.latest_user_input,
-                source=f"{self.user}",
-                creation_time=datetime.now(),
-                metadata={
-                    "action": "speak",
-                }
-            )
-        if self.latest_role_output is not None:
-            self.memory_system.add_memory(
-                message=self.latest_role_output,
-                source=f"{self.role}",
-                creation_time=datetime.now(),
-                metadata={
-                    "action": "speak",
-                },
-                memory_unit_id=self.latest_role_output_id
-            )
-        role_description =  kwargs.get('role_description',None)
-        if isinstance(role_description,str) and role_description:
-            self.role_description = role_description
+        role_description = kwargs.pop('role_description', None)
+        previous_turn = (self.latest_user_input, self.latest_role_output, self.latest_role_output_id)
         self.latest_user_input = user_input
-        messages = self._build_prompts(user_input=user_input, **kwargs)
-        # print("printing msgs:\n")
-        # for msg in messages:
-        #     print(msg)
-
-        llm_response = self.llm.invoke(messages, **kwargs)
-        print(llm_response)
-        response = self._parse_and_validate_response(llm_response.content)
+        self._scene_desc_before_turn = self.scene_desc
+
+        pipelined = kwargs.get('pipelined_turn', True)
+        pipeline = None
+        persist_future = None
+
+        # 语义回复缓存 (reply_cache 开启时)：同一会话、相同角色描述下，语义几乎相同的输入直接复用已生成的回应。
+        # 查找只需角色描述与输入嵌入，因此在启动各检索阶段之前进行，命中时不做任何检索
+        response = None
+        if kwargs.get('reply_cache', False):
+            # 会话id在提交持久化之前读取，之后持久化可能在线程池中持有记忆锁
+            session_id = self.memory_system.get_current_sesssion_id()
+            if pipelined:
+                persist_future = self._get_turn_executor().submit(self._persist_turn, *previous_turn, **kwargs)
+            else:
+                self._persist_turn(*previous_turn, **kwargs)
+            self._apply_role_description(role_description)
+            role_description = None
+            # 与 embed 阶段相同的批量嵌入，未命中时该阶段直接复用
+            input_embedding = self.prompt_info_builder.prime_embeddings(
+                [user_input, f"{self.user}说:" + user_input])[0]
+            cache_key = self._reply_cache_key(session_id, **kwargs)
+            response = self.reply_cache.lookup(input_embedding, cache_key,
+                                               min_variants=kwargs.get('reply_cache_min_variants', 2),
+                                               **self._reply_cache_params(**kwargs))
+            if response is not None and persist_future is not None:
+                # 命中时检索结果不再需要，但上一轮的持久化必须完成
+                persist_future.result()
+        if response is None:
+            if pipelined:
+                pipeline = self._start_turn_pipeline(user_input, role_description, previous_turn,
+                                                     persist_future=persist_future, **kwargs)
+            elif not kwargs.get('reply_cache', False):
+                self._persist_turn(*previous_turn, **kwargs)
+                self._apply_role_description(role_description)
+            if pipeline is not None:
+                try:
+                    messages = pipeline.result('prompts')
+                finally:
+                    pipeline.wait()
+                self._last_turn_timings = pipeline.timings()
+            else:
+                messages = self._build_prompts(user_input=user_input, **kwargs)
+            # print("printing msgs:\n")
+            # for msg in messages:
+            #     print(msg)
+
+            llm_response = self._invoke_llm(messages, **kwargs)
+            print(llm_response)
+            response = self._parse_and_validate_response(llm_response.content, **kwargs)
+            if kwargs.get('reply_cache', False) and not self._last_parse_failed:
+                self.reply_cache.store(input_embedding, cache_key, response,
+                                       max_variants=kwargs.get('reply_cache_max_variants', 4),
+                                       **self._reply_cache_params(**kwargs))
         # if hasattr(llm_response, "reasoning_content"):
         #     print("**********\n*********", f"resoning:{llm_response.reasoning_content}")
         # print(response)
-        scene_desc = response.get('desc', "")
-        # print("test for desc:" + scene_desc)
-        self.scene_desc = scene_desc
+        self._update_scene_desc(response, **kwargs)
         think_content = response.get('think', "")
         speak_content = response.get('speak', "")
 
@@ -641,21 +1396,72 @@ class RolePlayChatbot(BaseCharacterChatbot):
 
         return response
 
-    def _parse_and_validate_response(self, llm_response_content: str) -> Dict:
+    @staticmethod
+    def _rejects_response_format(error: Exception) -> bool:
+        """
+        错误是否表明服务商不支持 response_format 参数：请求被拒 (400/422 或 BadRequestError)，
+        或本地模型不接受该参数 (TypeError)，且错误信息提到 response_format。
+        超时、限流、网络错误等都不算。
+        """
+        if 'response_format' not in str(error):
+            return False
+        if isinstance(error, TypeError):
+            return True
+        status = getattr(error, 'status_code', None)
+        if status is None:
+            status = getattr(getattr(error, 'response', None), 'status_code', None)
+        return status in (400, 422) or type(error).__name__ == 'BadRequestError'
+
+    def _invoke_llm(self, messages: List[ChatMessage], json_mode: bool = False, **invoke_kwargs):
+        """
+        调用LLM。json_mode 为真时请求服务商的JSON输出模式 (response_format)；
+        仅当服务商明确拒绝该参数时打印警告、重发普通请求，并在此后改为普通输出，其余错误照常抛出。
+        """
+        if json_mode and self._json_mode_supported:
+            try:
+                return self.llm.invoke(messages, response_format={"type": "json_object"}, **invoke_kwargs)
+            except Exception as e:
+                if not self._rejects_response_format(e):
+                    raise
+                print(f"Warning: provider JSON mode unavailable, falling back to plain output: {e}")
+                self._json_mode_supported = False
+        return self.llm.invoke(messages, **invoke_kwargs)
+
+    def _parse_and_validate_response(self, llm_response_content: str, **kwargs) -> Dict:
         """
-        使用StructuredOutputParser解析和验证响应。
+        解析和验证响应。先用宽容的JSON解析 (去代码块、修复语法、补全截断)，
+        只要得到 speak 即采用，缺少的其余必需字段补为空字符串；失败时再交给
+        StructuredOutputParser，仍失败才返回默认回应。各结果计入 parse_metrics。
 
         Args:
             llm_response_content: LLM返回的字符串内容。
+            **kwargs: output_mode 等参数。
 
         Returns:
             解析后的字典，如果解析失败则返回包含默认回应的字典。
         """
+        mode = self._output_mode(**kwargs)
+        self._last_parse_failed = False
+        parsed, repair = parse_json_object(llm_response_content)
+        if parsed is not None and parsed.get('speak') is not None:
+            for name, _, required in OUTPUT_MODES[mode]:
+                if required and name not in parsed:
+                    parsed[name] = ""
+                    repair = "partial"
+            self.parse_metrics.record(repair or "direct")
+            return parsed
         try:
-            parsed = self.structured_parser.parse(llm_response_content)
+            parsed = self.output_parsers[mode][1].parse(llm_response_content)
+            self.parse_metrics.record("langchain")
             return parsed
         except Exception as e:
+            self.parse_metrics.record("failed")
+            self._last_parse_failed = True
             print(f"解析响应时出错: {e}")
+            if mode != 'full':
+                return {
+                    "speak": "我需要一些时间来理解你说的话。",
+                }
             return {
                 "desc": f"{self.role}正在困惑",
                 "think": f"我该如何回应{self.user}...",
@@ -0,0 +1,178 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from langchain.schema import ChatMessage
+
+DEFAULT_ROLLING_SUMMARY_PROMPT = (
+    "你负责维护一段对话的滚动摘要。根据已有摘要、已有要点与新增的对话内容，输出更新后的完整摘要与要点："
+    "摘要概括事件经过，删去寒暄与重复内容；要点逐条列出人物、地点、约定、偏好等需要长期记住的事实，"
+    "合并重复、删除已失效的要点。严格按以下格式输出：\n"
+    "摘要: <摘要>\n要点:\n- <要点>\n- <要点>"
+)
+_FACTS_HEADER = "要点:"
+_SUMMARY_HEADER = "摘要:"
+
+
+def parse_summary(text: str) -> Tuple[str, List[str]]:
+    """
+    解析摘要模型的输出，返回 (摘要, 要点列表)。不符合格式时整段视为摘要。
+    """
+    summary_part, _, facts_part = text.partition(_FACTS_HEADER)
+    summary = summary_part.strip()
+    if summary.startswith(_SUMMARY_HEADER):
+        summary = summary[len(_SUMMARY_HEADER):].strip()
+    facts = []
+    for line in facts_part.splitlines():
+        line = line.strip().lstrip("-*•").strip()
+        if line and line not in facts:
+            facts.append(line)
+    return summary, facts
+
+
+class RollingSessionSummarizer:
+    """
+    会话滚动摘要器。
+
+    记录当前会话的每一轮对话；当移出上下文窗口且尚未折叠的轮数达到 interval 时，
+    在后台线程中把这些轮次折叠进滚动摘要与要点列表 (每次只处理增量)。会话结束时
+    最多只需对剩余的少量轮次再做一次增量总结；压缩上下文模式下，摘要与要点代替
+    窗口外的原始对话放入提示词。
+    """
+
+    def __init__(self, llm: Any, summarizing_prompt: Union[str, List[Dict[str, str]], None] = None):
+        """
+        初始化摘要器。
+
+        Args:
+            llm: 用于生成摘要的语言模型，需支持 invoke(messages)。
+            summarizing_prompt: 摘要提示词 (字符串或 {"role","content"} 列表)，为空时使用默认提示词。
+        """
+        self.llm = llm
+        self.summarizing_prompt = summarizing_prompt
+        self._lock = threading.Lock()
+        # 按需创建，shutdown() 时关闭；之后再有 reset() 或 observe() 时重新创建
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._closed = False
+        self._pending: Optional[Future] = None
+        self.session_id: Optional[str] = None
+        self.summary = ""
+        self.key_facts: List[str] = []
+        self._turns: List[Tuple[str, str]] = []
+        self._folded = 0
+        self._generation = 0
+        self._window = 0
+        self._interval = 1
+
+    def reset(self, session_id: Optional[str], turns: Optional[List[Tuple[str, str]]] = None):
+        """
+        切换到新会话。turns 为会话中已有的 (说话者, 内容) 轮次。
+        """
+        with self._lock:
+            self._generation += 1
+            self.session_id = session_id
+            self.summary = ""
+            self.key_facts = []
+            self._turns = list(turns or [])
+            self._folded = 0
+            self._closed = False
+
+    def observe(self, source: str, content: str, window: int, interval: int):
+        """
+        记录一轮对话，并在需要时安排后台折叠。
+
+        Args:
+            source: 说话者。
+            content: 内容。
+            window: 上下文窗口保留的轮数，窗口外的轮次才会被折叠。
+            interval: 累计多少条窗口外的未折叠轮次后触发一次折叠 (K)。
+        """
+        with self._lock:
+            # 关闭后继续对话时重新开放后台折叠
+            self._closed = False
+            self._turns.append((source, content))
+            self._window, self._interval = max(window, 0), max(interval, 1)
+            if self._pending is None or self._pending.done():
+                self._schedule_locked()
+
+    def _schedule_locked(self):
+        if self._closed:
+            return
+        upto = len(self._turns) - self._window
+        if upto - self._folded >= self._interval:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rolling-summary")
+            self._pending = self._executor.submit(self._fold, self._generation, upto, True)
+
+    def render(self, max_facts: Optional[int] = None) -> str:
+        """
+        以文本形式返回当前摘要与 (至多 max_facts 条最新的) 要点。
+        """
+        with self._lock:
+            return self._render_locked(max_facts)
+
+    def _render_locked(self, max_facts: Optional[int] = None) -> str:
+        summary, facts = self.summary, self.key_facts
+        if max_facts is not None:
+            facts = facts[-max_facts:] if max_facts > 0 else []
+        if not facts:
+            return summary
+        return f"{_SUMMARY_HEADER} {summary}\n{_FACTS_HEADER}\n" + "\n".join(f"- {fact}" for fact in facts)
+
+    def _format_messages(self, summary: str, turns: List[Tuple[str, str]]) -> List[ChatMessage]:
+        prompt = self.summarizing_prompt or DEFAULT_ROLLING_SUMMARY_PROMPT
+        if isinstance(prompt, str):
+            messages = [ChatMessage(role="system", content=prompt)]
+        else:
+            messages = [ChatMessage(role=msg.get("role", "system"), content=msg["content"]) for msg in prompt]
+        dialogue = "\n".join(f"{source}: {content}" for source, content in turns)
+        messages.append(ChatMessage(role="user", content=f"已有摘要:\n{summary or '无'}\n\n新增对话:\n{dialogue}"))
+        return messages
+
+    def _fold(self, generation: int, upto: int, background: bool = False) -> str:
+        with self._lock:
+            if generation != self._generation or upto <= self._folded:
+                return self._render_locked()
+            turns, start = self._turns[self._folded:upto], self._folded
+            previous = self._render_locked()
+        try:
+            new_summary, new_facts = parse_summary(
+                self.llm.invoke(self._format_messages(previous, turns)).content.strip())
+        except Exception as e:
+            print(f"Warning: rolling session summary failed: {e}")
+            return previous
+        with self._lock:
+            if generation == self._generation and self._folded == start and (new_summary or new_facts):
+                self.summary = new_summary
+                self.key_facts = new_facts
+                self._folded = upto
+                if background:
+                    # 折叠期间又有轮次移出窗口时继续折叠
+                    self._schedule_locked()
+        return self.render()
+
+    def pending_turns(self) -> int:
+        with self._lock:
+            return len(self._turns) - self._folded
+
+    def flush(self) -> str:
+        """
+        等待后台折叠完成，再把剩余轮次做一次增量总结，返回完整的会话摘要 (含要点)。
+        """
+        pending = self._pending
+        while pending is not None and not pending.done():
+            pending.result()
+            pending = self._pending
+        with self._lock:
+            generation, upto = self._generation, len(self._turns)
+        return self._fold(generation, upto)
+
+    def shutdown(self):
+        """
+        不再安排新的后台折叠，等待进行中的折叠完成后关闭线程池。
+        """
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,107 @@
+import threading
+import time
+from concurrent.futures import Executor, Future, wait
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+
+class TurnPipeline:
+    """
+    单轮对话的阶段依赖图执行器。
+
+    每个阶段在其依赖全部完成后立即提交到线程池执行，阶段函数以依赖的结果为参数
+    (顺序与 deps 一致)。等待只发生在调用方线程中，工作线程从不阻塞等待其他阶段，
+    因此线程数少于阶段数时也不会死锁。任一依赖失败时，下游阶段以相同异常失败。
+    """
+
+    def __init__(self, executor: Executor):
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+        self._timings: Dict[str, Tuple[float, float]] = {}
+        self._origin = time.perf_counter()
+
+    def add_future(self, name: str, future: Future) -> Future:
+        """
+        把外部已在运行的任务 (如调用方提交的 get_role_desc) 作为一个阶段接入。
+        """
+        started = time.perf_counter()
+        future.add_done_callback(lambda _: self._record(name, started))
+        self._futures[name] = future
+        return future
+
+    def _record(self, name: str, started: float):
+        with self._lock:
+            self._timings[name] = (started, time.perf_counter())
+
+    def add(self, name: str, func: Callable[..., Any], deps: Iterable[str] = ()) -> Future:
+        """
+        添加一个阶段。依赖必须已经添加。
+
+        Args:
+            name: 阶段名。
+            func: 阶段函数，参数为各依赖阶段的结果。
+            deps: 依赖的阶段名。
+
+        Returns:
+            该阶段结果的 Future。
+        """
+        dep_futures = [self._futures[dep] for dep in deps]
+        future: Future = Future()
+        self._futures[name] = future
+        # [未完成的依赖数, 是否已提交或已失败]
+        state = [len(dep_futures), False]
+
+        def _run():
+            if not future.set_running_or_notify_cancel():
+                return
+            started = time.perf_counter()
+            try:
+                value = func(*[dep.result() for dep in dep_futures])
+            except BaseException as e:
+                self._record(name, started)
+                future.set_exception(e)
+                return
+            self._record(name, started)
+            future.set_result(value)
+
+        def _on_dep_done(dep: Future):
+            failed = dep.cancelled() or dep.exception() is not None
+            with self._lock:
+                state[0] -= 1
+                if state[1] or not (failed or state[0] == 0):
+                    return
+                state[1] = True
+            if not failed:
+                self._executor.submit(_run)
+            elif future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError(f"dependency of stage '{name}' was cancelled")
+                                     if dep.cancelled() else dep.exception())
+
+        if not dep_futures:
+            self._executor.submit(_run)
+        for dep in dep_futures:
+            dep.add_done_callback(_on_dep_done)
+        return future
+
+    def result(self, name: str, timeout: Optional[float] = None) -> Any:
+        return self._futures[name].result(timeout)
+
+    def wait(self, timeout: Optional[float] = None):
+        """
+        等待所有阶段结束 (无论成功与否)。
+        """
+        wait(list(self._futures.values()), timeout=timeout)
+
+    def timings(self) -> Dict[str, Any]:
+        """
+        返回各阶段耗时 (毫秒)、各阶段耗时之和 (即串行执行所需时间) 与从开始到最后一个阶段结束的实际耗时。
+        """
+        with self._lock:
+            timings = dict(self._timings)
+        stages = {name: round((end - start) * 1000, 2) for name, (start, end) in timings.items()}
+        finished = max((end for _, end in timings.values()), default=self._origin)
+        return {
+            "stages_ms": stages,
+            "sequential_ms": round(sum(stages.values()), 2),
+            "wall_ms": round((finished - self._origin) * 1000, 2),
+        }
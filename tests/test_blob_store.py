@@ -0,0 +1,53 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+
+from utils.blob_store import ContentAddressedStore
+
+
+class ContentAddressedStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+    def _age(self, filename, seconds):
+        path = os.path.join(self.upload_dir, filename)
+        past = time.time() - seconds
+        os.utime(path, (past, past))
+
+    def test_legacy_uuid_named_upload_survives_gc(self):
+        legacy = uuid.uuid4().hex + ".png"
+        with open(os.path.join(self.upload_dir, legacy), "wb") as f:
+            f.write(b"old wallpaper")
+        self._age(legacy, 3 * 86400)
+        store = ContentAddressedStore(self.upload_dir, ("png", "jpg"))
+        self.assertFalse(store.is_blob_name(legacy))
+        self.assertIsNone(store.digest_of(legacy))
+        self.assertEqual(store.gc(), [])
+        self.assertTrue(os.path.exists(os.path.join(self.upload_dir, legacy)))
+
+    def test_dedup_and_collect_released_blob(self):
+        store = ContentAddressedStore(self.upload_dir, ("png", "jpg"), grace_seconds=60)
+        first = store.put_stream(io.BytesIO(b"a"), "png")
+        self.assertTrue(first.filename.startswith("b2-"))
+        store.set_ref("background", first.filename)
+        again = store.put_stream(io.BytesIO(b"a"), "jpg")
+        self.assertTrue(again.deduplicated)
+        self.assertEqual(again.filename, first.filename)
+
+        second = store.put_stream(io.BytesIO(b"b"), "png")
+        store.set_ref("background", second.filename)
+        self.assertEqual(store.gc(), [])
+        self.assertEqual(store.gc(now=time.time() + 120), [first.filename])
+        self.assertTrue(os.path.exists(second.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
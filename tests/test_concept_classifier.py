@@ -0,0 +1,32 @@
+import unittest
+from unittest import mock
+
+from core.workflow import roleplay_chatbot
+from core.workflow.roleplay_chatbot import RolePlayChatbot
+from tests.test_retrieval_cache import _LLM, _MemorySystem
+
+
+def _chatbot():
+    return RolePlayChatbot(
+        llm=_LLM(), role="r", user="u", role_description="x",
+        entity_attr={"爱好": ["读书"], "短期记忆": ["x"]},
+        query_schema={"爱好": ["你喜欢做什么", "平时有什么爱好"], "短期记忆": ["刚才说了什么"]},
+        answer_schema={"q": ["a"]},
+        memory_system=_MemorySystem())
+
+
+class ConceptClassifierBuildTest(unittest.TestCase):
+
+    def test_built_only_when_enabled(self):
+        with mock.patch.object(roleplay_chatbot, "ConceptPrototypeClassifier",
+                               wraps=roleplay_chatbot.ConceptPrototypeClassifier) as classifier_class:
+            chatbot = _chatbot()
+            chatbot.chat("今天天气不错", rolling_summary=False)
+            self.assertEqual(classifier_class.call_count, 0)
+            chatbot.chat("今天天气很好", concept_classifier=True, rolling_summary=False)
+            chatbot.chat("明天天气如何", concept_classifier=True, rolling_summary=False)
+            self.assertEqual(classifier_class.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
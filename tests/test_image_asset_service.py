@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils.image_asset_service import ImageAssetService
+
+
+class ImageAssetServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.image_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.image_dir, ignore_errors=True)
+
+    def _image(self, name):
+        path = os.path.join(self.image_dir, name)
+        with open(path, "wb") as f:
+            f.write(name.encode("utf-8"))
+        return path
+
+    def test_pinned_token_survives_eviction(self):
+        assets = ImageAssetService(max_entries=3)
+        default_token = assets.token_for(self._image("default.png"), pin=True)
+        evictable_token = assets.token_for(self._image("first.png"))
+        for i in range(10):
+            assets.token_for(self._image(f"other{i}.png"))
+        self.assertIsNotNone(assets.resolve(default_token))
+        self.assertIsNone(assets.resolve(evictable_token))
+        self.assertEqual(len(assets), 3)
+
+    def test_evicted_token_is_reissued_unchanged(self):
+        assets = ImageAssetService(max_entries=1)
+        path = self._image("a.png")
+        token = assets.token_for(path)
+        assets.token_for(self._image("b.png"))
+        self.assertIsNone(assets.resolve(token))
+        self.assertEqual(assets.token_for(path), token)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from core.workflow.roleplay_chatbot import RolePlayChatbot
+from tests.test_retrieval_cache import _LLM, _MemorySystem
+
+
+class _ProviderError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _FailingJsonModeLLM(_LLM):
+    def __init__(self, error):
+        self.error = error
+        self.calls = []
+
+    def invoke(self, messages, **kwargs):
+        self.calls.append(kwargs)
+        if "response_format" in kwargs:
+            raise self.error
+        return super().invoke(messages, **kwargs)
+
+
+def _chatbot(llm):
+    return RolePlayChatbot(
+        llm=llm, role="r", user="u", role_description="x",
+        entity_attr={"短期记忆": ["x"]}, query_schema={"短期记忆": ["刚才说了什么"]},
+        answer_schema={"q": ["a"]}, memory_system=_MemorySystem())
+
+
+class JsonModeFallbackTest(unittest.TestCase):
+
+    def test_rejected_parameter_falls_back_once(self):
+        llm = _FailingJsonModeLLM(_ProviderError("Invalid parameter: response_format is not supported", 400))
+        chatbot = _chatbot(llm)
+        self.assertEqual(chatbot.chat("你好", json_mode=True, rolling_summary=False)["content"], "reply")
+        chatbot.chat("你好", json_mode=True, rolling_summary=False)
+        self.assertFalse(chatbot._json_mode_supported)
+        self.assertEqual(["response_format" in call for call in llm.calls], [True, False, False])
+
+    def test_transient_errors_are_raised_and_keep_json_mode(self):
+        for error in (_ProviderError("Rate limit reached", 429), TimeoutError("request timed out"),
+                      _ProviderError("response_format: upstream timeout", 504)):
+            with self.subTest(error=error):
+                llm = _FailingJsonModeLLM(error)
+                chatbot = _chatbot(llm)
+                with self.assertRaises(type(error)):
+                    chatbot.chat("你好", json_mode=True, rolling_summary=False)
+                self.assertTrue(chatbot._json_mode_supported)
+                self.assertEqual(len(llm.calls), 1)
+
+    def test_refresh_output_uses_the_same_call_shape(self):
+        llm = _FailingJsonModeLLM(_ProviderError("unused", 400))
+        chatbot = _chatbot(llm)
+        chatbot.chat("你好", temperature=0.3, rolling_summary=False)
+        chatbot.refresh_output(temperature=0.3, rolling_summary=False)
+        self.assertEqual(llm.calls[0], llm.calls[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
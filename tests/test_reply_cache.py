@@ -0,0 +1,71 @@
+import unittest
+
+from core.workflow.roleplay_chatbot import RolePlayChatbot
+from tests.test_retrieval_cache import _MemorySystem, _Reply
+from tests.test_rolling_summary import _CountingLLM
+
+
+class _QueryCountingMemorySystem(_MemorySystem):
+    def __init__(self):
+        super().__init__()
+        self.queries = 0
+
+    def query(self, **kwargs):
+        self.queries += 1
+        return super().query(**kwargs)
+
+
+class _VaryingLLM(_CountingLLM):
+    """Every generated reply is different, as a sampled model's would be."""
+
+    def invoke(self, messages, **kwargs):
+        self.calls += 1
+        return _Reply('{"desc": "d%d", "think": "t", "speak": "晚安 #%d"}' % (self.calls, self.calls))
+
+
+def _chatbot(memory_system, llm):
+    return RolePlayChatbot(
+        llm=llm, role="r", user="u", role_description="x",
+        entity_attr={"短期记忆": ["x"], "长期记忆": ["y"]},
+        query_schema={"短期记忆": ["刚才说了什么"], "长期记忆": ["以前聊过什么"]},
+        answer_schema={"q": ["a"]},
+        memory_system=memory_system)
+
+
+class ReplyCacheTurnTest(unittest.TestCase):
+
+    def test_repeated_input_hits_after_min_variants(self):
+        for pipelined in (True, False):
+            with self.subTest(pipelined_turn=pipelined):
+                memory_system = _QueryCountingMemorySystem()
+                llm = _VaryingLLM()
+                chatbot = _chatbot(memory_system, llm)
+                chat_kwargs = dict(reply_cache=True, retrieval_cache=False, pipelined_turn=pipelined,
+                                   rolling_summary=False)
+                replies = [chatbot.chat("晚安", **chat_kwargs)["content"] for _ in range(2)]
+                self.assertEqual(llm.calls, 2)
+
+                queries = memory_system.queries
+                third = chatbot.chat("晚安", **chat_kwargs)["content"]
+                self.assertEqual(llm.calls, 2)
+                self.assertIn(third, replies)
+                self.assertNotEqual(third, replies[-1])
+                self.assertEqual(memory_system.queries, queries)
+                self.assertEqual(chatbot.get_metrics()["reply_cache"]["hits"], 1)
+                # the hit still persisted the turn before it
+                self.assertEqual([unit.content for unit in memory_system.units],
+                                 ["晚安", replies[0], "晚安", replies[1]])
+
+    def test_other_session_does_not_hit(self):
+        memory_system = _QueryCountingMemorySystem()
+        llm = _VaryingLLM()
+        chatbot = _chatbot(memory_system, llm)
+        for _ in range(2):
+            chatbot.chat("晚安", reply_cache=True, rolling_summary=False)
+        memory_system.get_current_sesssion_id = lambda: "s2"
+        chatbot.chat("晚安", reply_cache=True, rolling_summary=False)
+        self.assertEqual(llm.calls, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import hashlib
+import unittest
+
+import numpy as np
+
+from core.workflow.retrieval_cache import RetrievalCache
+from core.workflow.roleplay_chatbot import RolePlayChatbot
+
+
+class _Unit:
+    def __init__(self, unit_id, source, content):
+        self.id = unit_id
+        self.source = source
+        self.content = content
+        self.metadata = {"action": "speak"}
+        self.parent_id = None
+        self.group_id = "s1"
+
+
+class _MemorySystem:
+    def __init__(self):
+        self.units = []
+        self.ltm_queries = 0
+
+    def get_embedding(self, text):
+        texts = [text] if isinstance(text, str) else text
+        vectors = np.stack([
+            np.random.default_rng(int(hashlib.md5(t.encode("utf-8")).hexdigest()[:8], 16)).random(8)
+            for t in texts])
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def add_memory(self, message, source, creation_time, metadata, memory_unit_id):
+        self.units.append(_Unit(memory_unit_id, source, message))
+
+    def get_current_sesssion_id(self):
+        return "s1"
+
+    def if_stm_enabled(self):
+        return True
+
+    def query(self, **kwargs):
+        if kwargs.get("long_term_only"):
+            self.ltm_queries += 1
+        return []
+
+    def get_context(self, length=None):
+        return self.units[-(length or 10):]
+
+
+class _Reply:
+    def __init__(self, content):
+        self.content = content
+
+
+class _LLM:
+    def invoke(self, messages, **kwargs):
+        return _Reply('{"desc": "d", "think": "t", "speak": "reply"}')
+
+
+class RetrievalCacheTest(unittest.TestCase):
+
+    def test_scoped_bump_keeps_other_scopes(self):
+        cache = RetrievalCache()
+        vector = np.ones(4)
+        stm_key = cache.make_key("stm", vector, {})
+        ltm_key = cache.make_key("ltm", vector, {})
+        cache.put(stm_key, "stm result", cache.version("stm"))
+        cache.put(ltm_key, "ltm result", cache.version("ltm"))
+        cache.bump("stm")
+        self.assertEqual(cache.get(stm_key), (False, None))
+        self.assertEqual(cache.get(ltm_key), (True, "ltm result"))
+        cache.bump()
+        self.assertEqual(cache.get(ltm_key), (False, None))
+
+    def test_put_after_concurrent_bump_is_dropped(self):
+        cache = RetrievalCache()
+        key = cache.make_key("ltm", np.ones(4), {})
+        version = cache.version("ltm")
+        cache.bump()
+        cache.put(key, "stale", version)
+        self.assertEqual(cache.get(key), (False, None))
+
+    def test_consecutive_turns_on_one_topic_hit_ltm_cache(self):
+        for pipelined in (True, False):
+            with self.subTest(pipelined_turn=pipelined):
+                memory_system = _MemorySystem()
+                chatbot = RolePlayChatbot(
+                    llm=_LLM(), role="r", user="u", role_description="x",
+                    entity_attr={"短期记忆": ["x"], "长期记忆": ["y"]},
+                    query_schema={"短期记忆": ["刚才说了什么"], "长期记忆": ["以前聊过什么"]},
+                    answer_schema={"q": ["a"]},
+                    memory_system=memory_system)
+                for _ in range(2):
+                    chatbot.chat("以前聊过什么来着", pipelined_turn=pipelined, rolling_summary=False)
+                self.assertEqual(memory_system.ltm_queries, 1)
+                self.assertGreaterEqual(chatbot.get_metrics()["retrieval_cache"]["hits"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from flask import Flask
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "core", "chatbot_app", "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from role_graph import bp as role_graph_bp  # noqa: E402
+from utils.role_graph_journal import load_graph  # noqa: E402
+
+_data_dir = None
+_client = None
+
+
+def setUpModule():
+    # The blueprint registers its routes on a module-level Blueprint, so it is created once per process.
+    global _data_dir, _client
+    _data_dir = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config.update(CHATBOT_STATUS="closed", CHATBOT_STATUS_LOCK=threading.Lock())
+    app.register_blueprint(role_graph_bp.create_role_graph_blueprint(
+        {"DATA_PATH": os.path.join(_data_dir, "graph.json"), "JOURNAL_COMPACT_INTERVAL": 3600}),
+        url_prefix="/rg")
+    _client = app.test_client()
+
+
+def tearDownModule():
+    shutil.rmtree(_data_dir, ignore_errors=True)
+
+
+def _journal_ops():
+    path = role_graph_bp.graph_journal.journal_path
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class SingleOpCommitTest(unittest.TestCase):
+
+    def setUp(self):
+        _client.post("/rg/role", json={"role_name": "alice"})
+
+    def test_failed_apply_is_rolled_back_and_not_journaled(self):
+        journaled = len(_journal_ops())
+        before = json.loads(json.dumps(role_graph_bp.graph_data))
+        original_apply = role_graph_bp.apply_graph_op
+
+        def _apply_then_fail(graph, op, index=None):
+            original_apply(graph, op, index)
+            raise RuntimeError("simulated failure after mutating the graph")
+
+        role_graph_bp.apply_graph_op = _apply_then_fail
+        try:
+            response = _client.post("/rg/role", json={"role_name": "bob"})
+        finally:
+            role_graph_bp.apply_graph_op = original_apply
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(role_graph_bp.graph_data, before)
+        self.assertEqual(len(_journal_ops()), journaled)
+
+    def test_failed_append_is_rolled_back(self):
+        before = json.loads(json.dumps(role_graph_bp.graph_data))
+        journal = role_graph_bp.graph_journal
+        journal.append = lambda op: False
+        try:
+            response = _client.post("/rg/role", json={"role_name": "carol"})
+        finally:
+            del journal.append
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(role_graph_bp.graph_data, before)
+        self.assertEqual(load_graph(journal.snapshot_path)["roles"].keys(), before["roles"].keys())
+
+
+class BatchValidationTest(unittest.TestCase):
+
+    def test_wrongly_typed_fields_are_rejected(self):
+        _client.post("/rg/role", json={"role_name": "dave"})
+        before = json.loads(json.dumps(role_graph_bp.graph_data))
+        for bad_op in ({"op": "add_role", "role": ["x"]},
+                       {"op": "add_attribute_description", "role": "dave", "attribute": {"a": 1},
+                        "description": "d"},
+                       {"op": "add_idea", "source": "dave", "target": "dave", "idea": 3},
+                       {"op": "delete_description", "role": "dave", "attribute": "a", "index": "0"}):
+            with self.subTest(op=bad_op):
+                response = _client.post("/rg/batch", json={"operations": [{"op": "add_role", "role": "erin"}, bad_op]})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json["failed_operation"], 1)
+                self.assertEqual(role_graph_bp.graph_data, before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from utils import role_graph_journal
+from utils.role_graph_journal import RoleGraphJournal, load_graph
+
+
+class LoadGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.data_dir, "graph.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_replays_journal_over_snapshot(self):
+        journal = RoleGraphJournal(self.snapshot_path)
+        journal.load()
+        journal.append({"op": "add_role", "role": "alice"})
+        self.assertIn("alice", load_graph(self.snapshot_path)["roles"])
+
+    def test_snapshot_that_keeps_changing_raises(self):
+        with open(self.snapshot_path, "w", encoding="utf-8") as f:
+            json.dump({"roles": {}}, f)
+        signatures = iter(range(100))
+        with mock.patch.object(role_graph_journal, "_snapshot_signature", lambda path: next(signatures)):
+            with self.assertRaises(RuntimeError):
+                load_graph(self.snapshot_path, max_attempts=3)
+
+
+if __name__ == "__main__":
+    unittest.main()
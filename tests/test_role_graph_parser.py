@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from utils import role_graph_parser
+from utils.role_graph_journal import RoleGraphJournal, load_graph
+from utils.role_graph_parser import get_entity_attr, parse_entity_attr
+
+
+class GetEntityAttrTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.graph_path = os.path.join(self.data_dir, "graph.json")
+        journal = RoleGraphJournal(self.graph_path)
+        journal.load()
+        for role in ("alice", "bob", "carol"):
+            journal.append({"op": "add_role", "role": role})
+        for attribute, description, access_rights in (
+                ("性格", "开朗", "unlimited"),
+                ("秘密", "怕黑", ["alice"]),
+                ("秘密", "会魔法", ["bob"]),
+                ("爱好", "读书", "carol"),
+                ("爱好", "画画", "alice")):
+            journal.append({"op": "add_attribute_description", "role": "alice", "attribute": attribute,
+                            "description": description, "access_rights": access_rights})
+        self.graph = load_graph(self.graph_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_indexed_parse_matches_full_walk(self):
+        expected = parse_entity_attr(self.graph["roles"]["alice"], "alice")
+        self.assertEqual(dict(get_entity_attr(self.graph_path, "alice")), dict(expected))
+        self.assertEqual(expected["秘密"], ["alice的秘密包括: 怕黑"])
+
+    def test_index_is_built_once_per_graph_version(self):
+        role_graph_parser._graph_index_cache.clear()
+        role_graph_parser._entity_attr_cache.clear()
+        with mock.patch.object(role_graph_parser, "RoleGraphIndex",
+                               wraps=role_graph_parser.RoleGraphIndex) as index_class:
+            get_entity_attr(self.graph_path, "alice")
+            get_entity_attr(self.graph_path, "bob")
+        self.assertEqual(index_class.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import threading
+import unittest
+
+from core.workflow.roleplay_chatbot import RolePlayChatbot
+from tests.test_retrieval_cache import _LLM, _MemorySystem
+
+
+class _CountingLLM(_LLM):
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, messages, **kwargs):
+        self.calls += 1
+        return super().invoke(messages, **kwargs)
+
+
+class _ExternalSummaryMemorySystem(_MemorySystem):
+    def summarize_session(self, session_id, role=None, system_message=None, external_summary=None):
+        pass
+
+
+def _chatbot(memory_system, llm):
+    return RolePlayChatbot(
+        llm=llm, role="r", user="u", role_description="x",
+        entity_attr={"短期记忆": ["x"]}, query_schema={"短期记忆": ["刚才说了什么"]},
+        answer_schema={"q": ["a"]}, memory_system=memory_system, max_ctx_len=2)
+
+
+class RollingSummaryTest(unittest.TestCase):
+
+    def _fold_calls(self, memory_system, **chat_kwargs):
+        llm = _CountingLLM()
+        chatbot = _chatbot(memory_system, llm)
+        for i in range(8):
+            chatbot.chat(f"第{i}句话", rolling_summary_interval=1, **chat_kwargs)
+        chatbot.rolling_summarizer.flush()
+        return llm.calls - 8
+
+    def test_no_fold_without_consumer(self):
+        self.assertEqual(self._fold_calls(_MemorySystem()), 0)
+
+    def test_fold_in_compressed_mode(self):
+        self.assertGreater(self._fold_calls(_MemorySystem(), context_mode="compressed", context_verbatim_turns=1), 0)
+
+    def test_fold_when_memory_system_accepts_external_summary(self):
+        self.assertGreater(self._fold_calls(_ExternalSummaryMemorySystem()), 0)
+
+
+class _ClosableMemorySystem(_ExternalSummaryMemorySystem):
+    def close(self, auto_summarize=False, system_message=None, role=None):
+        pass
+
+
+def _summary_threads():
+    return {thread for thread in threading.enumerate() if thread.name.startswith("rolling-summary")}
+
+
+class RollingSummaryShutdownTest(unittest.TestCase):
+
+    def test_close_waits_for_fold_and_releases_thread(self):
+        before = _summary_threads()
+        llm = _CountingLLM()
+        chatbot = _chatbot(_ClosableMemorySystem(), llm)
+        for i in range(6):
+            chatbot.chat(f"第{i}句话", rolling_summary_interval=1, rolling_summary=True)
+        chatbot.close()
+        self.assertFalse(_summary_threads() - before)
+        pending = chatbot.rolling_summarizer._pending
+        self.assertTrue(pending is None or pending.done())
+
+        chatbot.chat("继续聊", rolling_summary_interval=1, rolling_summary=True)
+        chatbot.close()
+        self.assertFalse(_summary_threads() - before)
+
+
+if __name__ == "__main__":
+    unittest.main()
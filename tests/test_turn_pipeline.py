@@ -0,0 +1,118 @@
+import threading
+import time
+import unittest
+
+from core.workflow.roleplay_chatbot import RolePlayChatbot
+from tests.test_retrieval_cache import _LLM, _MemorySystem
+
+
+class _ExclusiveMemorySystem(_MemorySystem):
+    """Records overlapping storage calls and when each call ran."""
+
+    def __init__(self):
+        super().__init__()
+        self._guard = threading.Lock()
+        self._active = 0
+        self.overlaps = 0
+        self.calls = []
+
+    def _enter(self, name):
+        with self._guard:
+            self._active += 1
+            if self._active > 1:
+                self.overlaps += 1
+        started = time.perf_counter()
+        time.sleep(0.01)
+        return name, started
+
+    def _leave(self, call):
+        with self._guard:
+            self._active -= 1
+        self.calls.append((*call, time.perf_counter()))
+
+    def add_memory(self, **kwargs):
+        call = self._enter("add_memory")
+        try:
+            super().add_memory(**kwargs)
+        finally:
+            self._leave(call)
+
+    def query(self, **kwargs):
+        call = self._enter("stm_query" if kwargs.get("short_term_only") else "ltm_query")
+        try:
+            return super().query(**kwargs)
+        finally:
+            self._leave(call)
+
+    def get_context(self, length=None):
+        call = self._enter("get_context")
+        try:
+            return super().get_context(length)
+        finally:
+            self._leave(call)
+
+
+class TurnPipelineOrderTest(unittest.TestCase):
+
+    def test_memory_stages_are_exclusive_and_follow_persist(self):
+        memory_system = _ExclusiveMemorySystem()
+        chatbot = RolePlayChatbot(
+            llm=_LLM(), role="r", user="u", role_description="x",
+            entity_attr={"短期记忆": ["x"], "长期记忆": ["y"]},
+            query_schema={"短期记忆": ["刚才说了什么"], "长期记忆": ["以前聊过什么"]},
+            answer_schema={"q": ["a"]},
+            memory_system=memory_system)
+        for turn in range(3):
+            first_call = len(memory_system.calls)
+            chatbot.chat("刚才说了什么 以前聊过什么", retrieval_cache=False, rolling_summary=False)
+            stages = chatbot.get_metrics()["last_turn_pipeline"]["stages_ms"]
+            self.assertTrue({"persist", "stm", "typed_info", "context"} <= set(stages))
+
+            calls = memory_system.calls[first_call:]
+            self.assertEqual({name for name, _, _ in calls}, {"stm_query", "ltm_query", "get_context"}
+                             | ({"add_memory"} if turn else set()))
+            persisted = max((end for name, _, end in calls if name == "add_memory"), default=0.0)
+            # 短期记忆检索与上下文读取必须看到上一轮的写入
+            for name, started, _ in calls:
+                if name in ("stm_query", "get_context"):
+                    self.assertGreaterEqual(started, persisted, name)
+
+        self.assertEqual(memory_system.overlaps, 0)
+
+
+class _ClosableMemorySystem(_MemorySystem):
+    def close(self, auto_summarize=False, system_message=None, role=None):
+        pass
+
+    def start_session(self, session_id=None):
+        pass
+
+    def ensure_initialized(self):
+        pass
+
+
+def _live_threads(prefix):
+    return [thread for thread in threading.enumerate() if thread.name.startswith(prefix)]
+
+
+class TurnExecutorLifecycleTest(unittest.TestCase):
+
+    def test_close_releases_turn_threads_and_chat_recreates_them(self):
+        chatbot = RolePlayChatbot(
+            llm=_LLM(), role="r", user="u", role_description="x",
+            entity_attr={"短期记忆": ["x"]}, query_schema={"短期记忆": ["刚才说了什么"]},
+            answer_schema={"q": ["a"]}, memory_system=_ClosableMemorySystem())
+        before = set(_live_threads("chat-turn"))
+        chatbot.chat("你好", rolling_summary=False)
+        self.assertTrue(set(_live_threads("chat-turn")) - before)
+        chatbot.close()
+        self.assertFalse(set(_live_threads("chat-turn")) - before)
+
+        chatbot.start_new_session()
+        self.assertEqual(chatbot.chat("你好", rolling_summary=False)["content"], "reply")
+        chatbot.close()
+        self.assertFalse(set(_live_threads("chat-turn")) - before)
+
+
+if __name__ == "__main__":
+    unittest.main()
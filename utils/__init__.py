@@ -1,8 +1,11 @@
 from .ChatDS import ChatDS
 from .role_graph_parser import parse_entity_attr,get_entity_attr
+from .sprite_index import SpriteIndex, get_sprite_index
 
 __all__ = [
     'ChatDS',
     'parse_entity_attr',
-    'get_entity_attr'
+    'get_entity_attr',
+    'SpriteIndex',
+    'get_sprite_index'
 ]
\ No newline at end of file
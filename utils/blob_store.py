@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+REFS_FILE_NAME = '.refs.json'
+# The prefix keeps blob names disjoint from legacy uploads named uuid4().hex + ext,
+# which are also 32 hex characters and must never be collected.
+BLOB_PREFIX = 'b2-'
+_BLOB_NAME = re.compile(r'^' + re.escape(BLOB_PREFIX) + r'([0-9a-f]{32})\.([a-z0-9]+)$')
+
+
+class StoredBlob:
+    __slots__ = ('digest', 'filename', 'path', 'size', 'deduplicated')
+
+    def __init__(self, digest, filename, path, size, deduplicated):
+        self.digest = digest
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.deduplicated = deduplicated
+
+
+class ContentAddressedStore:
+    """
+    Deduplicating upload storage: every blob is named "b2-<content digest>.<ext>".
+
+    Uploads are hashed (BLAKE2b, 16 bytes) while they are streamed to a temporary file;
+    when a blob with the same digest already exists the temporary file is dropped and
+    the existing blob is reused, so uploading the same wallpaper again costs no disk
+    space. The bytes behind a blob name never change, which makes immutable caching safe.
+
+    Blobs are kept alive by named references ("slots", e.g. "background"). Pointing a
+    slot at a new blob releases the previous one; gc() deletes blobs that no slot
+    references once they have been unreferenced for longer than grace_seconds, so a page
+    still showing an old background keeps working for a while. References are persisted
+    in a small JSON file next to the blobs. Files not named like blobs (such as legacy
+    uuid-named uploads) are never served as blobs or collected.
+    """
+
+    def __init__(self, root, extensions, grace_seconds=86400, chunk_size=1024 * 64):
+        self.root = root
+        self.extensions = tuple(extensions)
+        self.grace_seconds = grace_seconds
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._refs_path = os.path.join(root, REFS_FILE_NAME)
+        os.makedirs(root, exist_ok=True)
+        self._slots = {}
+        self._released = {}
+        self._load_refs()
+
+    @staticmethod
+    def is_blob_name(filename):
+        return bool(_BLOB_NAME.match(filename or ''))
+
+    @staticmethod
+    def digest_of(filename):
+        """Digest part of a blob name, or None for other names."""
+        match = _BLOB_NAME.match(filename or '')
+        return match.group(1) if match else None
+
+    def _load_refs(self):
+        try:
+            with open(self._refs_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read upload references {self._refs_path}: {e}")
+            return
+        self._slots = dict(data.get('slots', {}))
+        self._released = dict(data.get('released', {}))
+
+    def _save_refs_locked(self):
+        tmp_path = f"{self._refs_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'slots': self._slots, 'released': self._released}, f, indent=2)
+            os.replace(tmp_path, self._refs_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _existing_blob(self, digest):
+        for ext in self.extensions:
+            filename = f"{BLOB_PREFIX}{digest}.{ext}"
+            if os.path.isfile(os.path.join(self.root, filename)):
+                return filename
+        return None
+
+    def put_stream(self, stream, ext):
+        """
+        Stores the content of a readable binary stream and returns a StoredBlob.
+
+        The digest is computed during the chunked write; if the content is already stored
+        (under any of the allowed extensions) the existing blob is returned with
+        deduplicated=True.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        size = 0
+        tmp_path = os.path.join(self.root, f".upload-{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            hex_digest = digest.hexdigest()
+            with self._lock:
+                existing = self._existing_blob(hex_digest)
+                if existing is not None:
+                    existing_path = os.path.join(self.root, existing)
+                    # restart the grace period so gc() cannot race the caller's set_ref()
+                    os.utime(existing_path)
+                    self._released.pop(existing, None)
+                    return StoredBlob(hex_digest, existing, existing_path, size, True)
+                filename = f"{BLOB_PREFIX}{hex_digest}.{ext}"
+                path = os.path.join(self.root, filename)
+                os.replace(tmp_path, path)
+                return StoredBlob(hex_digest, filename, path, size, False)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def set_ref(self, slot, filename):
+        """Points slot at filename, releasing the blob it referenced before."""
+        with self._lock:
+            previous = self._slots.get(slot)
+            if previous == filename:
+                return
+            self._slots[slot] = filename
+            self._released.pop(filename, None)
+            if previous and previous not in self._slots.values():
+                self._released[previous] = time.time()
+            self._save_refs_locked()
+
+    def referenced(self):
+        with self._lock:
+            return set(self._slots.values())
+
+    def gc(self, now=None):
+        """
+        Deletes unreferenced blobs (and partial uploads) older than the grace period.
+        Returns the removed names.
+        """
+        now = time.time() if now is None else now
+        removed = []
+        with self._lock:
+            live = set(self._slots.values())
+            try:
+                names = os.listdir(self.root)
+            except OSError as e:
+                print(f"Warning: could not list uploads in {self.root}: {e}")
+                return removed
+            for filename in names:
+                # leftovers of interrupted uploads are collected like unreferenced blobs
+                partial = filename.startswith('.upload-') and filename.endswith('.tmp')
+                if not (partial or self.is_blob_name(filename)) or filename in live:
+                    continue
+                path = os.path.join(self.root, filename)
+                try:
+                    unreferenced_since = self._released.get(filename, os.path.getmtime(path))
+                    if now - unreferenced_since < self.grace_seconds:
+                        continue
+                    os.remove(path)
+                    removed.append(filename)
+                except OSError as e:
+                    print(f"Warning: could not remove unreferenced upload {path}: {e}")
+            stale = [name for name in self._released if name in removed or not os.path.exists(os.path.join(self.root, name))]
+            for name in stale:
+                self._released.pop(name, None)
+            if stale:
+                self._save_refs_locked()
+        return removed
@@ -0,0 +1,412 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from .role_graph_parser import get_entity_attr
+
+BUNDLE_MAGIC = b"CIALLOCB"
+BUNDLE_VERSION = 3
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGNMENT = 64
+
+
+def get_bundle_path(output_dir, role_name):
+    """Path of the compiled bundle for role_name inside output_dir."""
+    return os.path.join(output_dir, f'bundle_{role_name}.ccb')
+
+
+def _source_paths(role_name, graph_path, queries_dir, qna_dir):
+    return {
+        "graph": os.path.abspath(graph_path),
+        "queries": os.path.abspath(os.path.join(queries_dir, f'queries_{role_name}.json')),
+        "qna": os.path.abspath(os.path.join(qna_dir, f'qna_{role_name}.json')),
+    }
+
+
+def inputs_digest(entity_attr, query_schema, answer_schema):
+    """
+    Content hash of a role's attributes, standard queries and QnA. Order-sensitive,
+    since the embedding matrices follow the order of the schemas.
+    """
+    payload = json.dumps([entity_attr, query_schema, answer_schema], ensure_ascii=False)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _load_inputs(role_name, paths):
+    """(entity_attr, query_schema, answer_schema) of role_name as currently stored in its source files."""
+    graph_path = paths["graph"]
+    entity_attr = get_entity_attr(graph_path, role_name) if os.path.exists(graph_path) else {}
+    return entity_attr, _load_json_or_empty(paths["queries"]), _load_json_or_empty(paths["qna"])
+
+
+def _load_json_or_empty(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _invert_query_schema(query_schema):
+    """query -> [concepts], in the order RolePlayChatbot builds its query_to_attr."""
+    query_to_attr = {}
+    for attr, queries in query_schema.items():
+        for query in queries:
+            query_to_attr.setdefault(query, []).append(attr)
+    return query_to_attr
+
+
+class _StringTable:
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def add(self, text):
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = self.ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+
+    def add_all(self, texts):
+        return np.asarray([self.add(text) for text in texts], dtype=np.int32)
+
+    def encode(self):
+        encoded = [s.encode('utf-8') for s in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        if encoded:
+            offsets[1:] = np.cumsum([len(b) for b in encoded], dtype=np.uint64)
+        return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _grouped(table, groups):
+    """Flattens {key: [texts]} into (key ids, int64 offsets, member ids)."""
+    keys = table.add_all(list(groups))
+    offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+    members = []
+    for i, texts in enumerate(groups.values()):
+        members.extend(table.add(text) for text in texts)
+        offsets[i + 1] = len(members)
+    return keys, offsets, np.asarray(members, dtype=np.int32)
+
+
+def _write_bundle(path, header, sections):
+    """Writes the preamble, JSON header and 64-byte aligned raw sections, atomically."""
+    layout = {}
+    offset = 0
+    for name, array in sections.items():
+        array = np.ascontiguousarray(array)
+        sections[name] = array
+        offset = (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+        layout[name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += array.nbytes
+    header_bytes = json.dumps(dict(header, sections=layout), ensure_ascii=False).encode('utf-8')
+    data_start = _data_start(len(header_bytes))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in sections.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _data_start(header_len):
+    return (_PREAMBLE.size + header_len + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _read_header(path):
+    with open(path, 'rb') as f:
+        magic, version, header_len = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != BUNDLE_MAGIC:
+            raise ValueError(f"{path} is not a character bundle")
+        if version != BUNDLE_VERSION:
+            raise ValueError(f"Unsupported character bundle version {version} in {path}")
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    header["data_start"] = _data_start(header_len)
+    return header
+
+
+class CharacterBundle:
+    """
+    A compiled character: entity attributes, standard queries and QnA, plus the
+    pre-normalized embedding matrices RolePlayChatbot would otherwise compute at init.
+
+    Numeric sections are views into a read-only memory map of the bundle file
+    (or into one in-memory copy when use_mmap=False); only the string table is
+    decoded on load. Windows refuses to replace a file that is still mapped, so a
+    running chatbot there should load with use_mmap=False if bundles are recompiled
+    while it is open.
+    """
+
+    def __init__(self, path, use_mmap=True):
+        self.path = path
+        self.header = _read_header(path)
+        data_start = self.header["data_start"]
+        if use_mmap:
+            buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            buffer = np.fromfile(path, dtype=np.uint8)
+        self._buffer = buffer
+
+        def section(name):
+            spec = self.header["sections"][name]
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"])) if spec["shape"] else 1
+            start = data_start + spec["offset"]
+            return buffer[start:start + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+
+        offsets = section("string_offsets")
+        blob = section("string_blob").tobytes()
+        strings = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+        def grouped(keys_name, offsets_name, members_name):
+            keys, group_offsets, members = section(keys_name), section(offsets_name), section(members_name)
+            return {strings[key]: [strings[m] for m in members[group_offsets[i]:group_offsets[i + 1]]]
+                    for i, key in enumerate(keys)}
+
+        self.role = self.header["role"]
+        self.embedding_model = self.header.get("embedding_model")
+
+        self.entity_attr = grouped("attr_ids", "attr_desc_offsets", "desc_ids")
+        desc_offsets = section("attr_desc_offsets")
+        desc_matrix = section("desc_embeddings")
+        self.desc_embeddings = {attr: desc_matrix[desc_offsets[i]:desc_offsets[i + 1]]
+                                for i, attr in enumerate(self.entity_attr)}
+
+        self.query_schema = grouped("concept_ids", "concept_query_offsets", "concept_query_ids")
+        self.query_embeddings = section("query_embeddings")
+
+        self.answer_schema = grouped("question_ids", "answer_offsets", "answer_ids")
+        self.question_embeddings = section("question_embeddings")
+        self.answer_embeddings = section("answer_embeddings")
+
+    @property
+    def inputs_digest(self):
+        return self.header.get("inputs_digest")
+
+    def is_current(self, embedding_model=None):
+        """
+        True if the role's attributes, queries and QnA in the source files still have the
+        content the bundle was compiled from (and the embedding model matches, if given).
+
+        Content is compared rather than file signatures, so rewriting the files without
+        changing them (e.g. role graph journal compaction) does not make a bundle stale.
+        """
+        if embedding_model is not None and embedding_model != self.embedding_model:
+            return False
+        return inputs_digest(*_load_inputs(self.role, self.header.get("sources", {}))) == self.inputs_digest
+
+
+def load_character_bundle(path, use_mmap=True, embedding_model=None, require_current=True):
+    """
+    Loads a compiled character bundle. Returns None if it does not exist, cannot be
+    read, or (with require_current) is older than its source files.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        bundle = CharacterBundle(path, use_mmap=use_mmap)
+    except Exception as e:
+        print(f"Error loading character bundle {path}: {e}")
+        return None
+    if require_current and not bundle.is_current(embedding_model):
+        print(f"Character bundle {path} is out of date with its sources.")
+        return None
+    return bundle
+
+
+def find_character_bundle(bundle_dir, role_name, entity_attr, query_schema, answer_schema,
+                          use_mmap=True, embedding_model=None):
+    """
+    The compiled bundle for role_name in bundle_dir if it was built from exactly these
+    attributes, queries and QnA (and embedding_model, if given); otherwise None.
+    """
+    if not bundle_dir:
+        return None
+    bundle = load_character_bundle(get_bundle_path(bundle_dir, role_name), use_mmap=use_mmap,
+                                   embedding_model=embedding_model, require_current=False)
+    if bundle is None:
+        return None
+    if embedding_model is not None and bundle.embedding_model != embedding_model:
+        return None
+    if bundle.inputs_digest != inputs_digest(entity_attr, query_schema, answer_schema):
+        print(f"Character bundle for {role_name} does not match the given character data; not using it.")
+        return None
+    return bundle
+
+
+def compile_character_bundle(role_name, graph_path, queries_dir, qna_dir, output_path, embed,
+                             embedding_model=None):
+    """
+    Compiles one role's graph attributes, queries and QnA into a bundle at output_path.
+
+    embed maps a list of strings to a matrix of embeddings. Vectors from an existing
+    bundle built with the same embedding_model are reused, so only strings that are
+    new since the last compilation are embedded, in a single call.
+    """
+    paths = _source_paths(role_name, graph_path, queries_dir, qna_dir)
+    entity_attr, query_schema, answer_schema = _load_inputs(role_name, paths)
+    query_to_attr = _invert_query_schema(query_schema)
+
+    descriptions = [desc for descs in entity_attr.values() for desc in descs]
+    queries = list(query_to_attr)
+    questions = list(answer_schema)
+    answers = [answer for answers in answer_schema.values() for answer in answers]
+
+    known = {}
+    previous = load_character_bundle(output_path, use_mmap=False, require_current=False)
+    if previous is not None and previous.embedding_model == embedding_model:
+        for attr, descs in previous.entity_attr.items():
+            known.update(zip(descs, previous.desc_embeddings[attr]))
+        known.update(zip(_invert_query_schema(previous.query_schema), previous.query_embeddings))
+        known.update(zip(previous.answer_schema, previous.question_embeddings))
+        known.update(zip([a for answers in previous.answer_schema.values() for a in answers],
+                         previous.answer_embeddings))
+
+    missing = list(dict.fromkeys(text for text in descriptions + queries + questions + answers if text not in known))
+    if missing:
+        known.update(zip(missing, _normalize_rows(embed(missing))))
+    dim = len(next(iter(known.values()))) if known else 0
+
+    def matrix(texts):
+        if not texts:
+            return np.zeros((0, dim), dtype=np.float32)
+        return np.stack([known[text] for text in texts]).astype(np.float32, copy=False)
+
+    table = _StringTable()
+    attr_ids, attr_desc_offsets, desc_ids = _grouped(table, entity_attr)
+    concept_ids, concept_query_offsets, concept_query_ids = _grouped(table, query_schema)
+    question_ids, answer_offsets, answer_ids = _grouped(table, answer_schema)
+    string_offsets, string_blob = table.encode()
+
+    sections = {
+        "string_offsets": string_offsets,
+        "string_blob": string_blob,
+        "attr_ids": attr_ids,
+        "attr_desc_offsets": attr_desc_offsets,
+        "desc_ids": desc_ids,
+        "desc_embeddings": matrix(descriptions),
+        "concept_ids": concept_ids,
+        "concept_query_offsets": concept_query_offsets,
+        "concept_query_ids": concept_query_ids,
+        "query_embeddings": matrix(queries),
+        "question_ids": question_ids,
+        "answer_offsets": answer_offsets,
+        "answer_ids": answer_ids,
+        "question_embeddings": matrix(questions),
+        "answer_embeddings": matrix(answers),
+    }
+    header = {
+        "role": role_name,
+        "created": datetime.now().isoformat(),
+        "embedding_model": embedding_model,
+        "dim": dim,
+        "sources": paths,
+        "inputs_digest": inputs_digest(entity_attr, query_schema, answer_schema),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    _write_bundle(output_path, header, sections)
+    print(f"Compiled character bundle for {role_name} to {output_path} "
+          f"({len(missing)} new embedding(s), {len(known) - len(missing)} reused)")
+    return output_path
+
+
+class CharacterBundleCompiler:
+    """
+    Recompiles character bundles in the background after editor saves.
+
+    schedule() coalesces requests: compilation starts once no new request has
+    arrived for `delay` seconds. embed_provider is called at compile time and returns
+    the embedding function (or None while no embedding model is loaded, in which case
+    the request is dropped and the stale bundle is simply not used).
+    """
+
+    def __init__(self, output_dir, graph_path, queries_dir, qna_dir, embed_provider,
+                 embedding_model=None, delay=2.0):
+        self.output_dir = output_dir
+        self.graph_path = graph_path
+        self.queries_dir = queries_dir
+        self.qna_dir = qna_dir
+        self.embed_provider = embed_provider
+        self.embedding_model = embedding_model
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._compile_lock = threading.Lock()
+        self._pending = set()
+        self._pending_all = False
+        self._timer = None
+
+    def bundle_path(self, role_name):
+        return get_bundle_path(self.output_dir, role_name)
+
+    def compiled_roles(self):
+        """Roles that currently have a bundle in output_dir."""
+        if not os.path.isdir(self.output_dir):
+            return []
+        return [name[len('bundle_'):-len('.ccb')] for name in os.listdir(self.output_dir)
+                if name.startswith('bundle_') and name.endswith('.ccb')]
+
+    def compile(self, role_name):
+        """Compiles one role's bundle now. Returns the bundle path, or None if it could not be built."""
+        embed = self.embed_provider()
+        if embed is None:
+            print(f"No embedding model available; character bundle for {role_name} not compiled.")
+            return None
+        with self._compile_lock:
+            try:
+                return compile_character_bundle(role_name, self.graph_path, self.queries_dir, self.qna_dir,
+                                                self.bundle_path(role_name), embed, self.embedding_model)
+            except Exception as e:
+                print(f"Error compiling character bundle for {role_name}: {e}")
+                return None
+
+    def ensure_current(self, role_name):
+        """Schedules a compile of role_name's bundle if it is missing or out of date with its sources."""
+        bundle = load_character_bundle(self.bundle_path(role_name), use_mmap=False,
+                                       embedding_model=self.embedding_model)
+        if bundle is None:
+            self.schedule(role_name)
+            return False
+        return True
+
+    def schedule(self, role_name=None):
+        """Requests a recompile of role_name's bundle, or of every existing bundle when role_name is None."""
+        with self._lock:
+            if role_name is None:
+                self._pending_all = True
+            else:
+                self._pending.add(role_name)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self._run)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            roles = set(self._pending)
+            if self._pending_all:
+                roles.update(self.compiled_roles())
+            self._pending.clear()
+            self._pending_all = False
+            self._timer = None
+        for role_name in sorted(roles):
+            self.compile(role_name)
@@ -0,0 +1,106 @@
+import bisect
+import threading
+import uuid
+
+
+class ChatHistoryLog:
+    """
+    The UI-facing chat history of the current session, with sequence-numbered entries.
+
+    Every appended entry gets a "seq" that increases monotonically and is never reused,
+    so clients page through the log with cursors instead of copying it whole:
+    page(after=seq) returns only the entries a client has not seen yet, and
+    page(before=seq) walks back towards older ones. Rewriting the log (clearing it,
+    replacing it on resume, or dropping entries as update_input does) starts a new
+    epoch; a client whose cursor belongs to an older epoch gets reset=True with the
+    latest page and must discard what it holds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []
+        self._seqs = []
+        self._next_seq = 1
+        self.epoch = uuid.uuid4().hex[:12]
+
+    def _new_epoch_locked(self):
+        self.epoch = uuid.uuid4().hex[:12]
+
+    def _append_locked(self, entry):
+        entry = dict(entry)
+        entry['seq'] = self._next_seq
+        self._next_seq += 1
+        self._entries.append(entry)
+        self._seqs.append(entry['seq'])
+        return entry
+
+    def append(self, entry):
+        """Appends a copy of entry with its seq assigned; returns that copy."""
+        with self._lock:
+            return self._append_locked(entry)
+
+    def replace(self, entries):
+        """Replaces the whole log (e.g. with a resumed session) and starts a new epoch."""
+        with self._lock:
+            self._entries, self._seqs = [], []
+            self._new_epoch_locked()
+            for entry in entries or []:
+                self._append_locked(entry)
+
+    def clear(self):
+        self.replace([])
+
+    def truncate(self, length):
+        """Keeps the first length entries and starts a new epoch if anything was dropped."""
+        with self._lock:
+            if length >= len(self._entries):
+                return
+            del self._entries[max(length, 0):]
+            del self._seqs[max(length, 0):]
+            self._new_epoch_locked()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __getitem__(self, index):
+        with self._lock:
+            return self._entries[index]
+
+    @property
+    def latest_seq(self):
+        with self._lock:
+            return self._seqs[-1] if self._seqs else 0
+
+    def page(self, after=None, before=None, limit=50, epoch=None):
+        """
+        One page of the log.
+
+        Args:
+            after: return the oldest entries with seq > after (incremental sync).
+            before: return the newest entries with seq < before (loading older history).
+            limit: page size.
+            epoch: the epoch the client's cursor belongs to; a mismatch ignores the
+                cursors, returns the latest page and sets reset.
+
+        Without cursors the latest page is returned. has_more_before / has_more_after
+        tell whether entries exist outside the page in either direction.
+        """
+        with self._lock:
+            reset = epoch is not None and epoch != self.epoch
+            if reset:
+                after = before = None
+            if after is not None:
+                start = bisect.bisect_right(self._seqs, after)
+                end = min(start + limit, len(self._seqs))
+            else:
+                end = bisect.bisect_left(self._seqs, before) if before is not None else len(self._seqs)
+                start = max(end - limit, 0)
+            return {
+                "history": [dict(entry) for entry in self._entries[start:end]],
+                "epoch": self.epoch,
+                "latest_seq": self._seqs[-1] if self._seqs else 0,
+                "has_more_before": start > 0,
+                "has_more_after": end < len(self._seqs),
+                "reset": reset,
+            }
@@ -0,0 +1,122 @@
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+_HASH_CHUNK_SIZE = 1024 * 64
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def content_hash(path, digest_size=16):
+    """Hex BLAKE2b digest of a file's content, read in chunks."""
+    digest = hashlib.blake2b(digest_size=digest_size)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageAsset:
+    __slots__ = ('token', 'abs_path', 'orig_path', 'mimetype', 'signature')
+
+    def __init__(self, token, abs_path, orig_path, mimetype, signature):
+        self.token = token
+        self.abs_path = abs_path
+        self.orig_path = orig_path
+        self.mimetype = mimetype
+        self.signature = signature
+
+    @property
+    def etag(self):
+        return self.token
+
+
+class ImageAssetService:
+    """
+    Maps image files to serve tokens derived from their content.
+
+    A token is the content hash of the file, so the same bytes always get the same
+    token (across paths and restarts) and the bytes behind a token never change; that
+    is what makes the immutable cache headers in /serve_image safe. A path -> token
+    reverse index keyed by the file's mtime and size avoids rehashing unchanged files;
+    an edited file gets a new token. The token table is an LRU bounded by max_entries;
+    pinned tokens (the defaults handed out once at startup) are never evicted, since
+    nothing would re-issue them.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._assets = OrderedDict()
+        self._by_path = {}
+        self._pinned = set()
+
+    def token_for(self, file_path, pin=False):
+        """
+        Token for file_path, or None when the path is invalid or the file is missing.
+        With pin=True the token is exempt from LRU eviction.
+        """
+        if not file_path or not isinstance(file_path, str):
+            return None
+        abs_path = os.path.abspath(file_path)
+        signature = _file_signature(abs_path)
+        if signature is None:
+            return None
+        with self._lock:
+            cached = self._by_path.get(abs_path)
+            if cached is not None and cached[0] == signature and cached[1] in self._assets:
+                self._assets.move_to_end(cached[1])
+                if pin:
+                    self._pinned.add(cached[1])
+                return cached[1]
+
+        try:
+            token = content_hash(abs_path)
+        except OSError:
+            return None
+        mimetype = mimetypes.guess_type(abs_path)[0] or 'application/octet-stream'
+        with self._lock:
+            self._by_path[abs_path] = (signature, token)
+            asset = self._assets.get(token)
+            if asset is None or not self.is_current(asset):
+                self._assets[token] = ImageAsset(token, abs_path, file_path, mimetype, signature)
+            self._assets.move_to_end(token)
+            if pin:
+                self._pinned.add(token)
+            self._evict_locked()
+        return token
+
+    def _evict_locked(self):
+        excess = len(self._assets) - self.max_entries
+        if excess <= 0:
+            return
+        evicted = [token for token in self._assets if token not in self._pinned][:excess]
+        for token in evicted:
+            del self._assets[token]
+        evicted = set(evicted)
+        self._by_path = {path: entry for path, entry in self._by_path.items() if entry[1] not in evicted}
+
+    def resolve(self, token):
+        """The ImageAsset for token, or None when it is unknown or was evicted."""
+        with self._lock:
+            asset = self._assets.get(token)
+            if asset is not None:
+                self._assets.move_to_end(token)
+            return asset
+
+    def is_current(self, asset):
+        """Whether the file behind asset is unchanged since its token was issued."""
+        return _file_signature(asset.abs_path) == asset.signature
+
+    def __len__(self):
+        with self._lock:
+            return len(self._assets)
@@ -0,0 +1,174 @@
+import os
+import threading
+import uuid
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow is optional; without it originals are served unchanged
+    Image = None
+    features = None
+
+# Requested dimensions snap up to one of these, so a handful of variants per sprite cover every viewport
+SIZE_BUCKETS = (256, 384, 512, 768, 1024, 1536, 2048, 3072, 4096)
+VARIANT_FORMATS = {
+    'avif': ('AVIF', 'image/avif', {'quality': 60}),
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'png': ('PNG', 'image/png', {'optimize': True}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True}),
+}
+# Formats picked from the Accept header, best first
+NEGOTIATED_FORMATS = ('avif', 'webp')
+
+
+def _snap(size):
+    if not size or size <= 0:
+        return 0
+    for bucket in SIZE_BUCKETS:
+        if bucket >= size:
+            return bucket
+    return SIZE_BUCKETS[-1]
+
+
+def _parse_size(value):
+    try:
+        return int(value) if value not in (None, '') else 0
+    except (TypeError, ValueError):
+        return 0
+
+
+def pillow_supports(fmt):
+    """Whether the installed Pillow can encode fmt (a VARIANT_FORMATS key)."""
+    if Image is None:
+        return False
+    if fmt in ('png', 'jpeg'):
+        return True
+    if fmt == 'avif':
+        try:
+            import pillow_avif  # noqa: F401  (registers the AVIF plugin on older Pillow)
+        except ImportError:
+            pass
+        if 'AVIF' in Image.SAVE:
+            return True
+    try:
+        return bool(features.check(fmt))
+    except Exception:
+        return False
+
+
+class VariantSpec:
+    __slots__ = ('width', 'height', 'fmt', 'negotiated')
+
+    def __init__(self, width, height, fmt, negotiated):
+        self.width = width
+        self.height = height
+        self.fmt = fmt
+        self.negotiated = negotiated
+
+    @property
+    def key(self):
+        return f"{self.width}x{self.height}.{self.fmt or 'src'}"
+
+
+class ImageVariantCache:
+    """
+    Lazily generated, disk-cached resized / re-encoded variants of served images.
+
+    Variants are keyed by the source's content-hash token plus the snapped bounding box
+    and format, so they are immutable and shared by every path with the same content.
+    Images are only ever scaled down (to fit the box, keeping the aspect ratio); animated
+    images and sources Pillow cannot read are served as-is. A variant that comes out
+    larger than its source is not used.
+    """
+
+    def __init__(self, cache_dir, enabled=True):
+        self.cache_dir = cache_dir
+        self.enabled = bool(enabled and cache_dir and Image is not None)
+        self._locks_guard = threading.Lock()
+        self._locks = {}
+        # variants that failed to generate or came out larger than their source
+        self._unusable = set()
+        self._supported = {fmt: pillow_supports(fmt) for fmt in VARIANT_FORMATS} if self.enabled else {}
+
+    def negotiate(self, width=None, height=None, fmt=None, accept=''):
+        """
+        Variant for the request, or None when the original should be served.
+
+        Args:
+            width, height: requested bounding box in pixels (query params w / h); snapped up to SIZE_BUCKETS.
+            fmt: explicit format (query param format); "original" keeps the source format.
+            accept: the request's Accept header, used when fmt is not given.
+        """
+        if not self.enabled:
+            return None
+        width, height = _snap(_parse_size(width)), _snap(_parse_size(height))
+        negotiated = not fmt
+        if fmt:
+            fmt = str(fmt).lower().replace('jpg', 'jpeg')
+            fmt = fmt if self._supported.get(fmt) else None
+        else:
+            accept = (accept or '').lower()
+            fmt = next((f for f in NEGOTIATED_FORMATS
+                        if self._supported.get(f) and VARIANT_FORMATS[f][1] in accept), None)
+        if not (width or height or fmt):
+            return None
+        return VariantSpec(width, height, fmt, negotiated)
+
+    def etag(self, token, spec):
+        return f"{token}-{spec.key}"
+
+    def _variant_path(self, token, spec, source_ext):
+        ext = spec.fmt or source_ext.lstrip('.').lower() or 'img'
+        return os.path.join(self.cache_dir, token[:2], f"{token}_{spec.width}x{spec.height}.{ext}")
+
+    def _lock_for(self, path):
+        with self._locks_guard:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def get(self, token, source_path, spec):
+        """
+        Path and mimetype of the variant, generating it on first use. None means serve the original.
+        """
+        if spec is None or not self.enabled:
+            return None
+        source_ext = os.path.splitext(source_path)[1]
+        path = self._variant_path(token, spec, source_ext)
+        if path in self._unusable:
+            return None
+        if not os.path.exists(path):
+            with self._lock_for(path):
+                if not os.path.exists(path) and not self._generate(source_path, path, spec):
+                    self._unusable.add(path)
+                    return None
+        try:
+            if os.path.getsize(path) >= os.path.getsize(source_path):
+                self._unusable.add(path)
+                return None
+        except OSError:
+            return None
+        mimetype = VARIANT_FORMATS[spec.fmt][1] if spec.fmt else None
+        return path, mimetype
+
+    def _generate(self, source_path, path, spec):
+        try:
+            with Image.open(source_path) as image:
+                if getattr(image, 'is_animated', False):
+                    return False
+                source_format = image.format
+                image.load()
+                if spec.width or spec.height:
+                    image.thumbnail((spec.width or image.width, spec.height or image.height), Image.LANCZOS)
+                pil_format, _, options = VARIANT_FORMATS[spec.fmt] if spec.fmt else (source_format, None, {})
+                if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                try:
+                    image.save(tmp_path, format=pil_format, **options)
+                    os.replace(tmp_path, path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            return True
+        except Exception as e:
+            print(f"Warning: could not generate image variant {path} from {source_path}: {e}")
+            return False
@@ -0,0 +1,66 @@
+import json
+import os
+import threading
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _etag_for(signature):
+    return f"{signature[0]:x}-{signature[1]:x}"
+
+
+class JsonDocumentCache:
+    """
+    In-process cache of parsed JSON documents, revalidated against each file's
+    mtime and size on every access.
+
+    Documents handed out are shared with the cache and must be treated as read-only.
+    Editors work copy-on-write: take a shallow copy of the document, replace (rather
+    than mutate) any nested value they change, save it, then store() the copy. A
+    failed save simply drops the copy, so the cached original is the rollback.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def load(self, path):
+        """Returns (document, etag). Raises FileNotFoundError or the JSON parse error."""
+        signature = _file_signature(path)
+        if signature is None:
+            with self._lock:
+                self._entries.pop(path, None)
+            raise FileNotFoundError(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == signature:
+            return entry[1], entry[2]
+
+        with open(path, 'r', encoding='utf-8') as f:
+            document = json.load(f)
+        # Keyed by the pre-read signature, so a rewrite racing this read is reloaded next time.
+        etag = _etag_for(signature)
+        with self._lock:
+            self._entries[path] = (signature, document, etag)
+        return document, etag
+
+    def store(self, path, document):
+        """Records a document that was just written to path. Returns its new etag."""
+        signature = _file_signature(path)
+        if signature is None:
+            self.invalidate(path)
+            return None
+        etag = _etag_for(signature)
+        with self._lock:
+            self._entries[path] = (signature, document, etag)
+        return etag
+
+    def invalidate(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
@@ -0,0 +1,226 @@
+import heapq
+from collections import deque
+from operator import itemgetter
+
+
+def _named_viewers(access_rights):
+    """Roles explicitly named by a description's access_rights."""
+    if isinstance(access_rights, list):
+        return set(access_rights)
+    if isinstance(access_rights, str) and access_rights and access_rights != "unlimited":
+        return {access_rights}
+    return set()
+
+
+class RoleGraphIndex:
+    """
+    Inverted indexes over role graph data, kept current by apply_graph_op.
+
+    - viewer -> owner -> attribute -> [(position, description)] for descriptions whose
+      access_rights name the viewer;
+    - owner -> attribute -> [(position, description)] for descriptions whose access_rights
+      are not a list (normally "unlimited"), which any viewer may be able to see;
+    - target -> sources (and source -> targets) for ideas, so "who has ideas about X"
+      needs no scan and multi-hop relation queries walk only the adjacency lists.
+
+    Entries keep their position inside the attribute list so callers can reproduce the
+    graph's own ordering. Index lists are replaced rather than mutated, so readers can
+    iterate them while a writer reindexes.
+    """
+
+    def __init__(self, graph=None):
+        self._named = {}
+        self._open = {}
+        self._attr_viewers = {}
+        self._owner_attrs = {}
+        self._idea_sources = {}
+        self._idea_targets = {}
+        if graph is not None:
+            self.rebuild(graph)
+
+    def rebuild(self, graph):
+        """Indexes the whole graph from scratch."""
+        self._named = {}
+        self._open = {}
+        self._attr_viewers = {}
+        self._owner_attrs = {}
+        self._idea_sources = {}
+        self._idea_targets = {}
+        for owner, role_data in graph.get("roles", {}).items():
+            for attr_name in role_data.get("attributes", {}):
+                self.reindex_attribute(graph, owner, attr_name)
+            for target in role_data.get("ideas", {}):
+                self.reindex_ideas(graph, owner, target)
+
+    def _unindex_attribute(self, owner, attr_name):
+        owner_attrs = self._owner_attrs.get(owner)
+        if owner_attrs is not None:
+            owner_attrs.discard(attr_name)
+            if not owner_attrs:
+                self._owner_attrs.pop(owner, None)
+        for viewer in self._attr_viewers.pop((owner, attr_name), ()):
+            owners = self._named.get(viewer, {})
+            attrs = owners.get(owner, {})
+            attrs.pop(attr_name, None)
+            if not attrs:
+                owners.pop(owner, None)
+            if not owners:
+                self._named.pop(viewer, None)
+        open_attrs = self._open.get(owner, {})
+        open_attrs.pop(attr_name, None)
+        if not open_attrs:
+            self._open.pop(owner, None)
+
+    def reindex_attribute(self, graph, owner, attr_name):
+        """Re-derives the entries of one attribute list; cost is proportional to that list."""
+        self._unindex_attribute(owner, attr_name)
+        descriptions = graph.get("roles", {}).get(owner, {}).get("attributes", {}).get(attr_name)
+        if not descriptions:
+            return
+        named = {}
+        opened = []
+        for position, desc in enumerate(descriptions):
+            access_rights = desc.get("access_rights", "unlimited")
+            for viewer in _named_viewers(access_rights):
+                named.setdefault(viewer, []).append((position, desc))
+            if not isinstance(access_rights, list):
+                opened.append((position, desc))
+        for viewer, entries in named.items():
+            self._named.setdefault(viewer, {}).setdefault(owner, {})[attr_name] = entries
+        if named:
+            self._attr_viewers[(owner, attr_name)] = set(named)
+        if opened:
+            self._open.setdefault(owner, {})[attr_name] = opened
+        self._owner_attrs.setdefault(owner, set()).add(attr_name)
+
+    @staticmethod
+    def _with(mapping, key, member):
+        members = mapping.get(key, {})
+        if member not in members:
+            mapping[key] = {**members, member: None}
+
+    @staticmethod
+    def _without(mapping, key, member):
+        members = mapping.get(key, {})
+        if member in members:
+            members = {m: None for m in members if m != member}
+            if members:
+                mapping[key] = members
+            else:
+                mapping.pop(key, None)
+
+    def reindex_ideas(self, graph, source, target):
+        """Updates the idea entries for a single source/target pair."""
+        ideas = graph.get("roles", {}).get(source, {}).get("ideas", {}).get(target)
+        if ideas is not None:
+            self._with(self._idea_sources, target, source)
+            self._with(self._idea_targets, source, target)
+        else:
+            self._without(self._idea_sources, target, source)
+            self._without(self._idea_targets, source, target)
+
+    def drop_role(self, role_name):
+        """Forgets a deleted role as owner, viewer and idea source/target.
+
+        Attributes of other roles that named it must be reindexed by the caller once
+        their access_rights have been rewritten (see attributes_naming).
+        """
+        for attr_name in list(self._owner_attrs.get(role_name, ())):
+            self._unindex_attribute(role_name, attr_name)
+        for target in self._idea_targets.pop(role_name, {}):
+            self._without(self._idea_sources, target, role_name)
+        for source in self._idea_sources.pop(role_name, {}):
+            self._without(self._idea_targets, source, role_name)
+
+    def attributes_naming(self, viewer):
+        """(owner, attribute) pairs with at least one description whose access_rights name viewer."""
+        return [(owner, attr_name)
+                for owner, attrs in list(self._named.get(viewer, {}).items())
+                for attr_name in list(attrs)]
+
+    def attribute_audience(self, owner, attr_name):
+        """(viewers named by the attribute's descriptions, whether any description is unrestricted)."""
+        viewers = set(self._attr_viewers.get((owner, attr_name), ()))
+        return viewers, attr_name in self._open.get(owner, {})
+
+    def idea_sources(self, target):
+        """Roles that hold ideas about target, in the order they were indexed."""
+        return list(self._idea_sources.get(target, {}))
+
+    def idea_targets(self, source):
+        """Roles that source holds ideas about, in the order they were indexed."""
+        return list(self._idea_targets.get(source, {}))
+
+    def _adjacent(self, role_name, direction):
+        if direction == "out":
+            return self._idea_targets.get(role_name, {})
+        if direction == "in":
+            return self._idea_sources.get(role_name, {})
+        return {**self._idea_targets.get(role_name, {}), **self._idea_sources.get(role_name, {})}
+
+    def neighbors(self, role_name, hops=1, direction="both"):
+        """
+        Roles reachable from role_name over idea relations within `hops` steps, as
+        {role: distance} in breadth-first order. direction is "out" (role_name's ideas
+        about others), "in" (others' ideas about role_name) or "both".
+        """
+        distances = {role_name: 0}
+        frontier = deque([role_name])
+        while frontier:
+            current = frontier.popleft()
+            if distances[current] >= hops:
+                continue
+            for other in self._adjacent(current, direction):
+                if other not in distances:
+                    distances[other] = distances[current] + 1
+                    frontier.append(other)
+        del distances[role_name]
+        return distances
+
+    def shortest_path(self, source, target, direction="out"):
+        """Shortest chain of roles linking source to target over idea relations, or None."""
+        if source == target:
+            return [source]
+        parents = {source: None}
+        frontier = deque([source])
+        while frontier:
+            current = frontier.popleft()
+            for other in self._adjacent(current, direction):
+                if other in parents:
+                    continue
+                parents[other] = current
+                if other == target:
+                    path = [target]
+                    while parents[path[-1]] is not None:
+                        path.append(parents[path[-1]])
+                    return path[::-1]
+                frontier.append(other)
+        return None
+
+    def candidate_descriptions(self, viewer, owner, attribute_names):
+        """
+        Yields (attribute, description) pairs of owner that viewer may be able to access:
+        those naming viewer plus those not restricted by a role list, in graph order.
+        Callers apply their own access predicate to the candidates.
+        """
+        named = self._named.get(viewer, {}).get(owner, {})
+        opened = self._open.get(owner, {})
+        if not named and not opened:
+            return
+        for attr_name in attribute_names:
+            first = named.get(attr_name, ())
+            second = opened.get(attr_name, ())
+            if not first and not second:
+                continue
+            last_position = None
+            for position, desc in heapq.merge(first, second, key=itemgetter(0)):
+                if position == last_position:
+                    continue
+                last_position = position
+                yield attr_name, desc
+
+    def candidate_owners(self, graph, viewer):
+        """Roles (in graph order) owning at least one description viewer may be able to access."""
+        named = self._named.get(viewer, {})
+        return [owner for owner in list(graph.get("roles", {}))
+                if owner in named or owner in self._open]
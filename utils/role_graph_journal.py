@@ -0,0 +1,360 @@
+import json
+import os
+import threading
+
+
+def _strip_role_from_descriptions(descriptions, role_name):
+    for i in range(len(descriptions))[-1::-1]:
+        desc = descriptions[i]
+        if isinstance(desc.get("access_rights"), list):
+            desc["access_rights"] = [ar for ar in desc["access_rights"] if ar != role_name]
+        elif isinstance(desc.get("access_rights"), str):
+            if desc["access_rights"] == role_name:
+                descriptions.pop(i)
+
+
+def _delete_role(graph, role_name, index=None):
+    roles = graph["roles"]
+    del roles[role_name]
+    if index is None:
+        for source_role_data in roles.values():
+            if role_name in source_role_data.get("ideas", {}):
+                del source_role_data["ideas"][role_name]
+        for current_role_data in roles.values():
+            for descriptions in current_role_data.get("attributes", {}).values():
+                _strip_role_from_descriptions(descriptions, role_name)
+        return
+
+    # With an index only the roles and attributes that actually reference the deleted role are visited.
+    for source_role in index.idea_sources(role_name):
+        source_role_data = roles.get(source_role)
+        if source_role_data and role_name in source_role_data.get("ideas", {}):
+            del source_role_data["ideas"][role_name]
+    touched = [(owner, attr_name) for owner, attr_name in index.attributes_naming(role_name) if owner != role_name]
+    for owner, attr_name in touched:
+        descriptions = roles.get(owner, {}).get("attributes", {}).get(attr_name)
+        if descriptions:
+            _strip_role_from_descriptions(descriptions, role_name)
+    index.drop_role(role_name)
+    for owner, attr_name in touched:
+        index.reindex_attribute(graph, owner, attr_name)
+
+
+def apply_graph_op(graph, op, index=None):
+    """Applies a single role graph edit (as stored in the journal) to graph data in place.
+
+    A "batch" edit carries an ordered list of edits under "ops" and applies them in turn.
+
+    When a RoleGraphIndex is given it is updated for exactly the attributes and idea
+    pairs the edit touched.
+    """
+    roles = graph.setdefault("roles", {})
+    kind = op.get("op")
+
+    if kind == "add_role":
+        roles[op["role"]] = {"attributes": {}, "ideas": {}}
+
+    elif kind == "delete_role":
+        _delete_role(graph, op["role"], index)
+        return
+
+    elif kind == "batch":
+        for sub_op in op["ops"]:
+            apply_graph_op(graph, sub_op, index)
+        return
+
+    elif kind == "add_attribute_description":
+        attributes = roles[op["role"]].setdefault("attributes", {})
+        attributes.setdefault(op["attribute"], []).append({
+            "description": op["description"],
+            "access_rights": op["access_rights"]
+        })
+
+    elif kind == "add_description_for":
+        source_role = op["source"]
+        attributes = roles[op["target"]].setdefault("attributes", {})
+        descriptions = attributes.setdefault(op["attribute"], [])
+        for item in descriptions:
+            if item["description"] == op["description"]:
+                access_rights = item.get("access_rights")
+                if not access_rights:
+                    item["access_rights"] = [source_role]
+                elif isinstance(access_rights, list):
+                    if source_role not in access_rights:
+                        access_rights.append(source_role)
+                elif access_rights != "unlimited" and access_rights != source_role:
+                    item["access_rights"] = [access_rights, source_role]
+                break
+        else:
+            descriptions.append({
+                "description": op["description"],
+                "access_rights": [source_role]
+            })
+
+    elif kind == "add_idea":
+        ideas = roles[op["source"]].setdefault("ideas", {})
+        ideas.setdefault(op["target"], []).append(op["idea"])
+
+    elif kind == "delete_attribute":
+        role_data = roles[op["role"]]
+        attributes = role_data.get("attributes", {})
+        del attributes[op["attribute"]]
+        if not attributes:
+            role_data.pop("attributes", None)
+
+    elif kind == "delete_description":
+        role_data = roles[op["role"]]
+        attributes = role_data.get("attributes", {})
+        descriptions = attributes[op["attribute"]]
+        descriptions.pop(op["index"])
+        if not descriptions:
+            del attributes[op["attribute"]]
+            if not attributes:
+                role_data.pop("attributes", None)
+
+    elif kind == "delete_ideas_to":
+        role_data = roles[op["source"]]
+        ideas = role_data.get("ideas", {})
+        del ideas[op["target"]]
+        if not ideas:
+            role_data.pop("ideas", None)
+
+    elif kind == "delete_idea":
+        role_data = roles[op["source"]]
+        ideas = role_data.get("ideas", {})
+        ideas_list = ideas[op["target"]]
+        ideas_list.pop(op["index"])
+        if not ideas_list:
+            del ideas[op["target"]]
+            if not ideas:
+                role_data.pop("ideas", None)
+
+    else:
+        raise ValueError(f"Unknown role graph operation: {kind}")
+
+    if index is not None:
+        if "attribute" in op:
+            index.reindex_attribute(graph, op.get("role", op.get("target")), op["attribute"])
+        elif kind in ("add_idea", "delete_ideas_to", "delete_idea"):
+            index.reindex_ideas(graph, op["source"], op["target"])
+
+
+# Snapshot key holding the seq of the last journal entry folded into it
+SNAPSHOT_SEQ_KEY = "journal_seq"
+
+
+def get_journal_path(snapshot_path):
+    """Returns the journal file that accompanies a role graph snapshot."""
+    return snapshot_path + ".journal"
+
+
+def _read_journal(journal_path):
+    """Reads journal entries, returning (ops, valid_byte_length).
+
+    A torn final line (crash during append) is not an entry; valid_byte_length
+    marks where the last complete entry ends so the owner can truncate the tail.
+    """
+    ops = []
+    valid_length = 0
+    if not os.path.exists(journal_path):
+        return ops, valid_length
+    with open(journal_path, 'rb') as f:
+        raw = f.read()
+    offset = 0
+    for line in raw.splitlines(keepends=True):
+        offset += len(line)
+        if not line.endswith(b"\n"):
+            break
+        stripped = line.strip()
+        if stripped:
+            try:
+                ops.append(json.loads(stripped.decode('utf-8')))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                break
+        valid_length = offset
+    return ops, valid_length
+
+
+def _replay(graph, ops, journal_path, applied_seq=0):
+    """Applies the journal entries newer than applied_seq (the seq the snapshot was compacted at).
+
+    Entries at or below applied_seq are already part of the snapshot; replaying them again
+    would duplicate additions and make index-based deletions remove the wrong entries.
+    Returns the seq of the last entry seen.
+    """
+    last_seq = applied_seq
+    for op in ops:
+        seq = op.get("seq")
+        if seq is not None:
+            if seq <= applied_seq:
+                continue
+            last_seq = seq
+        try:
+            apply_graph_op(graph, op)
+        except Exception as e:
+            print(f"Skipping unreplayable journal entry {op} from {journal_path}: {e}")
+    return last_seq
+
+
+def _snapshot_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _read_snapshot(filepath):
+    """Reads a snapshot file, returning (graph, applied_seq)."""
+    if not os.path.exists(filepath):
+        return {"roles": {}}, 0
+    with open(filepath, 'r', encoding='utf-8') as f:
+        graph = json.load(f)
+    return graph, graph.pop(SNAPSHOT_SEQ_KEY, 0)
+
+
+def load_graph(filepath, journal_path=None, max_attempts=5):
+    """Loads a role graph snapshot and replays any edits journaled since the last compaction.
+
+    Safe to call while a RoleGraphJournal compacts the same files in the background: a
+    snapshot that was swapped while the journal was being read is read again, and journal
+    entries the snapshot already contains are skipped by seq.
+
+    Raises the underlying error if the snapshot exists but cannot be read, and
+    RuntimeError if no consistent snapshot/journal pair was read in max_attempts tries.
+    """
+    if journal_path is None:
+        journal_path = get_journal_path(filepath)
+    for _ in range(max_attempts):
+        signature = _snapshot_signature(filepath)
+        graph, applied_seq = _read_snapshot(filepath)
+        ops, _ = _read_journal(journal_path)
+        # An unchanged snapshot means the journal we read was not truncated by a compaction
+        # that our snapshot predates.
+        if _snapshot_signature(filepath) == signature:
+            _replay(graph, ops, journal_path, applied_seq)
+            return graph
+    raise RuntimeError(f"Role graph {filepath} kept changing while it was read; "
+                       f"gave up after {max_attempts} attempts.")
+
+
+class RoleGraphJournal:
+    """
+    Append-only edit journal in front of a role graph snapshot file.
+
+    Edits are appended as one JSON line each and fsync'd, so the cost of a write is
+    proportional to the edit rather than to the graph. A background thread folds the
+    journal back into the snapshot once enough edits have piled up (or the journal
+    has been idle for `compact_interval` seconds); on startup the journal is replayed
+    over the snapshot to recover edits that were never compacted.
+
+    Every entry carries a monotonically increasing "seq" and the snapshot records the
+    seq it was compacted at, so replay is idempotent: a crash between swapping in a new
+    snapshot and truncating the journal, or a reader that sees the new snapshot with the
+    old journal, does not apply an edit twice.
+    """
+
+    def __init__(self, snapshot_path, journal_path=None, compact_threshold=256, compact_interval=30.0):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or get_journal_path(snapshot_path)
+        self.compact_threshold = compact_threshold
+        self.compact_interval = compact_interval
+        self.lock = threading.RLock()
+        self.graph = {"roles": {}}
+        self.pending = 0
+        self.seq = 0
+        self._compact_requested = threading.Event()
+        self._compactor = None
+
+    def load(self):
+        """Loads the snapshot, replays the journal and returns the recovered graph."""
+        with self.lock:
+            applied_seq = 0
+            if os.path.exists(self.snapshot_path):
+                try:
+                    graph, applied_seq = _read_snapshot(self.snapshot_path)
+                    print(f"Graph data loaded successfully from {self.snapshot_path}")
+                except json.JSONDecodeError:
+                    print(f"Error decoding JSON from {self.snapshot_path}. Starting with empty graph.")
+                    graph = {"roles": {}}
+                except Exception as e:
+                    print(f"Error loading graph data from {self.snapshot_path}: {e}. Starting with empty graph.")
+                    graph = {"roles": {}}
+            else:
+                print(f"Data file not found at {self.snapshot_path}. Starting with empty graph.")
+                graph = {"roles": {}}
+
+            ops, valid_length = _read_journal(self.journal_path)
+            if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) != valid_length:
+                print(f"Discarding torn tail of journal {self.journal_path}.")
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(valid_length)
+                    f.flush()
+                    os.fsync(f.fileno())
+            new_ops = [op for op in ops if op.get("seq") is None or op["seq"] > applied_seq]
+            if new_ops:
+                print(f"Replaying {len(new_ops)} journaled edit(s) from {self.journal_path}")
+            self.seq = _replay(graph, ops, self.journal_path, applied_seq)
+
+            self.graph = graph
+            # Entries the snapshot already contains still make the journal worth truncating
+            self.pending = len(ops)
+            return graph
+
+    def append(self, op):
+        """Durably appends one edit to the journal. Returns False if it could not be written."""
+        with self.lock:
+            line = (json.dumps({"seq": self.seq + 1, **op}, ensure_ascii=False) + "\n").encode('utf-8')
+            try:
+                with open(self.journal_path, 'ab') as f:
+                    start = f.tell()
+                    try:
+                        f.write(line)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    except Exception:
+                        f.truncate(start)
+                        raise
+            except Exception as e:
+                print(f"Error appending to role graph journal {self.journal_path}: {e}")
+                return False
+            self.seq += 1
+            self.pending += 1
+            if self.pending >= self.compact_threshold:
+                self._compact_requested.set()
+            return True
+
+    def compact(self):
+        """Writes the in-memory graph to the snapshot atomically and empties the journal."""
+        with self.lock:
+            tmp_path = self.snapshot_path + ".tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({**self.graph, SNAPSHOT_SEQ_KEY: self.seq}, f, ensure_ascii=False, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+                with open(self.journal_path, 'wb') as f:
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception as e:
+                print(f"Error compacting graph data into {self.snapshot_path}: {e}")
+                return False
+            if self.pending:
+                print(f"Compacted {self.pending} journaled edit(s) into {self.snapshot_path}")
+            self.pending = 0
+            return True
+
+    def start_compactor(self):
+        """Starts the background compaction thread (idempotent)."""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self._compact_loop, name="RoleGraphCompactor", daemon=True)
+        self._compactor.start()
+
+    def _compact_loop(self):
+        while True:
+            self._compact_requested.wait(self.compact_interval)
+            self._compact_requested.clear()
+            if self.pending:
+                self.compact()
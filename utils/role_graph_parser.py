@@ -1,8 +1,22 @@
 import itertools
+import os
 from collections import defaultdict
-import json
+from .role_graph_journal import load_graph, get_journal_path
+from .role_graph_index import RoleGraphIndex
 
-def parse_entity_attr(entity, role_name, source_role = None):
+# (abs graph path, role) -> (file signature, parsed attributes); see get_entity_attr.
+_entity_attr_cache = {}
+# abs graph path -> (file signature, graph, RoleGraphIndex); shared by every role of the same graph.
+_graph_index_cache = {}
+
+def _iter_descriptions(attributes):
+    for attr_name, descriptions in attributes.items():
+        if not descriptions:
+            continue
+        for desc in descriptions:
+            yield attr_name, desc
+
+def parse_entity_attr(entity, role_name, source_role = None, index = None):
     if not source_role:
         source_role = role_name
     prefix = ""
@@ -14,31 +28,60 @@ def parse_entity_attr(entity, role_name, source_role = None):
         print("\b not attrs. \n")
         pass
     else:
-        for attr_name, descriptions in attributes.items():
-            if not descriptions:
+        # A RoleGraphIndex narrows the walk to descriptions source_role can possibly see.
+        if index is not None:
+            candidates = index.candidate_descriptions(source_role, role_name, list(attributes))
+        else:
+            candidates = _iter_descriptions(attributes)
+        for attr_name, desc in candidates:
+            if not desc.get("description", None):
                 continue
-            else:
-                for desc in descriptions:
-                    if not desc.get("description", None):
-                        continue
-                    access = desc.get("access_rights", "unlimited")
-                    if isinstance(access, list):
-                        if source_role in access:
-                            all_attr[attr_name].append(prefix + f"{role_name}的{attr_name}包括: " + desc['description'])
-                    elif isinstance(access, str):
-                        if (not access or access == "unlimited" or access == source_role):
-                            all_attr[attr_name].append(prefix + f"{role_name}的{attr_name}包括: " + desc['description'])
+            access = desc.get("access_rights", "unlimited")
+            if isinstance(access, list):
+                if source_role in access:
+                    all_attr[attr_name].append(prefix + f"{role_name}的{attr_name}包括: " + desc['description'])
+            elif isinstance(access, str):
+                if (not access or access == "unlimited" or access == source_role):
+                    all_attr[attr_name].append(prefix + f"{role_name}的{attr_name}包括: " + desc['description'])
     return all_attr
 
+def _graph_file_signature(rg_path):
+    signature = []
+    for path in (rg_path, get_journal_path(rg_path)):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+def _load_indexed_graph(rg_path, signature):
+    """Loads the graph and its RoleGraphIndex once per file signature."""
+    cache_key = os.path.abspath(rg_path)
+    cached = _graph_index_cache.get(cache_key)
+    if cached is not None and cached[0] == signature:
+        return cached[1], cached[2]
+    rg = load_graph(rg_path)
+    index = RoleGraphIndex(rg)
+    _graph_index_cache[cache_key] = (signature, rg, index)
+    return rg, index
+
+def _copy_entity_attr(all_attr):
+    return defaultdict(list, {attr: list(descs) for attr, descs in all_attr.items()})
+
 def get_entity_attr(rg_path,role_name):
+    cache_key = (os.path.abspath(rg_path), role_name)
+    signature = _graph_file_signature(rg_path)
+    cached = _entity_attr_cache.get(cache_key)
+    if cached is not None and cached[0] == signature:
+        return _copy_entity_attr(cached[1])
     try:
-        with open(rg_path, 'r', encoding='utf-8') as f:
-            rg = json.load(f)
+        rg, index = _load_indexed_graph(rg_path, signature)
         entity = rg['roles'].get(role_name)
         # print(entity)
         if not entity:
             return {}
-        all_attr = parse_entity_attr(entity,role_name)
+        all_attr = parse_entity_attr(entity,role_name,index=index)
         ideas_to_others = entity.get('ideas')
         for other_role,ideas in ideas_to_others.items():
             all_attr[f'idea_to-{other_role}'] = [f"{role_name}对{other_role}想法包括: " + '; '.join(ideas)] if ideas is not None else []
@@ -47,6 +90,7 @@ def get_entity_attr(rg_path,role_name):
                 others_attr = parse_entity_attr(entity,other_role,role_name)
                 all_attr[f'idea_to-{other_role}'].extend(list(itertools.chain(others_attr.values())))
 
+        _entity_attr_cache[cache_key] = (signature, _copy_entity_attr(all_attr))
         return all_attr
 
     except Exception as e:
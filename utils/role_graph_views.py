@@ -0,0 +1,139 @@
+def render_role_attributes(graph, role_name):
+    """Renders a role's attributes into a natural language list."""
+    role_data = graph["roles"][role_name]
+    all_attr = []
+
+    attributes = role_data.get("attributes", {})
+    for attr_name, descriptions in attributes.items():
+        parsed_dict = {}
+        if not descriptions:
+            continue
+        for desc in descriptions:
+            if not desc.get("description", None):
+                continue
+            access = desc.get("access_rights", "unlimited")
+            if isinstance(access, list):
+                access_str = f"对于{', '.join(access)}来说，" if access else ""
+                all_attr.append(access_str + f"{role_name}的{attr_name}包括: " + desc['description'])
+            elif isinstance(access, str):
+                if (not access or access == "unlimited"):
+                    all_attr.append(f"{role_name}的{attr_name}包括: " + desc['description'])
+                else:
+                    if not parsed_dict.get(access, None):
+                        parsed_dict[access] = [desc['description']]
+                    elif isinstance(parsed_dict[access], list):
+                        parsed_dict[access].append(desc['description'])
+
+        for access, descs in parsed_dict.items():
+            all_attr.append(f"对于{access}来说，" + f"{role_name}的{attr_name}包括: " + ";".join(descs))
+
+    return all_attr
+
+
+def render_accessible_descriptions(graph, index, role_name):
+    """Renders the descriptions of other roles that role_name can access."""
+    parsed_list = []
+    for other_role_name in index.candidate_owners(graph, role_name):
+        if other_role_name == role_name:
+            continue
+        attributes = graph["roles"][other_role_name].get("attributes", {})
+        for attr_name, desc_obj in index.candidate_descriptions(role_name, other_role_name, list(attributes)):
+            description = desc_obj.get("description")
+            access_rights = desc_obj.get("access_rights", "unlimited")
+
+            can_access = False
+            if access_rights == "unlimited":
+                can_access = True
+            elif isinstance(access_rights, list) and role_name in access_rights:
+                can_access = True
+
+            if can_access and description:
+                # Include attribute name in the description for clarity
+                parsed_list.append(f"{attr_name}: {description}")
+    return parsed_list
+
+
+def render_ideas(graph, source_role, target_role):
+    """Renders the ideas source_role holds about target_role."""
+    ideas = graph["roles"][source_role].get("ideas", {}).get(target_role, [])
+    return [f"{source_role}对{target_role}的看法 ：" + ";".join(ideas)]
+
+
+class RoleGraphViews:
+    """
+    Materialized parse results of a role graph, cached per role and per role pair.
+
+    Entries are dropped by invalidate(), which works out from an edit and the
+    RoleGraphIndex exactly which roles' views the edit can change. Call it both
+    before and after applying the edit so the audience of the old and the new
+    state is covered. Callers serialize get_*/invalidate with graph writes.
+    """
+
+    def __init__(self, graph, index):
+        self.graph = graph
+        self.index = index
+        self._attributes = {}
+        self._accessible = {}
+        self._ideas = {}
+
+    def reset(self, graph, index):
+        self.graph = graph
+        self.index = index
+        self._attributes.clear()
+        self._accessible.clear()
+        self._ideas.clear()
+
+    def get_attributes(self, role_name):
+        rendered = self._attributes.get(role_name)
+        if rendered is None:
+            rendered = self._attributes[role_name] = render_role_attributes(self.graph, role_name)
+        return rendered
+
+    def get_accessible_descriptions(self, role_name):
+        rendered = self._accessible.get(role_name)
+        if rendered is None:
+            rendered = self._accessible[role_name] = render_accessible_descriptions(self.graph, self.index, role_name)
+        return rendered
+
+    def get_ideas(self, source_role, target_role):
+        key = (source_role, target_role)
+        rendered = self._ideas.get(key)
+        if rendered is None:
+            rendered = self._ideas[key] = render_ideas(self.graph, source_role, target_role)
+        return rendered
+
+    def _invalidate_attribute(self, owner, attr_name):
+        self._attributes.pop(owner, None)
+        viewers, has_open = self.index.attribute_audience(owner, attr_name)
+        if has_open:
+            # Unrestricted descriptions are visible to every other role.
+            for viewer in [v for v in self._accessible if v != owner]:
+                self._accessible.pop(viewer, None)
+        else:
+            for viewer in viewers:
+                if viewer != owner:
+                    self._accessible.pop(viewer, None)
+
+    def invalidate(self, op):
+        """Drops every cached view that the given edit can change."""
+        kind = op.get("op")
+        if kind == "batch":
+            for sub_op in op["ops"]:
+                self.invalidate(sub_op)
+        elif kind == "add_role":
+            self._attributes.pop(op["role"], None)
+            self._accessible.pop(op["role"], None)
+        elif kind == "delete_role":
+            role_name = op["role"]
+            self._attributes.pop(role_name, None)
+            self._accessible.pop(role_name, None)
+            for key in [k for k in self._ideas if role_name in k]:
+                self._ideas.pop(key, None)
+            for attr_name in list(self.graph.get("roles", {}).get(role_name, {}).get("attributes", {})):
+                self._invalidate_attribute(role_name, attr_name)
+            for owner, attr_name in self.index.attributes_naming(role_name):
+                self._invalidate_attribute(owner, attr_name)
+        elif "attribute" in op:
+            self._invalidate_attribute(op.get("role", op.get("target")), op["attribute"])
+        elif kind in ("add_idea", "delete_ideas_to", "delete_idea"):
+            self._ideas.pop((op["source"], op["target"]), None)
@@ -0,0 +1,147 @@
+import json
+import os
+import re
+import threading
+
+SPRITE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif'}
+MANIFEST_NAME = 'sprites.json'
+_TAG_SEPARATORS = re.compile(r'[\s_\-.]+')
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _normalize_tag(tag):
+    return str(tag).strip().lower()
+
+
+class SpriteIndex:
+    """
+    Precomputed emotion tag -> sprite path index for one sprite directory.
+
+    Every image in the directory (recursively) is tagged with the tokens of its file
+    name and of its sub-directory names, e.g. "happy_02.png" -> {"happy", "02"} and
+    "smile/wink.png" -> {"smile", "wink"}. An optional sprites.json manifest adds
+    explicit tags and keyword aliases:
+
+        {
+            "tags": {"happy_02.png": ["joy", "开心"]},
+            "keywords": {"happy": ["开心", "高兴", "哈哈"]},
+            "default": "default.png"
+        }
+
+    Lookups by tag are dict hits; paths keep the directory prefix they were built with.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._tags = {}
+        self._keywords = {}
+        self.default = None
+        self._build()
+
+    def _build(self):
+        manifest = {}
+        manifest_path = os.path.join(self.directory, MANIFEST_NAME)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+
+        for root, dirs, files in os.walk(self.directory):
+            dirs.sort()
+            relative_dir = os.path.relpath(root, self.directory)
+            dir_tags = [] if relative_dir == '.' else _TAG_SEPARATORS.split(relative_dir.replace(os.sep, ' '))
+            for filename in sorted(files):
+                stem, ext = os.path.splitext(filename)
+                if ext.lower() not in SPRITE_EXTENSIONS:
+                    continue
+                path = os.path.join(root, filename)
+                for tag in dir_tags + _TAG_SEPARATORS.split(stem) + [stem]:
+                    self._add(tag, path)
+
+        for name, tags in manifest.get('tags', {}).items():
+            path = os.path.join(self.directory, name)
+            for tag in tags:
+                self._add(tag, path)
+        for tag, keywords in manifest.get('keywords', {}).items():
+            for keyword in keywords:
+                self._keywords[keyword.lower()] = _normalize_tag(tag)
+        if manifest.get('default'):
+            self.default = os.path.join(self.directory, manifest['default'])
+        elif self._tags.get('default'):
+            self.default = self._tags['default'][0]
+
+    def _add(self, tag, path):
+        tag = _normalize_tag(tag)
+        if not tag:
+            return
+        paths = self._tags.setdefault(tag, [])
+        if path not in paths:
+            paths.append(path)
+
+    def __len__(self):
+        return len(self._tags)
+
+    def __contains__(self, tag):
+        return _normalize_tag(tag) in self._tags
+
+    def tags(self):
+        return list(self._tags)
+
+    def get(self, tag):
+        """All sprite paths carrying tag (a copy; empty when unknown)."""
+        return list(self._tags.get(_normalize_tag(tag), ()))
+
+    def lookup(self, *tags, default=True):
+        """
+        Paths of the first tag that has sprites. Falls back to the default sprite
+        (when default is True) and then to an empty list.
+        """
+        for tag in tags:
+            paths = self._tags.get(_normalize_tag(tag))
+            if paths:
+                return list(paths)
+        return [self.default] if default and self.default else []
+
+    def match_text(self, *texts):
+        """
+        Tags whose manifest keywords (or whose own names) occur in any of texts,
+        in order of first appearance.
+        """
+        haystack = "\n".join(text for text in texts if text).lower()
+        hits = []
+        for keyword, tag in list(self._keywords.items()) + [(tag, tag) for tag in self._tags]:
+            if len(keyword) < 2 or keyword.isdigit():
+                continue
+            position = haystack.find(keyword)
+            if position >= 0:
+                hits.append((position, tag))
+        seen = set()
+        return [tag for _, tag in sorted(hits) if not (tag in seen or seen.add(tag))]
+
+
+_index_lock = threading.Lock()
+_indexes = {}
+
+
+def get_sprite_index(directory):
+    """
+    Shared SpriteIndex for directory, rebuilt when the directory's own listing or its
+    manifest changes (checked against their mtimes on every call). Files added inside
+    sub-directories are picked up after the manifest or top-level directory changes.
+    """
+    key = os.path.abspath(directory)
+    signature = (_file_signature(key), _file_signature(os.path.join(key, MANIFEST_NAME)))
+    with _index_lock:
+        entry = _indexes.get(key)
+    if entry is not None and entry[0] == signature:
+        return entry[1]
+    index = SpriteIndex(directory)
+    with _index_lock:
+        _indexes[key] = (signature, index)
+    return index